@@ -0,0 +1,217 @@
+# Engine analysis of many positions in one go, for puzzle generation and
+# post-game review.
+#
+#   pool = BotPool(4, 0, 0, 1 << 16)
+#   for result in analyse_positions(pool, open('positions.txt'), time_ms=500):
+#       ...
+#
+# Each item is a FEN string, or an object (a dict, or a JSON text of one)
+# with either 'fen' or 'board' (the 8x8 list of piece names the routes use)
+# and 'turn'. An object may also carry an 'id', which is copied to its
+# result, and its own time_ms, node_limit, max_depth and difficulty.
+#
+# Items are searched on the pool's workers, two per worker at a time by
+# default, and results come back in the order they finish, each with
+# the item's 'index' in the input. The next item is only read once a result
+# has been taken, so the input can be a file of any size and a slow reader
+# of the results slows the reading down instead of piling results up.
+#
+#   python analysis.py [FILE ...] [--workers N] [--time-ms MS] > results.ndjson
+#
+# reads one item per line from the files (or stdin) and writes one JSON
+# result per line.
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from position import Position, COLOR_NAMES
+from movegen import generate_legal, in_check
+from evaluate import evaluate_board, DIFFICULTY_TABLES, DEFAULT_DIFFICULTY
+from notation import move_to_uci, move_to_san
+from search import MATE, MATE_BOUND
+from tablebase import DEFAULT_DIRECTORY as DEFAULT_TABLEBASES
+from bot_pool import BotPool, run_search
+
+DEFAULT_LIMITS = {'time_ms': 1000, 'node_limit': None, 'max_depth': 64, 'difficulty': DEFAULT_DIFFICULTY}
+
+
+def read_limits(source, defaults, max_time_ms=None):
+    # The search limits given in source (an item or the query string), with
+    # defaults for the rest. max_time_ms caps the time and stands in for
+    # "no limit"; without it a time of 0 means no time limit, and then there
+    # has to be a node limit. Raises ValueError on bad values.
+    limits = dict(defaults)
+    try:
+        for name in ('time_ms', 'node_limit', 'max_depth'):
+            if source.get(name) not in (None, ''):
+                limits[name] = int(source[name])
+    except (TypeError, ValueError):
+        raise ValueError('Invalid search limits')
+    limits['difficulty'] = source.get('difficulty') or limits['difficulty']
+    if limits['difficulty'] not in DIFFICULTY_TABLES:
+        raise ValueError('Unknown difficulty')
+    time_ms, node_limit = limits['time_ms'], limits['node_limit']
+    if (time_ms is not None and time_ms < 0) or (node_limit is not None and node_limit < 1):
+        raise ValueError('Invalid search limits')
+    if max_time_ms:
+        limits['time_ms'] = min(time_ms, max_time_ms) if time_ms else max_time_ms
+    elif not time_ms and not node_limit:
+        raise ValueError('A time or node limit is needed')
+    limits['max_depth'] = max(1, min(limits['max_depth'], DEFAULT_LIMITS['max_depth']))
+    return limits
+
+
+def parse_item(item, defaults, max_time_ms=None):
+    # (FEN, id, limits) of one input item; raises ValueError
+    if isinstance(item, bytes):
+        item = item.decode('utf-8', 'replace')
+    if isinstance(item, str):
+        item = item.strip()
+        try:
+            item = json.loads(item) if item.startswith('{') else {'fen': item}
+        except ValueError:
+            raise ValueError('Invalid JSON')
+    if not isinstance(item, dict):
+        raise ValueError('Expected a FEN or an object with a fen or a board')
+    if item.get('fen'):
+        fen = Position.from_fen(item['fen']).to_fen()
+    elif item.get('board'):
+        turn = item.get('turn', 'white')
+        if turn not in COLOR_NAMES:
+            raise ValueError('Invalid turn')
+        try:
+            fen = Position.from_board(item['board'], turn).to_fen()
+        except (AttributeError, TypeError, IndexError, KeyError, ValueError):
+            raise ValueError('Invalid board')
+    else:
+        raise ValueError('Expected a FEN or an object with a fen or a board')
+    return fen, item.get('id'), read_limits(item, defaults, max_time_ms)
+
+
+def analyse_fen(fen, time_ms, node_limit, max_depth, difficulty):
+    # Runs on a pool worker: the search of one position and what it found.
+    # Scores are centipawns for the side to move; 'mate' is the number of
+    # moves to mate, negative when the side to move is getting mated.
+    search = run_search(fen, time_ms, node_limit, max_depth, difficulty)
+    position = Position.from_fen(fen)
+    move = search['move']
+    score = search['score']
+    result = {
+        'fen': fen,
+        'best_move': move_to_uci(move) if move is not None else None,
+        'san': move_to_san(position, move) if move is not None else None,
+        'score': score,
+        'mate': None,
+        'eval': evaluate_board(position, position.turn, DIFFICULTY_TABLES[difficulty]),
+        'depth': search['depth'],
+        'nodes': search['nodes'],
+        'time_ms': search['time_ms'],
+    }
+    if score is not None and abs(score) > MATE_BOUND:
+        plies = MATE - abs(score)
+        result['score'] = None
+        result['mate'] = (plies + 1) // 2 if score > 0 else -(plies // 2)
+    if move is None and not generate_legal(position):
+        result['reason'] = 'checkmate' if in_check(position, position.turn) else 'stalemate'
+    return result
+
+
+def analyse_positions(pool, items, defaults=None, max_time_ms=None, in_flight=None, **limits):
+    # Generator of the results for items (see above) in the order they
+    # finish. Limits not given per item come from limits, then defaults,
+    # then DEFAULT_LIMITS. At most in_flight items (two per worker by
+    # default) are queued on the pool at once. An item that can't be read
+    # gets a result with an 'error' instead.
+    defaults = read_limits(limits, defaults or DEFAULT_LIMITS, max_time_ms)
+    in_flight = in_flight or 2 * max(1, pool.workers)
+    items = enumerate(items)
+    pending = {}  # future -> (index, id)
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < in_flight:
+                try:
+                    index, item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                try:
+                    fen, item_id, item_limits = parse_item(item, defaults, max_time_ms)
+                except ValueError as e:
+                    yield {'index': index, 'error': str(e)}
+                    continue
+                future = pool.run(analyse_fen, fen, item_limits['time_ms'], item_limits['node_limit'],
+                                  item_limits['max_depth'], item_limits['difficulty'])
+                pending[future] = (index, item_id)
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, item_id = pending.pop(future)
+                result = {'index': index}
+                if item_id is not None:
+                    result['id'] = item_id
+                try:
+                    result.update(future.result())
+                except Exception as e:
+                    result['error'] = 'Analysis failed: %s' % e
+                yield result
+    finally:
+        # The caller stopped reading: drop what hasn't started
+        for future in pending:
+            future.cancel()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Analyse positions, one FEN or JSON object per line')
+    parser.add_argument('files', nargs='*', help='input files (default: stdin)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='search processes, 0 to search in this one (default: one per CPU)')
+    parser.add_argument('--time-ms', type=int, default=DEFAULT_LIMITS['time_ms'],
+                        help='time per position, 0 for none with --node-limit (default %(default)s)')
+    parser.add_argument('--node-limit', type=int, default=None, help='nodes per position')
+    parser.add_argument('--depth', type=int, default=DEFAULT_LIMITS['max_depth'], help='deepest iteration')
+    parser.add_argument('--difficulty', default=DEFAULT_DIFFICULTY, choices=sorted(DIFFICULTY_TABLES))
+    parser.add_argument('--tt-size', type=int, default=1 << 16, help='transposition table entries per worker')
+    parser.add_argument('--tablebases', default=DEFAULT_TABLEBASES, help='tablebase directory, empty for none')
+    args = parser.parse_args(argv)
+
+    def lines():
+        for path in args.files or ['-']:
+            f = sys.stdin if path == '-' else open(path)
+            try:
+                for line in f:
+                    if line.strip():
+                        yield line
+            finally:
+                if f is not sys.stdin:
+                    f.close()
+
+    limits = {'time_ms': args.time_ms, 'node_limit': args.node_limit, 'max_depth': args.depth,
+              'difficulty': args.difficulty}
+    try:
+        read_limits(limits, DEFAULT_LIMITS)
+    except ValueError as e:
+        parser.error(str(e))
+
+    pool = BotPool(args.workers, 0, 0, args.tt_size, tablebase_path=args.tablebases or None)
+    count = 0
+    start = time.perf_counter()
+    try:
+        for result in analyse_positions(pool, lines(), **limits):
+            sys.stdout.write(json.dumps(result, separators=(',', ':')) + '\n')
+            count += 1
+    finally:
+        pool.shutdown()
+    seconds = time.perf_counter() - start
+    print('%d positions in %.1f s, %.1f positions/s' % (count, seconds, count / seconds if seconds else 0),
+          file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
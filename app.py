@@ -1,584 +1,550 @@
-from flask import Flask, render_template, request, jsonify
-import copy
-app = Flask(__name__)
-
-# Store ongoing games
-games = {}
-
-class ChessGame:
-    def __init__(self):
-        self.board = self.initialize_board()
-        self.turn = 'white'
-        self.move_history = []
-        self.en_passant_target = None  # Track en passant target square
-        self.castling_rights = {'white': {'king_side': True, 'queen_side': True}, 
-                                'black': {'king_side': True, 'queen_side': True}}
-        self.captured_pieces = {'white': [], 'black': []}  # Store captured pieces
-        self.game_over = False  # Track whether the game is over
-        self.winner = None 
-        self.move_history.append((copy.deepcopy(self.board), self.turn))
-    
-    def initialize_board(self):
-        board = [
-            ['black rook', 'black knight', 'black bishop', 'black queen', 'black king', 'black bishop', 'black knight', 'black rook'],
-            ['black pawn', 'black pawn', 'black pawn', 'black pawn', 'black pawn', 'black pawn', 'black pawn', 'black pawn'],
-            ['', '', '', '', '', '', '', ''],
-            ['', '', '', '', '', '', '', ''],
-            ['', '', '', '', '', '', '', ''],
-            ['', '', '', '', '', '', '', ''],
-            ['white pawn', 'white pawn', 'white pawn', 'white pawn', 'white pawn', 'white pawn', 'white pawn', 'white pawn'],
-            ['white rook', 'white knight', 'white bishop', 'white queen', 'white king', 'white bishop', 'white knight', 'white rook']
-        ]
-        return board
-
-    def get_board(self):
-        return self.board
-
-    def validate_move(self, start_pos, end_pos):
-        if self.game_over:
-            return False  # No moves allowed if the game is over
-
-        piece = self.board[start_pos[0]][start_pos[1]]
-        legal_moves = self.get_legal_moves(start_pos[0], start_pos[1])
-        if end_pos not in legal_moves:
-            return False
-        
-        # Make the move temporarily
-        temp_board = copy.deepcopy(self.board)
-        temp_board[end_pos[0]][end_pos[1]] = piece
-        temp_board[start_pos[0]][start_pos[1]] = ''
-
-        # Check if the king is still in check after the move
-        if self.is_in_check(self.turn, temp_board):
-            return False
-
-        return True
-
-    def make_move(self, start_pos, end_pos):
-        start_pos = [int(start_pos[0]), int(start_pos[1])]
-        end_pos = [int(end_pos[0]), int(end_pos[1])]
-
-        if self.validate_move(start_pos, end_pos):
-            piece = self.board[start_pos[0]][start_pos[1]]
-            target_piece = self.board[end_pos[0]][end_pos[1]]
-
-            # Capture the target piece
-            if target_piece:
-                captured_color = 'black' if 'white' in target_piece else 'white'
-                self.captured_pieces[captured_color].append(target_piece)
-
-            self.board[end_pos[0]][end_pos[1]] = piece
-            self.board[start_pos[0]][start_pos[1]] = ''
-
-            # Handle pawn promotion
-            if 'pawn' in piece and (end_pos[0] == 0 or end_pos[0] == 7):
-                self.board[end_pos[0]][end_pos[1]] = piece.replace('pawn', 'queen')  # Auto-promote to queen for now
-
-            # Handle en passant
-            if 'pawn' in piece:
-                if abs(start_pos[0] - end_pos[0]) == 2:
-                    self.en_passant_target = [(start_pos[0] + end_pos[0]) // 2, start_pos[1]]
-                elif end_pos == self.en_passant_target:
-                    captured_pawn_row = start_pos[0]
-                    captured_pawn_col = end_pos[1]
-                    self.board[captured_pawn_row][captured_pawn_col] = ''
-                else:
-                    self.en_passant_target = None
-            else:
-                self.en_passant_target = None
-
-            # Handle castling
-            if piece == 'white king' and start_pos == [7, 4]:
-                if end_pos == [7, 6]:  # King-side castling
-                    if self.castling_rights['white']['king_side']:
-                        self.board[7][7] = ''
-                        self.board[7][5] = 'white rook'
-                        self.castling_rights['white']['king_side'] = False
-                        self.castling_rights['white']['queen_side'] = False
-                elif end_pos == [7, 2]:  # Queen-side castling
-                    if self.castling_rights['white']['queen_side']:
-                        self.board[7][0] = ''
-                        self.board[7][3] = 'white rook'
-                        self.castling_rights['white']['king_side'] = False
-                        self.castling_rights['white']['queen_side'] = False
-            elif piece == 'black king' and start_pos == [0, 4]:
-                if end_pos == [0, 6]:  # King-side castling
-                    if self.castling_rights['black']['king_side']:
-                        self.board[0][7] = ''
-                        self.board[0][5] = 'black rook'
-                        self.castling_rights['black']['king_side'] = False
-                        self.castling_rights['black']['queen_side'] = False
-                elif end_pos == [0, 2]:  # Queen-side castling
-                    if self.castling_rights['black']['queen_side']:
-                        self.board[0][0] = ''
-                        self.board[0][3] = 'black rook'
-                        self.castling_rights['black']['king_side'] = False
-                        self.castling_rights['black']['queen_side'] = False
-
-            # Update turn
-            self.turn = 'black' if self.turn == 'white' else 'white'
-            self.move_history.append((copy.deepcopy(self.board), self.turn))
-            
-            # Check for endgame conditions
-            if self.is_checkmate():
-                return True
-            if self.is_stalemate():
-                return True
-
-            return True
-        return False
-
-    def get_legal_moves(self, row, col):
-        piece = self.board[row][col]
-        all_moves = self.get_possible_moves_without_check(row, col)
-        print(all_moves)
-        valid_moves = []
-        for move in all_moves:
-            temp_board = copy.deepcopy(self.board)  # Deep copy only here
-            temp_board[move[0]][move[1]] = piece
-            temp_board[row][col] = ''
-            if not self.is_in_check(self.turn, temp_board):
-                valid_moves.append(move)
-    
-        return valid_moves
-    
-    def get_pawn_moves(self, row, col, piece):
-        moves = []
-        direction = -1 if 'white' in piece else 1
-        start_row = 6 if 'white' in piece else 1
-
-        # Move forward
-        if self.board[row + direction][col] == '':
-            moves.append([row + direction, col])
-            if row == start_row and self.board[row + 2 * direction][col] == '':
-                moves.append([row + 2 * direction, col])
-
-        # Capture diagonally
-        for offset in [-1, 1]:
-            new_col = col + offset
-            if 0 <= new_col < 8 and self.board[row + direction][new_col]:
-                if 'white' not in self.board[row + direction][new_col] if 'white' in piece else 'white' in self.board[row + direction][new_col]:
-                    moves.append([row + direction, new_col])
-
-        # Handle en passant
-        if self.en_passant_target:
-            if [row + direction, col + 1] == self.en_passant_target or [row + direction, col - 1] == self.en_passant_target:
-                moves.append(self.en_passant_target)
-
-        return moves
-
-    def get_rook_moves(self, row, col):
-        return self.get_straight_line_moves(row, col, directions=[(1, 0), (-1, 0), (0, 1), (0, -1)])
-
-    def get_bishop_moves(self, row, col):
-        return self.get_straight_line_moves(row, col, directions=[(1, 1), (-1, -1), (1, -1), (-1, 1)])
-
-    def get_queen_moves(self, row, col):
-        return self.get_rook_moves(row, col) + self.get_bishop_moves(row, col)
-
-    def get_knight_moves(self, row, col):
-        moves = []
-        possible_moves = [(2, 1), (2, -1), (-2, 1), (-2, -1), (1, 2), (1, -2), (-1, 2), (-1, -2)]
-        for dx, dy in possible_moves:
-            new_row = row + dx
-            new_col = col + dy
-            if 0 <= new_row < 8 and 0 <= new_col < 8:
-                if not self.board[new_row][new_col] or ('white' not in self.board[new_row][new_col] if 'white' in self.board[row][col] else 'white' in self.board[new_row][new_col]):
-                    moves.append([new_row, new_col])
-        return moves
-
-    def get_king_moves(self, row, col, piece):
-        moves = []
-        king_moves = [(1, 0), (1, 1), (1, -1), (0, 1), (0, -1), (-1, 0), (-1, 1), (-1, -1)]
-        for move in king_moves:
-            new_row = row + move[0]
-            new_col = col + move[1]
-            if 0 <= new_row < 8 and 0 <= new_col < 8:
-                if not self.board[new_row][new_col] or 'white' not in self.board[new_row][new_col] if 'white' in piece else 'white' in self.board[new_row][new_col]:
-                    moves.append([new_row, new_col])
-
-        # Handle castling
-        if piece == 'white king' and row == 7 and col == 4:
-            if self.castling_rights['white']['king_side'] and self.board[7][5] == '' and self.board[7][6] == '':
-                moves.append([7, 6])
-            if self.castling_rights['white']['queen_side'] and self.board[7][3] == '' and self.board[7][2] == '' and self.board[7][1] == '':
-                moves.append([7, 2])
-        elif piece == 'black king' and row == 0 and col == 4:
-            if self.castling_rights['black']['king_side'] and self.board[0][5] == '' and self.board[0][6] == '':
-                moves.append([0, 6])
-            if self.castling_rights['black']['queen_side'] and self.board[0][3] == '' and self.board[0][2] == '' and self.board[0][1] == '':
-                moves.append([0, 2])
-
-        return moves
-
-    def get_straight_line_moves(self, row, col, directions):
-        moves = []
-        for direction in directions:
-            for i in range(1, 8):
-                new_row = row + direction[0] * i
-                new_col = col + direction[1] * i
-                if 0 <= new_row < 8 and 0 <= new_col < 8:
-                    if self.board[new_row][new_col]:
-                        if 'white' not in self.board[new_row][new_col] if 'white' in self.board[row][col] else 'white' in self.board[new_row][new_col]:
-                            moves.append([new_row, new_col])
-                        break
-                    moves.append([new_row, new_col])
-                else:
-                    break
-        return moves
-
-    def is_in_check(self, color, board):
-        king_pos = self.find_king(color, board)
-
-        if king_pos:
-            opponent_color = 'white' if color == 'black' else 'black'
-            for row in range(8):
-                for col in range(8):
-                    if opponent_color in board[row][col]:
-                    # Check if the king is in the possible moves of an opponent's piece
-                        if king_pos in self.get_possible_moves_without_check(row, col):
-                            print(color,'king is in check')
-                            return True
-        return False
-    
-    def find_king(self, color, board):
-        king = color + ' king'
-        for row in range(8):
-            for col in range(8):
-                if board[row][col] == king:
-                    return [row, col]
-        return None
-
-    def is_checkmate(self):
-        if not self.is_in_check(self.turn, self.board):
-            return False
-
-        for row in range(8):
-            for col in range(8):
-                if self.turn in self.board[row][col]:
-                    legal_moves = self.get_legal_moves(row, col)
-                    print('checking checkmate and it should above it []')
-                    if len(legal_moves)!=0:
-                        for move in legal_moves:
-                            temp_board = copy.deepcopy(self.board)
-                            temp_board[move[0]][move[1]] = self.board[row][col]
-                            temp_board[row][col] = ''
-                            if not self.is_in_check(self.turn, temp_board):
-                                return False
-                    else:
-                        self.game_over = True
-                        self.winner = 'black' if self.turn == 'white' else 'white'
-                        return True
-
-    def is_stalemate(self):
-        if self.is_in_check(self.turn, self.board):
-            return False
-
-        for row in range(8):
-            for col in range(8):
-                if self.turn in self.board[row][col]:
-                    legal_moves = self.get_legal_moves(row, col)
-                    if legal_moves:
-                        return False
-
-        self.game_over = True
-        self.winner = 'draw'
-        return True
-
-    def get_possible_moves_without_check(self, row, col):
-        piece = self.board[row][col]
-        legal_moves = []
-
-        if 'pawn' in piece:
-            legal_moves = self.get_pawn_moves(row, col, piece)
-        elif 'rook' in piece:
-            legal_moves = self.get_rook_moves(row, col)
-        elif 'knight' in piece:
-            legal_moves = self.get_knight_moves(row, col)
-        elif 'bishop' in piece:
-            legal_moves = self.get_bishop_moves(row, col)
-        elif 'queen' in piece:
-            legal_moves = self.get_rook_moves(row, col) + self.get_bishop_moves(row, col)
-        elif 'king' in piece:
-            legal_moves = self.get_king_moves(row, col, piece)
-
-        return legal_moves
-    
-    def undo_move(self):
-        if not self.move_history:
-            return False  # No move to undo
-
-        # Remove the last move and revert to the previous state
-        self.move_history.pop()
-        last_board_state, last_turn = self.move_history[-1] if self.move_history else (self.initialize_board(), 'white')
-        self.board = last_board_state
-        # self.current_turn = last_turn
-        self.turn=last_turn
-        return True
-    
-    def restart_game(self):
-        self.board = self.initialize_board()
-        self.turn = 'white'
-        self.move_history = []
-        self.en_passant_target = None
-        self.castling_rights = {'white': {'king_side': True, 'queen_side': True}, 
-                            'black': {'king_side': True, 'queen_side': True}}
-        self.captured_pieces = {'white': [], 'black': []}
-        self.game_over = False
-        self.winner = None
-
-@app.route('/')
-def index():
-    return render_template('index.html')
-
-@app.route('/1vs1')
-def vs1():
-    return render_template('1vs1.html')
-
-@app.route('/1vsbot')
-def vsbot():
-    return render_template('1vsbot.html')
-
-@app.route('/start_game', methods=['POST'])
-def start_game():
-    game_id = request.json.get('game_id')
-    games[game_id] = ChessGame()
-    return jsonify({'status': 'game started', 'game_id': game_id})
-
-@app.route('/move', methods=['POST'])
-def move():
-    data = request.json
-    game_id = data['game_id']
-    start_pos = data['start']
-    end_pos = data['end']
-
-    game = games.get(game_id)
-    if not game:
-        return jsonify({'error': 'Game not found'}), 404
-
-    if game.game_over:
-        return jsonify({
-            'status': 'game over',
-            'board': game.get_board(),
-            'turn': game.turn,
-            'game_over': game.game_over,
-            'winner': game.winner,
-            'captured':game.captured_pieces
-        })
-
-    move_result = game.make_move(start_pos, end_pos)
-
-    if move_result:
-        return jsonify({
-            'status': 'move made',
-            'board': game.get_board(),
-            'turn': game.turn,
-            'game_over': game.game_over,
-            'winner': game.winner,
-            'captured':game.captured_pieces
-        })
-    else:
-        # Add debugging information
-        return jsonify({
-            'status': 'invalid move',
-            'board': game.get_board(),
-            'turn': game.turn
-        })
-
-@app.route('/board/<game_id>', methods=['GET'])
-def get_board(game_id):
-    game = games.get(game_id)
-    if not game:
-        return jsonify({'error': 'Game not found'}), 404
-
-    return jsonify({
-        'board': game.get_board(),
-        'turn': game.turn,
-        'game_over': game.game_over,
-        'winner': game.winner
-    })
-
-@app.route('/legal_moves', methods=['POST'])
-def legal_moves():
-    data = request.json
-    game_id = data['game_id']
-    row = int(data['row'])
-    col = int(data['col'])
-
-    game = games.get(game_id)
-    if not game:
-        return jsonify({'error': 'Game not found'}), 404
-
-    legal_moves = game.get_legal_moves(row, col)
-    return jsonify({'legal_moves':legal_moves})
-
-@app.route('/captured_pieces/<game_id>', methods=['GET'])
-def get_captured_pieces(game_id):
-    game = games.get(game_id)
-    if not game:
-        return jsonify({'error': 'Game not found'}), 404
-
-    return jsonify({'captured': game.captured_pieces})
-
-@app.route('/restart', methods=['POST'])
-def restart():
-    data = request.json
-    game_id = data.get('game_id')
-    game = games.get(game_id)
-    if not game:
-        return jsonify({'error': 'Game not found'}), 404
-
-    game.restart_game()
-    return jsonify({'status': 'success', 'message': 'Game restarted'})
-
-@app.route('/undo', methods=['POST'])
-def undo():
-    data = request.json
-    game_id = data.get('game_id')
-    game = games.get(game_id)
-    if not game:
-        return jsonify({'error': 'Game not found'}), 404
-    # print(game.board)
-    success = game.undo_move()
-    # print(game.board)
-    if success:
-        return jsonify({'status': 'success', 'message': 'Move undone', 'board': game.board, 'turn': game.turn})
-    else:
-        return jsonify({'status': 'error', 'message': 'No moves to undo'})
-
-@app.route('/bot_move', methods=['POST'])
-def bot_move():
-    data = request.json
-    game_id = data['game_id']
-
-    game = games.get(game_id)
-    if not game:
-        return jsonify({'error': 'Game not found'}), 404
-
-    if game.game_over:
-        return jsonify({
-            'status': 'game over',
-            'board': game.get_board(),
-            'turn': game.turn,
-            'game_over': game.game_over,
-            'winner': game.winner,
-            'captured':game.captured_pieces
-        })
-
-    # Simulate bot move (implement bot logic here)
-    move= get_bot_move(game)  # You need to define this method
-    bot_start, bot_end =move['start'],move['end']
-    move_result = game.make_move(bot_start, bot_end)
-
-    if move_result:
-        return jsonify({
-            'status': 'move made',
-            'board': game.get_board(),
-            'turn': game.turn,
-            'game_over': game.game_over,
-            'winner': game.winner,
-            'captured':game.captured_pieces
-        })
-    else:
-        return jsonify({
-            'status': 'bot move invalid',
-            'board': game.get_board(),
-            'turn': game.turn
-        })
-
-# def get_bot_move(game):
-#     """
-#     Generate a move for the bot.
-#     This simple implementation randomly selects a legal move.
-#     """
-
-#     all_legal_moves = []
-
-#     for row in range(8):
-#         for col in range(8):
-#             piece = game.board[row][col]
-#             if piece and piece.startswith(game.turn):  # Check if the piece belongs to the current player (bot)
-#                 legal_moves = game.get_legal_moves(row, col)
-#                 if legal_moves:
-#                     for move in legal_moves:
-#                         all_legal_moves.append(((row, col), move))
-
-#     if not all_legal_moves:
-#         return None, None  # No legal moves available, should not happen in a valid game state
-
-#     selected_move = random.choice(all_legal_moves)
-#     start_pos, end_pos = selected_move
-
-#     return start_pos, end_pos
-def evaluate_board(board, color):
-    # Basic evaluation function based on piece values
-    piece_values = {'pawn': 1, 'knight': 3, 'bishop': 3, 'rook': 5, 'queen': 9, 'king': 0}
-    value = 0
-    for row in board:
-        for cell in row:
-            if color in cell:
-                piece_type = cell.split(' ')[1]
-                value += piece_values.get(piece_type, 0)
-            elif cell and color not in cell:
-                piece_type = cell.split(' ')[1]
-                value -= piece_values.get(piece_type, 0)
-    return value
-
-def minimax(game, depth, is_maximizing, alpha, beta):
-    if depth == 0 or game.game_over:
-        return evaluate_board(game.get_board(), game.turn)
-
-    if is_maximizing:
-        max_eval = float('-inf')
-        for move in get_all_possible_moves(game, game.turn):
-            game_copy = copy.deepcopy(game)
-            game_copy.make_move(move['start'], move['end'])
-            eval = minimax(game_copy, depth - 1, False, alpha, beta)
-            max_eval = max(max_eval, eval)
-            alpha = max(alpha, eval)
-            if beta <= alpha:
-                break
-        return max_eval
-    else:
-        min_eval = float('inf')
-        for move in get_all_possible_moves(game, 'black' if game.turn == 'white' else 'white'):
-            game_copy = copy.deepcopy(game)
-            game_copy.make_move(move['start'], move['end'])
-            eval = minimax(game_copy, depth - 1, True, alpha, beta)
-            min_eval = min(min_eval, eval)
-            beta = min(beta, eval)
-            if beta <= alpha:
-                break
-        return min_eval
-
-def get_best_move(game, depth):
-    best_move = None
-    best_value = float('-inf')
-    for move in get_all_possible_moves(game, game.turn):
-        game_copy = copy.deepcopy(game)
-        game_copy.make_move(move['start'], move['end'])
-        move_value = minimax(game_copy, depth - 1, False, float('-inf'), float('inf'))
-        if move_value > best_value:
-            best_value = move_value
-            best_move = move
-    return best_move
-
-def get_all_possible_moves(game, color):
-    moves = []
-    for row in range(8):
-        for col in range(8):
-            if color in game.get_board()[row][col]:
-                legal_moves = game.get_legal_moves(row, col)
-                for move in legal_moves:
-                    moves.append({'start': [row, col], 'end': move})
-    return moves
-
-def get_bot_move(game):
-    # Use a depth of 3 for the minimax algorithm
-    best_move = get_best_move(game, depth=3)
-    return best_move
-
-
-if __name__ == '__main__':
-    app.run(debug=True)
-
+from flask import Flask, render_template, request, jsonify, g
+import os
+import json
+import threading
+import time
+from array import array
+from position import row_col
+from evaluate import DIFFICULTY_TABLES, DEFAULT_DIFFICULTY
+from notation import export_pgn
+from chess_game import ChessGame
+from game_store import GameStore, GameConflict, open_backend
+from bot_pool import BotPool, QueueFull
+from book import DEFAULT_BOOK, open_book
+from tablebase import DEFAULT_DIRECTORY as DEFAULT_TABLEBASES
+from game_events import GameEvents
+from analysis import DEFAULT_LIMITS as ANALYSIS_LIMITS, analyse_positions, read_limits
+import metrics
+app = Flask(__name__)
+
+# Transposition table entries per bot worker and difficulty (16 bytes each)
+TT_SIZE = int(os.environ.get('CHESS_TT_SIZE', 1 << 16))
+# Default and largest time budget for one /bot_move search
+BOT_TIME_MS = int(os.environ.get('CHESS_BOT_TIME_MS', 1000))
+BOT_MAX_TIME_MS = int(os.environ.get('CHESS_BOT_MAX_TIME_MS', 10000))
+BOT_MAX_DEPTH = 64
+# Bot search processes (0 searches in the request thread), how many searches
+# may wait or run at once, and how long a job may take before it is given up
+BOT_WORKERS = int(os.environ.get('CHESS_BOT_WORKERS', os.cpu_count() or 1))
+BOT_QUEUE = int(os.environ.get('CHESS_BOT_QUEUE', 64))
+BOT_JOB_TIMEOUT_MS = int(os.environ.get('CHESS_BOT_JOB_TIMEOUT_MS', BOT_MAX_TIME_MS + 5000))
+# Longest wait a client may ask for when polling a bot job
+BOT_MAX_WAIT_SECONDS = 30
+# Workers that search one bot move together, by difficulty; a request can
+# ask for a different number with 'search_workers'
+SEARCH_WORKERS = {
+    'easy': 1,
+    'hard': int(os.environ.get('CHESS_HARD_SEARCH_WORKERS', min(4, BOT_WORKERS) or 1)),
+}
+# Opening book the bot plays from before it starts searching; set it empty
+# to have the bot search every move
+BOOK_PATH = os.environ.get('CHESS_BOOK', DEFAULT_BOOK)
+# Directory of endgame tables (python tablebase.py generate); set it empty to
+# search those endings instead
+TABLEBASE_PATH = os.environ.get('CHESS_TABLEBASES', DEFAULT_TABLEBASES)
+# Where games live: memory, fakeredis, sqlite:///path.db or redis://host:port/db.
+# Use a shared store (sqlite or redis) when running several worker processes.
+GAME_STORE = os.environ.get('CHESS_GAME_STORE', 'memory')
+MAX_LIVE_GAMES = int(os.environ.get('CHESS_MAX_LIVE_GAMES', 1000))
+GAME_IDLE_SECONDS = int(os.environ.get('CHESS_GAME_IDLE_SECONDS', 1800))
+GAME_TTL_SECONDS = int(os.environ.get('CHESS_GAME_TTL_SECONDS', 7 * 24 * 3600))
+SHARED_GAME_STORE = os.environ.get('CHESS_SHARED_GAME_STORE', '0') == '1'
+# How often an event stream re-reads its game: often with a shared store,
+# where other processes change games without this one hearing of it
+EVENT_POLL_SECONDS = 1 if SHARED_GAME_STORE else 15
+# Batch analyses (/analyse) that may run at once; each keeps up to one position
+# per bot worker queued, so bot moves still get a turn in between
+ANALYSIS_BATCHES = int(os.environ.get('CHESS_ANALYSIS_BATCHES', 2))
+# Counters and latency histograms served at /metrics; set to 0 to turn them off
+METRICS_ENABLED = os.environ.get('CHESS_METRICS', '1') == '1'
+# Lets a request ask for a sampling profile of itself with ?profile=1; the
+# response's X-Profile-Id header names it at /profiles/<id>. Off by default.
+PROFILING_ENABLED = os.environ.get('CHESS_PROFILING', '0') == '1'
+PROFILE_INTERVAL_MS = float(os.environ.get('CHESS_PROFILE_INTERVAL_MS', 1))
+
+metrics.enabled = METRICS_ENABLED
+REQUESTS = metrics.counter('chess_http_requests_total', 'Requests served by endpoint and status',
+                           ('endpoint', 'status'))
+REQUEST_SECONDS = metrics.histogram('chess_http_request_seconds', 'Time to build each response by endpoint '
+                                    '(to the first byte for event streams)', ('endpoint',))
+ANALYSED = metrics.counter('chess_analysis_positions_total', 'Positions analysed through /analyse')
+
+# Store ongoing games: recently used ones live, idle ones as snapshots
+games = GameStore(open_backend(GAME_STORE, GAME_TTL_SECONDS),
+                  lambda game: game.to_snapshot(),
+                  lambda data: ChessGame.from_snapshot(data),
+                  MAX_LIVE_GAMES, GAME_IDLE_SECONDS, SHARED_GAME_STORE)
+
+bot_pool = BotPool(BOT_WORKERS, BOT_QUEUE, BOT_JOB_TIMEOUT_MS, TT_SIZE, open_book(BOOK_PATH), TABLEBASE_PATH)
+
+# Pushes game changes to the clients watching them
+events = GameEvents()
+
+profiles = metrics.ProfileStore()
+
+analysis_slots = threading.BoundedSemaphore(ANALYSIS_BATCHES)
+
+metrics.reading('chess_live_games', 'Games held live in this process', lambda: len(games))
+metrics.reading('chess_game_evictions_total', 'Live games moved out to snapshots', lambda: games.evictions,
+                'counter')
+metrics.reading('chess_bot_jobs_pending', 'Bot jobs waiting or running', lambda: bot_pool.pending)
+metrics.reading('chess_event_streams', 'Open event streams',
+                lambda: sum(channel.listeners for channel in list(events.channels.values())))
+
+
+def _start_request():
+    g.request_start = time.perf_counter()
+    if PROFILING_ENABLED and request.args.get('profile'):
+        g.profiler = metrics.SamplingProfiler(interval=PROFILE_INTERVAL_MS / 1000.0).start()
+
+def _finish_request(response):
+    # Runs once the response is built; a streamed body is sent after this
+    endpoint = request.endpoint or 'unmatched'
+    REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, endpoint)
+    REQUESTS.inc(endpoint, response.status_code)
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        response.headers['X-Profile-Id'] = profiles.add(profiler.stop().collapsed())
+    return response
+
+# Only hook requests when something uses the hooks
+if METRICS_ENABLED or PROFILING_ENABLED:
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+
+@app.route('/metrics')
+def get_metrics():
+    # Prometheus text format, for this process only
+    if not METRICS_ENABLED:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/profiles/<profile_id>')
+def get_profile(profile_id):
+    # A profile taken with ?profile=1 as collapsed stacks ('frame;frame;... samples'
+    # per line), which flamegraph.pl and speedscope read. Bot searches run in
+    # worker processes and show up here as waiting, unless CHESS_BOT_WORKERS=0.
+    profile = profiles.get(profile_id) if PROFILING_ENABLED else None
+    if profile is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    return app.response_class(profile, mimetype='text/plain')
+
+@app.route('/')
+def index():
+    return render_template('index.html')
+
+@app.route('/1vs1')
+def vs1():
+    return render_template('1vs1.html')
+
+@app.route('/1vsbot')
+def vsbot():
+    return render_template('1vsbot.html')
+
+@app.route('/start_game', methods=['POST'])
+def start_game():
+    game_id = request.json.get('game_id')
+    difficulty = request.json.get('difficulty', DEFAULT_DIFFICULTY)
+    if difficulty not in DIFFICULTY_TABLES:
+        return jsonify({'error': 'Unknown difficulty'}), 400
+    # Optionally start from a FEN position or replay a PGN game
+    fen = request.json.get('fen')
+    pgn = request.json.get('pgn')
+    try:
+        if pgn:
+            game = ChessGame.from_pgn(pgn, difficulty)
+        else:
+            game = ChessGame(difficulty, fen)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    games[game_id] = game
+    events.publish(game_id, game.view)
+    view = game.view
+    return jsonify({
+        'status': 'game started',
+        'game_id': game_id,
+        'board': view.board,
+        'turn': view.turn,
+        'fen': view.fen,
+        'game_over': view.game_over,
+        'winner': view.winner,
+        'reason': view.reason
+    })
+
+def _changed(game_id, game):
+    # After a request changes a game: write it back if the store is shared
+    # and push the change to the game's watchers
+    games.save(game_id, game)
+    events.publish(game_id, game.view)
+
+@app.errorhandler(GameConflict)
+def game_conflict(e):
+    # With a shared store, another process saved the game while this
+    # request was changing its own copy; the change is dropped
+    return jsonify({'error': 'The game was changed by another request, try again'}), 409
+
+def _game_over_response(game):
+    view = game.view
+    return jsonify({
+        'status': 'game over',
+        'board': view.board,
+        'turn': view.turn,
+        'game_over': view.game_over,
+        'winner': view.winner,
+        'reason': view.reason,
+        'captured': view.captured
+    })
+
+# Requests that change a game hold game.lock, so two requests for the same
+# game run one after the other while different games never wait on each
+# other. They take it through games.locked(), which makes sure the game is
+# still the live copy once the lock is held. Responses and read-only
+# requests use the game's published view.
+
+@app.route('/move', methods=['POST'])
+def move():
+    data = request.json
+    game_id = data['game_id']
+    start_pos = data['start']
+    end_pos = data['end']
+
+    with games.locked(game_id) as game:
+        if not game:
+            return jsonify({'error': 'Game not found'}), 404
+        if game.game_over:
+            return _game_over_response(game)
+
+        move_result = game.make_move(start_pos, end_pos)
+        if move_result:
+            _changed(game_id, game)
+        view = game.view
+
+    if move_result:
+        return jsonify({
+            'status': 'move made',
+            'board': view.board,
+            'turn': view.turn,
+            'game_over': view.game_over,
+            'winner': view.winner,
+            'reason': view.reason,
+            'captured': view.captured
+        })
+    else:
+        # Add debugging information
+        return jsonify({
+            'status': 'invalid move',
+            'board': view.board,
+            'turn': view.turn
+        })
+
+@app.route('/board/<game_id>', methods=['GET'])
+def get_board(game_id):
+    game = games.get(game_id)
+    if not game:
+        return jsonify({'error': 'Game not found'}), 404
+
+    view = game.view
+    return jsonify({
+        'board': view.board,
+        'turn': view.turn,
+        'fen': view.fen,
+        'game_over': view.game_over,
+        'winner': view.winner,
+        'reason': view.reason,
+        'version': view.version
+    })
+
+@app.route('/events/<game_id>', methods=['GET'])
+def game_events(game_id):
+    # Server-Sent Events stream of the game's changes (see game_events.py).
+    # A reconnecting EventSource sends Last-Event-ID; other clients can pass
+    # ?since=<version>. Each open stream holds a server thread.
+    if not games.get(game_id):
+        return jsonify({'error': 'Game not found'}), 404
+    try:
+        since = request.headers.get('Last-Event-ID') or request.args.get('since')
+        since = int(since) if since else None
+    except ValueError:
+        return jsonify({'error': 'Invalid event id'}), 400
+
+    def current_view():
+        game = games.get(game_id)
+        return game.view if game else None
+
+    return app.response_class(events.stream(game_id, current_view, since, EVENT_POLL_SECONDS),
+                              mimetype='text/event-stream',
+                              headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/fen/<game_id>', methods=['GET'])
+def get_fen(game_id):
+    game = games.get(game_id)
+    if not game:
+        return jsonify({'error': 'Game not found'}), 404
+
+    return jsonify({'fen': game.view.fen, 'start_fen': game.start_fen})
+
+@app.route('/pgn/<game_id>', methods=['GET'])
+def get_pgn(game_id):
+    with games.locked(game_id) as game:
+        if not game:
+            return jsonify({'error': 'Game not found'}), 404
+        # Writing the SAN is slower than copying the moves, so do it unlocked
+        moves = array('H', game.moves)
+        result = game.result()
+    return app.response_class(export_pgn(game.start_fen, moves, result), mimetype='application/x-chess-pgn')
+
+@app.route('/legal_moves', methods=['POST'])
+def legal_moves():
+    data = request.json
+    game_id = data['game_id']
+    row = int(data['row'])
+    col = int(data['col'])
+
+    game = games.get(game_id)
+    if not game:
+        return jsonify({'error': 'Game not found'}), 404
+
+    legal_moves = game.view.legal_moves(row, col)
+    return jsonify({'legal_moves':legal_moves})
+
+@app.route('/all_legal_moves/<game_id>', methods=['GET'])
+def all_legal_moves(game_id):
+    # Every legal move for the side to move, as target squares keyed by
+    # "row,col" of the piece, so the board needs one request per ply
+    game = games.get(game_id)
+    if not game:
+        return jsonify({'error': 'Game not found'}), 404
+
+    view = game.view
+    moves = {'%d,%d' % tuple(row_col(square)): targets for square, targets in view.moves_from.items()}
+    return jsonify({'legal_moves': moves, 'turn': view.turn, 'fen': view.fen})
+
+@app.route('/captured_pieces/<game_id>', methods=['GET'])
+def get_captured_pieces(game_id):
+    game = games.get(game_id)
+    if not game:
+        return jsonify({'error': 'Game not found'}), 404
+
+    return jsonify({'captured': game.view.captured})
+
+@app.route('/restart', methods=['POST'])
+def restart():
+    data = request.json
+    game_id = data.get('game_id')
+    with games.locked(game_id) as game:
+        if not game:
+            return jsonify({'error': 'Game not found'}), 404
+        game.restart_game()
+        _changed(game_id, game)
+    return jsonify({'status': 'success', 'message': 'Game restarted'})
+
+@app.route('/undo', methods=['POST'])
+def undo():
+    data = request.json
+    game_id = data.get('game_id')
+    with games.locked(game_id) as game:
+        if not game:
+            return jsonify({'error': 'Game not found'}), 404
+        success = game.undo_move()
+        if success:
+            _changed(game_id, game)
+        view = game.view
+    if success:
+        return jsonify({'status': 'success', 'message': 'Move undone', 'board': view.board, 'turn': view.turn,
+                        'captured': view.captured, 'game_over': view.game_over, 'winner': view.winner,
+                        'reason': view.reason})
+    else:
+        return jsonify({'status': 'error', 'message': 'No moves to undo'})
+
+@app.route('/redo', methods=['POST'])
+def redo():
+    data = request.json
+    game_id = data.get('game_id')
+    with games.locked(game_id) as game:
+        if not game:
+            return jsonify({'error': 'Game not found'}), 404
+        success = game.redo_move()
+        if success:
+            _changed(game_id, game)
+        view = game.view
+    if success:
+        return jsonify({'status': 'success', 'message': 'Move redone', 'board': view.board, 'turn': view.turn,
+                        'captured': view.captured, 'game_over': view.game_over, 'winner': view.winner,
+                        'reason': view.reason})
+    else:
+        return jsonify({'status': 'error', 'message': 'No moves to redo'})
+
+def _search_limits(data, game):
+    # (time_ms, node_limit, max_depth, difficulty, search_workers) from a
+    # bot request; the time budget is always capped and the pool caps the
+    # workers. Raises ValueError on bad values, including a time, node limit
+    # or depth below 1, which would leave the search without a budget.
+    difficulty = data.get('difficulty', game.difficulty)
+    if difficulty not in DIFFICULTY_TABLES:
+        raise ValueError('Unknown difficulty')
+    try:
+        time_ms = min(int(data.get('time_ms', BOT_TIME_MS)), BOT_MAX_TIME_MS)
+        node_limit = int(data['node_limit']) if data.get('node_limit') else None
+        max_depth = min(int(data.get('max_depth', BOT_MAX_DEPTH)), BOT_MAX_DEPTH)
+        search_workers = int(data.get('search_workers', SEARCH_WORKERS.get(difficulty, 1)))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid search limits')
+    if time_ms < 1 or max_depth < 1 or (node_limit is not None and node_limit < 1):
+        raise ValueError('Invalid search limits')
+    return time_ms, node_limit, max_depth, difficulty, search_workers
+
+def apply_bot_job(game_id, game, job):
+    # Play a finished job's move if the game is still in the position that
+    # was searched. The caller holds game.lock. The response is kept on the
+    # job so every poll gets the same answer.
+    if job.outcome is None:
+        search = dict(job.result())
+        best_move = search.pop('move')
+        if game.position.hash != job.position_hash or not game.make_packed_move(best_move):
+            job.outcome = {'status': 'stale', 'search': search}
+        else:
+            _changed(game_id, game)
+            view = game.view
+            job.outcome = {
+                'status': 'move made',
+                'board': view.board,
+                'turn': view.turn,
+                'game_over': view.game_over,
+                'winner': view.winner,
+                'reason': view.reason,
+                'captured': view.captured,
+                'search': search
+            }
+    return job.outcome
+
+@app.route('/bot_move', methods=['POST'])
+def bot_move():
+    data = request.json
+    game_id = data['game_id']
+
+    game = games.get(game_id)
+    if not game:
+        return jsonify({'error': 'Game not found'}), 404
+
+    try:
+        time_ms, node_limit, max_depth, difficulty, search_workers = _search_limits(data, game)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Waiting under the lock means the bot never answers a position that
+    # another request has already moved on from
+    with games.locked(game_id, game) as game:
+        if not game:
+            return jsonify({'error': 'Game not found'}), 404
+        if game.game_over:
+            return _game_over_response(game)
+        try:
+            job = bot_pool.submit(game_id, game.position, time_ms, node_limit, max_depth, difficulty,
+                                  search_workers)
+        except QueueFull:
+            return jsonify({'error': 'Bot is busy, try again shortly'}), 503
+        status = job.wait(BOT_JOB_TIMEOUT_MS / 1000.0)
+        if status != 'done':
+            bot_pool.cancel(job)
+            return jsonify({'error': 'Bot search ' + status}), 504 if status == 'timed out' else 500
+        outcome = apply_bot_job(game_id, game, job)
+
+    return jsonify(outcome)
+
+# Asynchronous bot moves: POST /bot_jobs starts a search and answers at once
+# with a job id, GET /bot_jobs/<job_id>?wait=seconds polls (or long-polls)
+# and plays the move into the game once the search is done, and
+# DELETE /bot_jobs/<job_id> cancels it. A search that has already started
+# keeps its worker until its budget runs out; only its move is dropped.
+
+@app.route('/bot_jobs', methods=['POST'])
+def submit_bot_job():
+    data = request.json
+    game_id = data.get('game_id')
+    game = games.get(game_id)
+    if not game:
+        return jsonify({'error': 'Game not found'}), 404
+
+    try:
+        time_ms, node_limit, max_depth, difficulty, search_workers = _search_limits(data, game)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    with games.locked(game_id, game) as game:
+        if not game:
+            return jsonify({'error': 'Game not found'}), 404
+        if game.game_over:
+            return _game_over_response(game)
+        try:
+            job = bot_pool.submit(game_id, game.position, time_ms, node_limit, max_depth, difficulty,
+                                  search_workers)
+        except QueueFull:
+            return jsonify({'error': 'Bot is busy, try again shortly'}), 503
+    return jsonify({'status': job.status(), 'job_id': job.id}), 202
+
+@app.route('/bot_jobs/<job_id>', methods=['GET'])
+def poll_bot_job(job_id):
+    job = bot_pool.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    try:
+        wait = min(float(request.args.get('wait', 0)), BOT_MAX_WAIT_SECONDS)
+    except ValueError:
+        return jsonify({'error': 'Invalid wait'}), 400
+
+    status = job.wait(wait)
+    if status != 'done':
+        return jsonify({'status': status, 'job_id': job.id})
+    with games.locked(job.game_id) as game:
+        if not game:
+            return jsonify({'error': 'Game not found'}), 404
+        outcome = apply_bot_job(job.game_id, game, job)
+    return jsonify(dict(outcome, job_id=job.id))
+
+@app.route('/bot_jobs/<job_id>', methods=['DELETE'])
+def cancel_bot_job(job_id):
+    job = bot_pool.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    if job.outcome is not None:
+        return jsonify({'error': 'Job already finished'}), 409
+    bot_pool.cancel(job)
+    return jsonify({'status': 'cancelled', 'job_id': job.id})
+
+@app.route('/analyse', methods=['POST'])
+def analyse():
+    # Batch analysis (see analysis.py). The body is NDJSON, one FEN or JSON
+    # object per line, read as the analysis goes; or a JSON object whose
+    # 'positions' list holds the items. Default limits for the items come
+    # from the query string, or from the JSON object. Answers NDJSON, one
+    # result per line in the order the searches finish.
+    if request.is_json:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not isinstance(data.get('positions'), list):
+            return jsonify({'error': 'Expected an object with a positions list'}), 400
+        items = data['positions']
+        source = data
+    else:
+        items = (line for line in request.stream if line.strip())
+        source = request.args
+    defaults = dict(ANALYSIS_LIMITS, time_ms=BOT_TIME_MS)
+    try:
+        defaults = read_limits(source, defaults, BOT_MAX_TIME_MS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not analysis_slots.acquire(blocking=False):
+        return jsonify({'error': 'Too many analyses running, try again shortly'}), 503
+
+    def results():
+        for result in analyse_positions(bot_pool, items, defaults, BOT_MAX_TIME_MS, max(1, BOT_WORKERS)):
+            ANALYSED.inc()
+            yield json.dumps(result, separators=(',', ':')) + '\n'
+
+    response = app.response_class(results(), mimetype='application/x-ndjson',
+                                  headers={'X-Accel-Buffering': 'no'})
+    response.call_on_close(analysis_slots.release)
+    return response
+
+if __name__ == '__main__':
+    app.run(debug=True)
+
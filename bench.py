@@ -0,0 +1,231 @@
+# Benchmarks for the move generator and the bot.
+#
+#   python bench.py                          perft to depth 3 plus throughput
+#   python bench.py --depth 5                deeper perft (takes minutes)
+#   python bench.py --json results.json      also write the results as JSON
+#   python bench.py --save-baseline base.json
+#   python bench.py --baseline base.json --threshold 0.2
+#
+# The exit status is 1 when a perft count is wrong or, given a baseline,
+# when any throughput figure drops more than the threshold below it.
+# Baselines are machine specific, so record one on the machine that runs
+# the comparison.
+
+import argparse
+import json
+import sys
+import time
+
+from chess_game import ChessGame, get_all_possible_moves
+from position import Position, COLOR_NAMES
+from movegen import generate_legal, perft
+from search import get_best_move, SearchLimits
+from transposition import TranspositionTable
+
+# (name, FEN, perft node counts for depth 1, 2, ...)
+PERFT_POSITIONS = [
+    ('start', 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+     [20, 400, 8902, 197281, 4865609]),
+    ('kiwipete', 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+     [48, 2039, 97862, 4085603]),
+    ('position3', '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+     [14, 191, 2812, 43238, 674624]),
+    ('position4', 'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+     [6, 264, 9467, 422333]),
+    ('position5', 'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+     [44, 1486, 62379, 2103487]),
+    ('illegal_ep_pin', '3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1',
+     [18, 92, 1670, 10138, 185429, 1134888]),
+    ('ep_gives_check', '8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1',
+     [15, 126, 1928, 13931, 206379, 1440467]),
+    ('short_castle_check', '5k2/8/8/8/8/8/8/4K2R w K - 0 1',
+     [15, 66, 1198, 6399, 120330, 661072]),
+    ('long_castle_check', '3k4/8/8/8/8/8/8/R3K3 w Q - 0 1',
+     [16, 71, 1286, 7418, 141077, 803711]),
+    ('castling_prevented', 'r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1',
+     [44, 1494, 50509, 1720476]),
+    ('promote_out_of_check', '2K2r2/4P3/8/8/8/8/8/3k4 w - - 0 1',
+     [11, 133, 1442, 19174, 266199, 3821001]),
+    ('underpromote_check', '8/P1k5/K7/8/8/8/8/8 w - - 0 1',
+     [6, 27, 273, 1329, 18135, 92683]),
+    ('self_stalemate', 'K1k5/8/P7/8/8/8/8/8 w - - 0 1',
+     [2, 6, 13, 63, 382, 2217]),
+]
+
+# Positions the throughput benchmarks cycle through
+THROUGHPUT_POSITIONS = [
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+    'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+    'r1bq1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N1PN2/PP1B1PPP/R2QKB1R w KQ - 0 8',
+    '8/5pk1/6p1/8/3R4/6P1/5PK1/2r5 b - - 0 40',
+]
+
+
+def _game(fen):
+    return ChessGame(fen=fen)
+
+
+def run_perft(max_depth, log):
+    results = []
+    for name, fen, counts in PERFT_POSITIONS:
+        depth = min(max_depth, len(counts))
+        position = Position.from_fen(fen)
+        start = time.perf_counter()
+        nodes = perft(position, depth)
+        seconds = time.perf_counter() - start
+        result = {
+            'name': name,
+            'depth': depth,
+            'nodes': nodes,
+            'expected': counts[depth - 1],
+            'ok': nodes == counts[depth - 1],
+            'seconds': round(seconds, 3),
+            'nps': round(nodes / seconds) if seconds else 0,
+        }
+        results.append(result)
+        log('perft %-22s depth %d  %9d nodes  %s  %8.0f nodes/s' % (
+            name, depth, nodes, 'ok' if result['ok'] else 'WRONG (expected %d)' % result['expected'],
+            result['nps']))
+    return results
+
+
+def _calls_per_second(function, seconds):
+    # Call function(i) for about the given time and return the call rate
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        function(calls)
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return calls / elapsed
+
+
+def run_throughput(seconds, search_depth, log):
+    games = [_game(fen) for fen in THROUGHPUT_POSITIONS]
+    own_squares = []
+    for game in games:
+        color = game.position.turn
+        own_squares.append([square for square, piece in enumerate(game.position.squares)
+                            if piece and piece >> 3 == color])
+
+    def all_moves(i):
+        game = games[i % len(games)]
+        get_all_possible_moves(game, game.turn)
+
+    def legal_moves(i):
+        squares = own_squares[i % len(games)]
+        square = squares[(i // len(games)) % len(squares)]
+        games[i % len(games)].get_legal_moves(square >> 3, square & 7)
+
+    def uncached(function):
+        # A game generates its legal moves once per position and reuses them,
+        # so clear that cache first to time the generation too
+        def call(i):
+            games[i % len(games)].legal_cache_key = None
+            function(i)
+        return call
+
+    def generate(i):
+        generate_legal(games[i % len(games)].position)
+
+    def check_test(i):
+        game = games[i % len(games)]
+        game.is_in_check(COLOR_NAMES[game.position.turn])
+
+    metrics = {
+        'generate_legal_per_sec': _calls_per_second(generate, seconds),
+        'get_all_possible_moves_per_sec': _calls_per_second(uncached(all_moves), seconds),
+        'get_legal_moves_per_sec': _calls_per_second(uncached(legal_moves), seconds),
+        # The same calls served from the cache, as repeated requests are
+        'get_all_possible_moves_cached_per_sec': _calls_per_second(all_moves, seconds),
+        'get_legal_moves_cached_per_sec': _calls_per_second(legal_moves, seconds),
+        'is_in_check_per_sec': _calls_per_second(check_test, seconds),
+    }
+
+    # Search speed in nodes per second at a fixed depth, fresh table each time
+    nodes = 0
+    start = time.perf_counter()
+    i = 0
+    while True:
+        limits = SearchLimits()
+        get_best_move(Position.from_fen(THROUGHPUT_POSITIONS[i % len(games)]), search_depth,
+                      TranspositionTable(1 << 16), limits)
+        nodes += limits.nodes
+        i += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            break
+    metrics['get_best_move_nps'] = nodes / elapsed
+
+    # Raw generator speed on a fixed perft
+    position = Position.from_fen(THROUGHPUT_POSITIONS[1])
+    start = time.perf_counter()
+    nodes = perft(position, 3)
+    metrics['perft_nps'] = nodes / (time.perf_counter() - start)
+
+    for name, value in metrics.items():
+        log('%-38s %12.0f' % (name, value))
+    return {name: round(value, 1) for name, value in metrics.items()}
+
+
+def find_regressions(metrics, baseline, threshold):
+    regressions = []
+    for name, value in metrics.items():
+        reference = baseline.get(name)
+        if reference and value < reference * (1 - threshold):
+            regressions.append({
+                'metric': name,
+                'value': value,
+                'baseline': reference,
+                'change': round(value / reference - 1, 3),
+            })
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Perft and search benchmarks')
+    parser.add_argument('--depth', type=int, default=3, help='maximum perft depth (default 3)')
+    parser.add_argument('--seconds', type=float, default=1.0,
+                        help='time spent on each throughput benchmark (default 1.0)')
+    parser.add_argument('--search-depth', type=int, default=3, help='get_best_move depth (default 3)')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='compare throughput against this results or baseline file')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed throughput drop against the baseline (default 0.2)')
+    parser.add_argument('--save-baseline', help='write the throughput figures to this file')
+    parser.add_argument('--quiet', action='store_true', help='no progress output')
+    args = parser.parse_args(argv)
+
+    def log(line):
+        if not args.quiet:
+            print(line)
+
+    perft_results = run_perft(args.depth, log)
+    metrics = run_throughput(args.seconds, args.search_depth, log)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(metrics, baseline.get('throughput', baseline), args.threshold)
+        for regression in regressions:
+            log('REGRESSION %(metric)s: %(value).0f vs baseline %(baseline).0f' % regression)
+
+    results = {
+        'perft': perft_results,
+        'throughput': metrics,
+        'regressions': regressions,
+        'ok': all(result['ok'] for result in perft_results) and not regressions,
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'throughput': metrics}, f, indent=2)
+    return 0 if results['ok'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,201 @@
+# Opening book for the bot.
+#
+# A book file is a sorted array of 16-byte big-endian entries, the same
+# layout as a Polyglot book:
+#   key    8 bytes  Zobrist hash of the position (our zobrist.py keys)
+#   move   2 bytes  packed move, start | end << 6 | promotion << 12
+#   weight 2 bytes  relative frequency of the move in that position
+#   learn  4 bytes  unused, always 0
+# The keys and moves are this engine's own rather than Polyglot's, so books
+# have to be built with this module. Entries are sorted by key (then by
+# weight, heaviest first), so a lookup is a binary search over the
+# memory-mapped file: opening a book reads nothing up front, and processes
+# that map the same file share its pages.
+#
+#   python book.py build book.bin                 from the built-in lines
+#   python book.py build book.bin games.pgn ...   from PGN files
+#   python book.py probe book.bin [FEN]
+
+import argparse
+import mmap
+import os
+import random
+import struct
+import sys
+from collections import defaultdict
+
+from position import Position
+from movegen import generate_legal
+from notation import parse_pgn, parse_san, split_pgn, move_to_san
+
+ENTRY = struct.Struct('>QHHI')
+KEY = struct.Struct('>Q')
+
+DEFAULT_BOOK = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'book.bin')
+
+# Main lines of common openings, used for the book that ships with the bot
+OPENING_LINES = [
+    'e4 e5 Nf3 Nc6 Bb5 a6 Ba4 Nf6 O-O Be7 Re1 b5 Bb3 d6 c3 O-O',
+    'e4 e5 Nf3 Nc6 Bb5 Nf6 O-O Nxe4 d4 Nd6 Bxc6 dxc6 dxe5 Nf5',
+    'e4 e5 Nf3 Nc6 Bb5 a6 Bxc6 dxc6 O-O f6 d4 exd4 Nxd4 c5',
+    'e4 e5 Nf3 Nc6 Bc4 Bc5 c3 Nf6 d3 d6 O-O O-O',
+    'e4 e5 Nf3 Nc6 d4 exd4 Nxd4 Nf6 Nxc6 bxc6 e5 Qe7',
+    'e4 e5 Nf3 Nf6 Nxe5 d6 Nf3 Nxe4 d4 d5 Bd3',
+    'e4 e5 Nc3 Nf6 f4 d5 fxe5 Nxe4 Nf3 Be7',
+    'e4 c5 Nf3 d6 d4 cxd4 Nxd4 Nf6 Nc3 a6 Be3 e5 Nb3 Be6',
+    'e4 c5 Nf3 Nc6 d4 cxd4 Nxd4 Nf6 Nc3 e5 Ndb5 d6 Bg5 a6 Na3 b5',
+    'e4 c5 Nf3 e6 d4 cxd4 Nxd4 Nc6 Nc3 Qc7 Be2 a6 O-O Nf6',
+    'e4 c5 Nc3 Nc6 g3 g6 Bg2 Bg7 d3 d6',
+    'e4 c5 c3 Nf6 e5 Nd5 d4 cxd4 Nf3 Nc6 cxd4 d6',
+    'e4 e6 d4 d5 Nc3 Nf6 Bg5 Be7 e5 Nfd7 Bxe7 Qxe7 f4 O-O',
+    'e4 e6 d4 d5 Nd2 c5 exd5 exd5 Ngf3 Nc6 Bb5 Bd6',
+    'e4 e6 d4 d5 e5 c5 c3 Nc6 Nf3 Qb6 a3',
+    'e4 c6 d4 d5 Nc3 dxe4 Nxe4 Bf5 Ng3 Bg6 h4 h6 Nf3 Nd7 h5 Bh7',
+    'e4 c6 d4 d5 e5 Bf5 Nf3 e6 Be2 c5 O-O',
+    'e4 d5 exd5 Qxd5 Nc3 Qa5 d4 Nf6 Nf3 c6',
+    'e4 Nf6 e5 Nd5 d4 d6 Nf3 Bg4 Be2 e6',
+    'e4 d6 d4 Nf6 Nc3 g6 f4 Bg7 Nf3 O-O',
+    'd4 d5 c4 e6 Nc3 Nf6 Bg5 Be7 e3 O-O Nf3 h6 Bh4 b6',
+    'd4 d5 c4 c6 Nf3 Nf6 Nc3 dxc4 a4 Bf5 e3 e6 Bxc4 Bb4 O-O O-O',
+    'd4 d5 c4 dxc4 Nf3 Nf6 e3 e6 Bxc4 c5 O-O a6',
+    'd4 d5 Nf3 Nf6 Bf4 e6 e3 c5 c3 Nc6 Nbd2 Bd6',
+    'd4 Nf6 c4 e6 Nc3 Bb4 e3 O-O Bd3 d5 Nf3 c5 O-O',
+    'd4 Nf6 c4 e6 Nf3 b6 g3 Ba6 b3 Bb4+ Bd2 Be7',
+    'd4 Nf6 c4 e6 g3 d5 Bg2 Be7 Nf3 O-O O-O dxc4',
+    'd4 Nf6 c4 g6 Nc3 Bg7 e4 d6 Nf3 O-O Be2 e5 O-O Nc6 d5 Ne7',
+    'd4 Nf6 c4 g6 Nc3 d5 cxd5 Nxd5 e4 Nxc3 bxc3 Bg7 Nf3 c5',
+    'd4 Nf6 c4 c5 d5 e6 Nc3 exd5 cxd5 d6 e4 g6',
+    'd4 f5 g3 Nf6 Bg2 g6 Nf3 Bg7 O-O O-O c4 d6',
+    'c4 e5 Nc3 Nf6 Nf3 Nc6 g3 d5 cxd5 Nxd5 Bg2 Nb6 O-O Be7',
+    'c4 c5 Nc3 Nc6 g3 g6 Bg2 Bg7 Nf3 e6 O-O Nge7',
+    'Nf3 d5 g3 Nf6 Bg2 e6 O-O Be7 d3 O-O',
+]
+
+
+class OpeningBook:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        if size % ENTRY.size:
+            self.file.close()
+            raise ValueError('Book file size is not a multiple of %d bytes' % ENTRY.size)
+        self.count = size // ENTRY.size
+        # mmap can't map an empty file
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+    def close(self):
+        if self.data:
+            self.data.close()
+        self.file.close()
+
+    def lookup(self, key):
+        # [(move, weight)] stored for a position hash
+        data = self.data
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if KEY.unpack_from(data, middle * ENTRY.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        entries = []
+        while low < self.count:
+            entry_key, move, weight, _ = ENTRY.unpack_from(data, low * ENTRY.size)
+            if entry_key != key:
+                break
+            entries.append((move, weight))
+            low += 1
+        return entries
+
+    def choose(self, position, rng=random):
+        # A book move for the position picked at random by weight, or None.
+        # Moves are checked against the legal moves in case of a hash clash.
+        entries = self.lookup(position.hash)
+        if not entries:
+            return None
+        legal = set(generate_legal(position))
+        entries = [(move, weight) for move, weight in entries if move in legal and weight]
+        if not entries:
+            return None
+        return rng.choices([move for move, _ in entries], [weight for _, weight in entries])[0]
+
+
+def open_book(path):
+    # The book at path, or None when there is no such file
+    if not path or not os.path.exists(path):
+        return None
+    return OpeningBook(path)
+
+
+def add_line(counts, start_fen, moves, max_plies):
+    # Count each of the first max_plies moves against its position's hash
+    position = Position.from_fen(start_fen)
+    for move in moves[:max_plies]:
+        counts[position.hash, move] += 1
+        position.push(move)
+
+
+def write_book(counts, path):
+    # counts maps (hash, move) to a count; weights are scaled to 16 bits
+    top = max(counts.values()) if counts else 1
+    scale = min(1.0, 65535.0 / top)
+    entries = sorted(((key, move, max(1, int(count * scale))) for (key, move), count in counts.items()),
+                     key=lambda entry: (entry[0], -entry[2], entry[1]))
+    with open(path, 'wb') as f:
+        for key, move, weight in entries:
+            f.write(ENTRY.pack(key, move, weight, 0))
+    return len(entries)
+
+
+def build_book(path, pgn_paths=(), max_plies=20):
+    # Writes a book from PGN files, or from OPENING_LINES when none are given
+    counts = defaultdict(int)
+    if pgn_paths:
+        for pgn_path in pgn_paths:
+            with open(pgn_path) as f:
+                for text in split_pgn(f.read()):
+                    try:
+                        _, start_fen, moves, _ = parse_pgn(text)
+                    except ValueError:
+                        continue  # Skip games with illegal or unreadable moves
+                    add_line(counts, start_fen, moves, max_plies)
+    else:
+        for line in OPENING_LINES:
+            position = Position.initial()
+            moves = []
+            for san in line.split():
+                move = parse_san(position, san)
+                moves.append(move)
+                position.push(move)
+            add_line(counts, Position.initial().to_fen(), moves, max_plies)
+    return write_book(counts, path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build or probe an opening book')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='write a book file')
+    build.add_argument('book')
+    build.add_argument('pgn', nargs='*', help='PGN files (default: the built-in opening lines)')
+    build.add_argument('--plies', type=int, default=20, help='moves per game to keep (default 20)')
+    probe = commands.add_parser('probe', help='list the book moves for a position')
+    probe.add_argument('book')
+    probe.add_argument('fen', nargs='?', help='position (default: the start position)')
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        count = build_book(args.book, args.pgn, args.plies)
+        print('%d entries written to %s' % (count, args.book))
+        return 0
+
+    book = OpeningBook(args.book)
+    position = Position.from_fen(args.fen) if args.fen else Position.initial()
+    for move, weight in book.lookup(position.hash):
+        print('%-8s %d' % (move_to_san(position, move), weight))
+    book.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
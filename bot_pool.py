@@ -0,0 +1,384 @@
+# Bot searches run in a pool of worker processes, so a long search neither
+# holds the GIL of the web process nor stops other requests from being served.
+#
+# A job carries only the FEN of the position and the search limits. Each
+# worker process keeps one transposition table per difficulty, which carries
+# over between the jobs it runs, whatever game they come from (entries are
+# keyed by the position hash).
+#
+# A search can also be spread over several workers (Lazy SMP). The workers
+# search the same position at once and share a transposition table in
+# shared memory, so each one mostly reads results the others have already
+# found and skips that part of the tree. Each running parallel search has a
+# table to itself, so searches of other games neither age its entries nor
+# overwrite them; tables are reused once their search ends. Half of the
+# helpers start one
+# iteration deeper than the main search so their work overlaps less. The
+# deepest iteration that finished wins. A node limit is shared out between
+# the workers, so the nodes of the whole search stay within it.
+#
+# Positions found in the opening book (book.py) or covered by the endgame
+# tablebases (tablebase.py) are answered from them at once, without a search.
+# Searches also score the positions the tablebases cover from them.
+#
+# With workers=0 searches run in the requesting thread instead, which is
+# handy for debugging and for hosts that can't fork.
+
+import atexit
+import itertools
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from position import Position
+from search import iterative_deepening
+from transposition import TranspositionTable, SharedTranspositionTable
+from evaluate import DIFFICULTY_TABLES
+from tablebase import open_tablebase
+import metrics
+
+# Finished jobs are forgotten after this long
+JOB_RETENTION_SECONDS = 300
+
+BOT_JOBS = metrics.counter('chess_bot_jobs_total', 'Bot jobs by how they ended: book, tablebase, search, '
+                           'failed or cancelled', ('result',))
+BOT_QUEUE_FULL = metrics.counter('chess_bot_queue_full_total', 'Bot jobs turned away because the queue was full')
+SEARCH_NODES = metrics.counter('chess_search_nodes_total', 'Nodes searched by the bot, all workers together')
+SEARCH_SECONDS = metrics.histogram('chess_search_seconds', 'Time the bot searched for one move')
+SEARCH_DEPTH = metrics.histogram('chess_search_depth', 'Deepest iteration the bot finished for one move',
+                                 buckets=(1, 2, 3, 4, 5, 6, 7, 8, 10, 12, 16, 24, 32))
+JOB_SECONDS = metrics.histogram('chess_bot_job_seconds', 'Time from submitting a bot job to its result, '
+                                'queueing included')
+
+_tt_size = 1 << 16
+_worker_tts = {}  # difficulty -> TranspositionTable, per process
+_shared_tts = {}  # shared memory name -> SharedTranspositionTable, per process
+_tablebase = None
+
+
+def _init_worker(tt_size, tablebase_path=None):
+    global _tt_size, _tablebase
+    _tt_size = tt_size
+    _worker_tts.clear()
+    _tablebase = open_tablebase(tablebase_path)
+
+
+def run_search(fen, time_ms, node_limit, max_depth, difficulty, shared=None, first_depth=1, deadline=None):
+    # Runs in a worker: returns the search result with the move packed.
+    # shared is (name, size, generation) of a shared table to search with;
+    # deadline (time.time()) stops a helper that started late with the rest.
+    generation = None
+    if shared:
+        name, size, generation = shared
+        tt = _shared_tts.get(name)
+        if tt is None:
+            tt = _shared_tts[name] = SharedTranspositionTable(size, name)
+    else:
+        tt = _worker_tts.get(difficulty)
+        if tt is None:
+            tt = _worker_tts[difficulty] = TranspositionTable(_tt_size)
+    if deadline:
+        time_ms = (deadline - time.time()) * 1000.0
+        if time_ms <= 0:
+            return {'move': None, 'depth': 0, 'score': None, 'nodes': 0, 'time_ms': 0}
+    return iterative_deepening(Position.from_fen(fen), time_ms, node_limit, max_depth, tt,
+                               DIFFICULTY_TABLES[difficulty], first_depth, generation, _tablebase)
+
+
+def _merge_results(parts):
+    # One future for the parts of a parallel search: the main search's
+    # result unless a helper finished a deeper iteration, with the nodes of
+    # all of them
+    merged = Future()
+    merged.set_running_or_notify_cancel()
+    remaining = [len(parts)]
+    lock = threading.Lock()
+
+    def part_done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        try:
+            best = parts[0].result()
+        except BaseException as e:
+            merged.set_exception(e)
+            return
+        nodes = best['nodes']
+        for part in parts[1:]:
+            if part.cancelled() or part.exception():
+                continue
+            result = part.result()
+            nodes += result['nodes']
+            if result['move'] is not None and result['depth'] > best['depth']:
+                best = result
+        merged.set_result(dict(best, nodes=nodes, time_ms=parts[0].result()['time_ms'], workers=len(parts)))
+
+    for part in parts:
+        part.add_done_callback(part_done)
+    return merged
+
+
+def _start_search(executor, fen, time_ms, node_limit, max_depth, difficulty, shared, search_workers):
+    # (future of the result, worker futures of a parallel search)
+    if not shared:
+        return executor.submit(run_search, fen, time_ms, node_limit, max_depth, difficulty), ()
+    deadline = time.time() + time_ms / 1000.0 if time_ms else None
+    helper_limit = None
+    if node_limit:
+        # Each worker needs a node at least; the main search gets what
+        # doesn't divide evenly
+        search_workers = min(search_workers, node_limit)
+        helper_limit = node_limit // search_workers
+        node_limit -= helper_limit * (search_workers - 1)
+    parts = []
+    try:
+        parts.append(executor.submit(run_search, fen, time_ms, node_limit, max_depth, difficulty, shared))
+        for helper in range(1, search_workers):
+            parts.append(executor.submit(run_search, fen, time_ms, helper_limit, max_depth, difficulty,
+                                         shared, 1 + helper % 2, deadline))
+    except BaseException:
+        for part in parts:
+            part.cancel()
+        raise
+    return _merge_results(parts), parts
+
+
+class QueueFull(Exception):
+    pass
+
+
+class BotJob:
+    __slots__ = ('id', 'game_id', 'position_hash', 'future', 'parts', 'shared_tt', 'submitted', 'deadline',
+                 'cancelled', 'finished', 'outcome')
+
+    def __init__(self, job_id, game_id, position_hash, future, timeout_ms, parts=()):
+        self.id = job_id
+        self.game_id = game_id
+        self.position_hash = position_hash  # The position the search was asked for
+        self.future = future
+        self.parts = parts  # Worker futures of a parallel search
+        self.shared_tt = None  # (difficulty, table) a parallel search uses until it ends
+        self.submitted = time.monotonic()
+        self.deadline = self.submitted + timeout_ms / 1000.0
+        self.cancelled = False
+        self.finished = None  # When the job stopped, for pruning
+        self.outcome = None  # Set once by whoever applies the result
+
+    def status(self):
+        if self.cancelled or self.future.cancelled():
+            return 'cancelled'
+        if self.future.done():
+            return 'failed' if self.future.exception() else 'done'
+        if time.monotonic() > self.deadline:
+            return 'timed out'
+        return 'running' if self.future.running() else 'queued'
+
+    def wait(self, seconds):
+        # Wait up to seconds, but not past the job's deadline; returns the
+        # final status
+        seconds = min(seconds, self.deadline - time.monotonic())
+        if seconds > 0:
+            try:
+                self.future.result(timeout=seconds)
+            except Exception:
+                pass  # Timeouts, cancellation and errors all show in status()
+        return self.status()
+
+    def result(self):
+        # The search result dict of a finished job
+        return self.future.result(timeout=0)
+
+
+class BotPool:
+    def __init__(self, workers, max_queue, timeout_ms, tt_size, book=None, tablebase_path=None):
+        self.workers = workers
+        self.max_queue = max_queue  # Jobs waiting or running at most
+        self.timeout_ms = timeout_ms
+        self.tt_size = tt_size
+        self.book = book  # OpeningBook or None
+        self.tablebase_path = tablebase_path  # Directory of tablebase files or None
+        self.tablebase = open_tablebase(tablebase_path)
+        self.executor = None  # Started on the first job
+        self.shared_tts = []  # Every SharedTranspositionTable made for parallel searches
+        self.free_tts = {}  # difficulty -> the ones no search is using
+        self.jobs = {}
+        self.pending = 0
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        if not workers:
+            _init_worker(tt_size, tablebase_path)
+
+    def _executor(self):
+        with self.lock:
+            if self.executor is None:
+                # Spawned rather than forked: the web process has threads running
+                self.executor = ProcessPoolExecutor(self.workers, multiprocessing.get_context('spawn'),
+                                                    initializer=_init_worker,
+                                                    initargs=(self.tt_size, self.tablebase_path))
+            return self.executor
+
+    def _on_executor(self, start):
+        # start(executor), on a new pool if the current one is broken. A
+        # worker that dies (killed for using too much memory, say) breaks
+        # the whole pool: the jobs it had fail and it takes no new ones.
+        executor = self._executor()
+        try:
+            return start(executor)
+        except BrokenProcessPool:
+            with self.lock:
+                if self.executor is executor:
+                    self.executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+            return start(self._executor())
+
+    def _shared_tt(self, difficulty):
+        # A table for one parallel search, started on a new generation; the
+        # caller holds the lock
+        free = self.free_tts.get(difficulty)
+        if free:
+            tt = free.pop()
+        else:
+            if not self.shared_tts:
+                atexit.register(self.shutdown)
+            tt = SharedTranspositionTable(self.tt_size)
+            self.shared_tts.append(tt)
+        tt.new_search()
+        return tt
+
+    def _release_tt(self, shared_tt):
+        # The caller holds the lock
+        difficulty, tt = shared_tt
+        if tt in self.shared_tts:  # Not closed by shutdown() meanwhile
+            self.free_tts.setdefault(difficulty, []).append(tt)
+
+    def submit(self, game_id, position, time_ms, node_limit, max_depth, difficulty, search_workers=1):
+        # Queue a search of position on search_workers workers at once;
+        # raises QueueFull when max_queue jobs are already waiting or running
+        answer = None
+        book_move = self.book.choose(position) if self.book else None
+        if book_move is not None:
+            answer = {'move': book_move, 'depth': 0, 'score': None, 'nodes': 0, 'time_ms': 0, 'book': True}
+        elif self.tablebase is not None:
+            found = self.tablebase.best_move(position)
+            if found:
+                answer = {'move': found[0], 'depth': 0, 'score': found[1], 'nodes': 0, 'time_ms': 0,
+                          'tablebase': True}
+        fen = position.to_fen()
+        search_workers = max(1, min(search_workers, self.workers))
+        with self.lock:
+            self._prune()
+            if self.pending >= self.max_queue:
+                BOT_QUEUE_FULL.inc()
+                raise QueueFull()
+            self.pending += 1
+            job_id = '%x' % next(self.ids)
+            shared_tt = shared = None
+            if search_workers > 1 and answer is None:
+                tt = self._shared_tt(difficulty)
+                shared_tt = (difficulty, tt)
+                shared = (tt.name, tt.size, tt.generation)
+        timeout_ms = min(self.timeout_ms, time_ms + 5000) if time_ms else self.timeout_ms
+        parts = ()
+        if answer is not None:
+            future = Future()
+            future.set_running_or_notify_cancel()
+            future.set_result(answer)
+        elif self.workers:
+            try:
+                future, parts = self._on_executor(lambda executor: _start_search(
+                    executor, fen, time_ms, node_limit, max_depth, difficulty, shared, search_workers))
+            except Exception:
+                with self.lock:
+                    self.pending -= 1
+                    if shared_tt:
+                        self._release_tt(shared_tt)
+                raise
+        else:
+            future = Future()
+            future.set_running_or_notify_cancel()
+            try:
+                future.set_result(run_search(fen, time_ms, node_limit, max_depth, difficulty))
+            except Exception as e:
+                future.set_exception(e)
+        job = BotJob(job_id, game_id, position.hash, future, timeout_ms, parts)
+        job.shared_tt = shared_tt
+        with self.lock:
+            self.jobs[job_id] = job
+        future.add_done_callback(lambda _: self._job_done(job))
+        return job
+
+    def run(self, function, *args):
+        # Future of function(*args) run on a worker, for work other than bot
+        # moves such as batch analysis (analysis.py). It is not counted
+        # against max_queue: callers limit how much they queue themselves.
+        if self.workers:
+            return self._on_executor(lambda executor: executor.submit(function, *args))
+        future = Future()
+        future.set_running_or_notify_cancel()
+        try:
+            future.set_result(function(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def _job_done(self, job):
+        # The future of a parallel search is only done once every part is,
+        # so nothing uses its table any more
+        with self.lock:
+            self.pending -= 1
+            job.finished = time.monotonic()
+            if job.shared_tt:
+                self._release_tt(job.shared_tt)
+                job.shared_tt = None
+        if not metrics.enabled:
+            return
+        JOB_SECONDS.observe(job.finished - job.submitted)
+        future = job.future
+        if future.cancelled():
+            BOT_JOBS.inc('cancelled')
+        elif future.exception():
+            BOT_JOBS.inc('failed')
+        else:
+            result = future.result()
+            if result.get('book'):
+                BOT_JOBS.inc('book')
+            elif result.get('tablebase'):
+                BOT_JOBS.inc('tablebase')
+            else:
+                BOT_JOBS.inc('search')
+                SEARCH_NODES.add(result['nodes'])
+                SEARCH_SECONDS.observe(result['time_ms'] / 1000.0)
+                SEARCH_DEPTH.observe(result['depth'])
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job):
+        # A queued job never starts. A running search can't be stopped: it
+        # keeps its worker busy until its own time budget or node limit runs
+        # out, and its result is thrown away.
+        job.cancelled = True
+        job.future.cancel()
+        for part in job.parts:
+            part.cancel()
+
+    def _prune(self):
+        # Forget jobs that finished long ago; the caller holds the lock
+        cutoff = time.monotonic() - JOB_RETENTION_SECONDS
+        for job_id in [job_id for job_id, job in self.jobs.items()
+                       if job.finished is not None and job.finished < cutoff]:
+            del self.jobs[job_id]
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        with self.lock:
+            for tt in self.shared_tts:
+                tt.close()
+            self.shared_tts.clear()
+            self.free_tts.clear()
@@ -0,0 +1,358 @@
+# A game in progress: its position, history and result, and the read-only
+# view of it that requests answer from. The web app (app.py), the benchmarks
+# (bench.py) and the tournament runner (tournament.py) share it; it doesn't
+# touch the app's game store, bot pool or configuration.
+
+import base64
+import json
+import sys
+import threading
+from array import array
+
+from position import Position, COLOR_NAMES, PIECE_NAMES, QUEEN, PAWN, piece_name, square_of, row_col
+from movegen import generate_legal, in_check, insufficient_material, encode_move
+from evaluate import DEFAULT_DIFFICULTY
+from notation import export_pgn, parse_pgn
+import metrics
+
+# Draws that end a game here but that players may play on from
+CLAIMABLE_DRAWS = ('threefold repetition', 'fifty-move rule')
+
+LEGAL_GENERATIONS = metrics.counter('chess_legal_move_generations_total', 'Legal move generations for games')
+LEGAL_CACHE_HITS = metrics.counter('chess_legal_move_cache_hits_total',
+                                   'Legal move lists served from the per-position cache')
+CHECK_TESTS = metrics.counter('chess_check_tests_total', 'Check tests for games')
+VIEWS_BUILT = metrics.counter('chess_game_views_total', 'Game views built, one per change to a game')
+SNAPSHOTS = metrics.counter('chess_game_snapshots_total', 'Games written to or rebuilt from snapshots',
+                            ('operation',))
+
+
+def _pack_moves(moves):
+    # Little-endian bytes of a move array, base64 encoded for JSON
+    if sys.byteorder == 'big':
+        moves = array('H', moves)
+        moves.byteswap()
+    return base64.b64encode(moves.tobytes()).decode('ascii')
+
+
+def _unpack_moves(text):
+    moves = array('H', base64.b64decode(text))
+    if sys.byteorder == 'big':
+        moves.byteswap()
+    return moves
+
+class GameView:
+    # Read-only state of a game after its latest change. A game publishes a
+    # new view instead of changing the old one, so request handlers can read
+    # a consistent view without taking the game's lock. delta describes the
+    # move that led to it, when the change was a single move.
+    __slots__ = ('version', 'delta', 'board', 'turn', 'fen', 'game_over', 'winner', 'reason', 'captured',
+                 'moves_from')
+
+    def __init__(self, game, delta=None):
+        VIEWS_BUILT.inc()
+        self.version = game.version
+        self.delta = delta
+        self.board = game.get_board()
+        self.turn = game.turn
+        self.fen = game.get_fen()
+        self.game_over = game.game_over
+        self.winner = game.winner
+        self.reason = game.end_reason
+        self.captured = {color: list(pieces) for color, pieces in game.captured_pieces.items()}
+        # Target [row, col] lists by start square, queen promotions only
+        self.moves_from = {}
+        if not game.game_over:
+            for move in game.legal_move_list():
+                if move >> 12 in (0, QUEEN):
+                    self.moves_from.setdefault(move & 63, []).append(row_col(move >> 6 & 63))
+
+    def legal_moves(self, row, col):
+        return list(self.moves_from.get(square_of(row, col), ()))
+
+
+class ChessGame:
+    def __init__(self, difficulty=DEFAULT_DIFFICULTY, fen=None):
+        # fen sets up any starting position; Position.from_fen raises
+        # ValueError if it is malformed
+        self.position = Position.from_fen(fen) if fen else Position.initial()
+        self.start_fen = self.position.to_fen()
+        self.difficulty = difficulty  # Picks the bot's evaluation tables
+        # History since start_fen: one packed move and one packed undo record
+        # (see Position.pack_last_move) per ply, plus the moves undone since
+        # the last new move for redo
+        self.moves = array('H')
+        self.undo_records = array('I')
+        self.redo_moves = array('H')
+        # Position hashes from the start on, for spotting repetitions
+        self.hashes = array('Q', [self.position.hash])
+        self.captured_pieces = {'white': [], 'black': []}  # Store captured pieces
+        self.game_over = False  # Track whether the game is over
+        self.winner = None 
+        self.end_reason = None  # checkmate, stalemate or the draw rule that ended the game
+        # Legal moves of the position whose hash is legal_cache_key
+        self.legal_cache_key = None
+        self.legal_cache = None
+        # Held by requests that change the game; readers use self.view
+        self.lock = threading.Lock()
+        self.evicted = False  # Set by the game store once this copy is snapshotted
+        self.version = 0  # One more after each change
+        # A loaded position may already be finished
+        self.update_status()
+        self.publish()
+
+    @classmethod
+    def from_pgn(cls, text, difficulty=DEFAULT_DIFFICULTY):
+        # Replays the game's moves from its starting position; raises
+        # ValueError on a bad FEN tag or an illegal move
+        headers, start_fen, moves, result = parse_pgn(text)
+        game = cls(difficulty, start_fen)
+        for move in moves:
+            # Players may play on instead of claiming a repetition or
+            # fifty-move draw, but not past a game that is really over
+            if game.game_over and game.end_reason not in CLAIMABLE_DRAWS:
+                raise ValueError('Moves after the end of the game')
+            game.play_move(move, publish=False)
+        game.publish()
+        return game
+
+    @property
+    def turn(self):
+        return COLOR_NAMES[self.position.turn]
+
+    def get_board(self):
+        # The string board is only built for JSON responses
+        return self.position.to_board()
+
+    def validate_move(self, start_pos, end_pos):
+        if self.game_over:
+            return False  # No moves allowed if the game is over
+
+        # The view is rebuilt after every change, so its moves are current
+        legal_moves = self.view.legal_moves(start_pos[0], start_pos[1])
+        return end_pos in legal_moves
+
+    def make_move(self, start_pos, end_pos):
+        start_pos = [int(start_pos[0]), int(start_pos[1])]
+        end_pos = [int(end_pos[0]), int(end_pos[1])]
+
+        if self.validate_move(start_pos, end_pos):
+            start, end = square_of(*start_pos), square_of(*end_pos)
+            promotion = 0
+            if self.position.squares[start] & 7 == PAWN and end >> 3 in (0, 7):
+                promotion = QUEEN  # Auto-promote to queen for now
+            self.redo_moves = array('H')  # A new move discards the undone ones
+            self.play_move(encode_move(start, end, promotion))
+            return True
+        return False
+
+    def make_packed_move(self, move):
+        # Play a packed move, such as the bot's; False if it isn't legal here
+        if self.game_over or move not in self.legal_move_list():
+            return False
+        self.redo_moves = array('H')
+        self.play_move(move)
+        return True
+
+    def to_snapshot(self):
+        # Compact serialized game for the game store: the starting FEN plus
+        # the packed moves, which from_snapshot() replays. The bot's
+        # transposition table is a cache and is not kept.
+        SNAPSHOTS.inc('dump')
+        return json.dumps({
+            'fen': self.start_fen,
+            'difficulty': self.difficulty,
+            'moves': _pack_moves(self.moves),
+            'redo': _pack_moves(self.redo_moves),
+            'version': self.version,
+        }, separators=(',', ':')).encode()
+
+    @classmethod
+    def from_snapshot(cls, data):
+        SNAPSHOTS.inc('load')
+        snapshot = json.loads(data)
+        game = cls(snapshot['difficulty'], snapshot['fen'])
+        for move in _unpack_moves(snapshot['moves']):
+            game.play_move(move, publish=False)
+        game.redo_moves = _unpack_moves(snapshot['redo'])
+        game.version = snapshot.get('version', game.version)
+        game.publish()
+        return game
+
+    def publish(self, delta=None):
+        # Replace the read-only view after a change
+        self.view = GameView(self, delta)
+
+    def play_move(self, move, publish=True):
+        # Record a legal packed move and check whether it ends the game
+        mover = self.turn
+        captured = self.push(move)
+
+        # Capture the target piece
+        if captured:
+            self.captured_pieces[mover].append(piece_name(captured))
+
+        move, record = self.position.pack_last_move()
+        self.moves.append(move)
+        self.undo_records.append(record)
+        self.hashes.append(self.position.hash)
+        self.version += 1
+
+        # Check for endgame conditions
+        self.update_status()
+        if publish:
+            self.publish({
+                'from': row_col(move & 63),
+                'to': row_col(move >> 6 & 63),
+                'promotion': PIECE_NAMES[move >> 12] or None,
+                'captured': piece_name(captured) or None,
+            })
+
+    def push(self, move):
+        # Play a packed move in place; pop() takes it back exactly
+        return self.position.push(move)
+
+    def pop(self):
+        self.position.pop()
+
+    def legal_move_list(self):
+        # Every legal packed move in the current position. They are generated
+        # once per position and reused by the view, move validation and the
+        # end of game checks until the position changes.
+        key = self.position.hash
+        if self.legal_cache_key != key:
+            LEGAL_GENERATIONS.inc()
+            self.legal_cache = generate_legal(self.position)
+            self.legal_cache_key = key
+        else:
+            LEGAL_CACHE_HITS.inc()
+        return self.legal_cache
+
+    def get_legal_moves(self, row, col):
+        start = square_of(row, col)
+        valid_moves = []
+        for move in self.legal_move_list():
+            # Promotions are listed once per piece type; the board only needs the square
+            if move & 63 == start and move >> 12 in (0, QUEEN):
+                valid_moves.append(row_col(move >> 6 & 63))
+        return valid_moves
+
+    def is_in_check(self, color, position=None):
+        position = position or self.position
+        color = COLOR_NAMES.index(color) if isinstance(color, str) else color
+        CHECK_TESTS.inc()
+        return in_check(position, color)
+    
+    def find_king(self, color):
+        square = self.position.king_square[COLOR_NAMES.index(color)]
+        return row_col(square) if square is not None else None
+
+    def has_legal_moves(self):
+        return bool(self.legal_move_list())
+
+    def is_checkmate(self):
+        return not self.has_legal_moves() and self.is_in_check(self.turn)
+
+    def is_stalemate(self):
+        return not self.has_legal_moves() and not self.is_in_check(self.turn)
+
+    def is_repetition(self, count=3):
+        # Whether the current position has now occurred count times. Only
+        # positions since the last capture or pawn move can repeat it, and
+        # only every other one has the same side to move.
+        hashes = self.hashes
+        key = hashes[-1]
+        first = max(0, len(hashes) - 1 - self.position.halfmove_clock)
+        seen = 0
+        for index in range(len(hashes) - 1, first - 1, -2):
+            if hashes[index] == key:
+                seen += 1
+                if seen >= count:
+                    return True
+        return False
+
+    def update_status(self):
+        # Decide after each change whether the game is over, from the one
+        # cached move generation for the position
+        position = self.position
+        reason = None
+        winner = 'draw'
+        if not self.legal_move_list():
+            if self.is_in_check(position.turn):
+                reason = 'checkmate'
+                winner = COLOR_NAMES[position.turn ^ 1]
+            else:
+                reason = 'stalemate'
+        elif position.halfmove_clock >= 100:
+            reason = 'fifty-move rule'
+        elif self.is_repetition():
+            reason = 'threefold repetition'
+        elif insufficient_material(position):
+            reason = 'insufficient material'
+        self.game_over = reason is not None
+        self.winner = winner if reason else None
+        self.end_reason = reason
+        return self.game_over
+    
+    def undo_move(self):
+        if not self.moves:
+            return False  # No move to undo
+
+        # Unwind the last move from its undo record
+        move = self.moves.pop()
+        record = self.undo_records.pop()
+        position = self.position
+        position.pop_packed(move, record)
+        # The record holds the captured piece, except for en passant
+        if record & 15 or (position.squares[move & 63] & 7 == PAWN and move >> 6 & 63 == position.ep_square):
+            self.captured_pieces[self.turn].pop()
+        self.hashes.pop()
+        self.redo_moves.append(move)
+        self.version += 1
+        self.update_status()
+        self.publish()
+        return True
+
+    def redo_move(self):
+        if not self.redo_moves:
+            return False  # Nothing undone to replay
+
+        self.play_move(self.redo_moves.pop())
+        return True
+
+    def get_fen(self):
+        return self.position.to_fen()
+
+    def result(self):
+        # PGN result tag
+        if not self.game_over:
+            return '*'
+        if self.winner == 'draw':
+            return '1/2-1/2'
+        return '1-0' if self.winner == 'white' else '0-1'
+
+    def get_pgn(self, headers=None):
+        return export_pgn(self.start_fen, self.moves, self.result(), headers)
+    
+    def restart_game(self):
+        # Back to the position the game was started from
+        self.position = Position.from_fen(self.start_fen)
+        self.moves = array('H')
+        self.undo_records = array('I')
+        self.redo_moves = array('H')
+        self.hashes = array('Q', [self.position.hash])
+        self.captured_pieces = {'white': [], 'black': []}
+        self.version += 1
+        self.update_status()
+        self.publish()
+
+
+def get_all_possible_moves(game, color):
+    # One generator call yields every move for the side to move
+    if COLOR_NAMES.index(color) != game.position.turn:
+        return []
+    moves = []
+    for move in game.legal_move_list():
+        if move >> 12 in (0, QUEEN):  # make_move always promotes to a queen
+            moves.append({'start': row_col(move & 63), 'end': row_col(move >> 6 & 63)})
+    return moves
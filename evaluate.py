@@ -0,0 +1,170 @@
+# Evaluation tables for the bot.
+#
+# An EvalTables object turns piece values and piece-square tables into one
+# midgame and one endgame score per piece code and square. A Position that
+# uses a set of tables keeps the sums of those scores (from white's point of
+# view) and the game phase up to date in push() and pop(), so the search can
+# read a tapered leaf score in constant time.
+#
+# Tables are written from white's side with black's back rank on the first
+# row, the same order as the board's squares.
+
+from position import WHITE, BLACK, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, make_piece
+
+# Game phase contributed by each piece type; 24 is the full opening phase
+PHASE_WEIGHTS = (0, 0, 1, 1, 2, 4, 0, 0)
+MAX_PHASE = 24
+
+PAWN_TABLE = (
+      0,   0,   0,   0,   0,   0,   0,   0,
+     50,  50,  50,  50,  50,  50,  50,  50,
+     10,  10,  20,  30,  30,  20,  10,  10,
+      5,   5,  10,  25,  25,  10,   5,   5,
+      0,   0,   0,  20,  20,   0,   0,   0,
+      5,  -5, -10,   0,   0, -10,  -5,   5,
+      5,  10,  10, -20, -20,  10,  10,   5,
+      0,   0,   0,   0,   0,   0,   0,   0,
+)
+PAWN_ENDGAME_TABLE = (
+      0,   0,   0,   0,   0,   0,   0,   0,
+     80,  80,  80,  80,  80,  80,  80,  80,
+     50,  50,  50,  50,  50,  50,  50,  50,
+     30,  30,  30,  30,  30,  30,  30,  30,
+     15,  15,  15,  15,  15,  15,  15,  15,
+      5,   5,   5,   5,   5,   5,   5,   5,
+      0,   0,   0,   0,   0,   0,   0,   0,
+      0,   0,   0,   0,   0,   0,   0,   0,
+)
+KNIGHT_TABLE = (
+    -50, -40, -30, -30, -30, -30, -40, -50,
+    -40, -20,   0,   0,   0,   0, -20, -40,
+    -30,   0,  10,  15,  15,  10,   0, -30,
+    -30,   5,  15,  20,  20,  15,   5, -30,
+    -30,   0,  15,  20,  20,  15,   0, -30,
+    -30,   5,  10,  15,  15,  10,   5, -30,
+    -40, -20,   0,   5,   5,   0, -20, -40,
+    -50, -40, -30, -30, -30, -30, -40, -50,
+)
+BISHOP_TABLE = (
+    -20, -10, -10, -10, -10, -10, -10, -20,
+    -10,   0,   0,   0,   0,   0,   0, -10,
+    -10,   0,   5,  10,  10,   5,   0, -10,
+    -10,   5,   5,  10,  10,   5,   5, -10,
+    -10,   0,  10,  10,  10,  10,   0, -10,
+    -10,  10,  10,  10,  10,  10,  10, -10,
+    -10,   5,   0,   0,   0,   0,   5, -10,
+    -20, -10, -10, -10, -10, -10, -10, -20,
+)
+ROOK_TABLE = (
+      0,   0,   0,   0,   0,   0,   0,   0,
+      5,  10,  10,  10,  10,  10,  10,   5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+      0,   0,   0,   5,   5,   0,   0,   0,
+)
+QUEEN_TABLE = (
+    -20, -10, -10,  -5,  -5, -10, -10, -20,
+    -10,   0,   0,   0,   0,   0,   0, -10,
+    -10,   0,   5,   5,   5,   5,   0, -10,
+     -5,   0,   5,   5,   5,   5,   0,  -5,
+      0,   0,   5,   5,   5,   5,   0,  -5,
+    -10,   5,   5,   5,   5,   5,   0, -10,
+    -10,   0,   5,   0,   0,   0,   0, -10,
+    -20, -10, -10,  -5,  -5, -10, -10, -20,
+)
+KING_TABLE = (
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -20, -30, -30, -40, -40, -30, -30, -20,
+    -10, -20, -20, -20, -20, -20, -20, -10,
+     20,  20,   0,   0,   0,   0,  20,  20,
+     20,  30,  10,   0,   0,  10,  30,  20,
+)
+KING_ENDGAME_TABLE = (
+    -50, -40, -30, -20, -20, -30, -40, -50,
+    -30, -20, -10,   0,   0, -10, -20, -30,
+    -30, -10,  20,  30,  30,  20, -10, -30,
+    -30, -10,  30,  40,  40,  30, -10, -30,
+    -30, -10,  30,  40,  40,  30, -10, -30,
+    -30, -10,  20,  30,  30,  20, -10, -30,
+    -30, -30,   0,   0,   0,   0, -30, -30,
+    -50, -30, -30, -30, -30, -30, -30, -50,
+)
+
+EMPTY_TABLE = (0,) * 64
+
+
+class EvalTables:
+    # values are indexed by piece type; tables map a piece type to its
+    # 64-square bonus table
+    def __init__(self, midgame_values, endgame_values, midgame_tables, endgame_tables):
+        self.mg = [[0] * 64 for _ in range(16)]
+        self.eg = [[0] * 64 for _ in range(16)]
+        self.phase = [PHASE_WEIGHTS[piece & 7] for piece in range(16)]  # By piece code
+        for kind in (PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING):
+            white, black = make_piece(WHITE, kind), make_piece(BLACK, kind)
+            for square in range(64):
+                # Black reads the table mirrored top to bottom
+                mirrored = square ^ 56
+                self.mg[white][square] = midgame_values[kind] + midgame_tables[kind][square]
+                self.eg[white][square] = endgame_values[kind] + endgame_tables[kind][square]
+                self.mg[black][square] = -(midgame_values[kind] + midgame_tables[kind][mirrored])
+                self.eg[black][square] = -(endgame_values[kind] + endgame_tables[kind][mirrored])
+
+    def score(self, position):
+        # (midgame, endgame, phase) for a position, computed from scratch
+        mg = eg = phase = 0
+        for square, piece in enumerate(position.squares):
+            if piece:
+                mg += self.mg[piece][square]
+                eg += self.eg[piece][square]
+                phase += self.phase[piece]
+        return mg, eg, phase
+
+
+STANDARD_TABLES = EvalTables(
+    (0, 100, 320, 330, 500, 900, 0),
+    (0, 120, 300, 320, 520, 950, 0),
+    {PAWN: PAWN_TABLE, KNIGHT: KNIGHT_TABLE, BISHOP: BISHOP_TABLE,
+     ROOK: ROOK_TABLE, QUEEN: QUEEN_TABLE, KING: KING_TABLE},
+    {PAWN: PAWN_ENDGAME_TABLE, KNIGHT: KNIGHT_TABLE, BISHOP: BISHOP_TABLE,
+     ROOK: ROOK_TABLE, QUEEN: QUEEN_TABLE, KING: KING_ENDGAME_TABLE},
+)
+
+# Plain material count with no positional knowledge
+MATERIAL_TABLES = EvalTables(
+    (0, 100, 300, 300, 500, 900, 0),
+    (0, 100, 300, 300, 500, 900, 0),
+    {kind: EMPTY_TABLE for kind in (PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING)},
+    {kind: EMPTY_TABLE for kind in (PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING)},
+)
+
+# Evaluation used by each bot difficulty level
+DIFFICULTY_TABLES = {
+    'easy': MATERIAL_TABLES,
+    'hard': STANDARD_TABLES,
+}
+DEFAULT_DIFFICULTY = 'hard'
+
+
+def evaluate(position):
+    # Tapered score for the side to move, read from the position's running
+    # sums; the position must have had use_eval_tables() called on it
+    phase = position.phase
+    if phase > MAX_PHASE:
+        phase = MAX_PHASE
+    score = (position.mg * phase + position.eg * (MAX_PHASE - phase)) // MAX_PHASE
+    return score if position.turn == WHITE else -score
+
+
+def evaluate_board(position, color, tables=STANDARD_TABLES):
+    # Score in centipawns from color's point of view, computed from scratch
+    mg, eg, phase = tables.score(position)
+    phase = min(phase, MAX_PHASE)
+    score = (mg * phase + eg * (MAX_PHASE - phase)) // MAX_PHASE
+    return score if color in ('white', WHITE) else -score
@@ -0,0 +1,150 @@
+# Push channel for game updates, sent to browsers as Server-Sent Events.
+#
+# Every change to a game is published here with the game's version number
+# (one more per change). A move goes out as a small 'move' event (from, to,
+# promotion, captured piece and the game's status); anything else, such as
+# an undo or a restart, goes out as a 'sync' event with the whole state.
+# Each event is encoded once however many clients watch the game.
+#
+# A client that reconnects sends the last version it saw (EventSource does
+# this by itself through Last-Event-ID) and gets the events it missed from a
+# short backlog, or a 'sync' when they are no longer there. Games only have
+# a channel while someone is listening, so publishing to an unwatched game
+# costs a dict lookup.
+#
+# Channels live in one process. With several worker processes sharing a game
+# store, each stream also re-reads its game every poll_seconds and sends a
+# 'sync' when it was changed elsewhere.
+
+import json
+import threading
+from collections import deque
+
+BACKLOG = 64  # Events kept per game for clients that reconnect
+
+
+def _frame(version, name, data):
+    return 'id: %d\nevent: %s\ndata: %s\n\n' % (version, name, json.dumps(data, separators=(',', ':')))
+
+
+def sync_frame(view):
+    return _frame(view.version, 'sync', {
+        'board': view.board,
+        'turn': view.turn,
+        'fen': view.fen,
+        'captured': view.captured,
+        'game_over': view.game_over,
+        'winner': view.winner,
+        'reason': view.reason,
+    })
+
+
+def event_frame(view):
+    # The event for the change that produced view
+    if view.delta is None:
+        return sync_frame(view)
+    return _frame(view.version, 'move', dict(view.delta, turn=view.turn, game_over=view.game_over,
+                                             winner=view.winner, reason=view.reason))
+
+
+class _Channel:
+    __slots__ = ('events', 'count', 'condition', 'listeners')
+
+    def __init__(self):
+        self.events = deque(maxlen=BACKLOG)  # (event number, version, is a move, frame)
+        self.count = 0  # Events published so far
+        self.condition = threading.Condition()
+        self.listeners = 0
+
+
+class GameEvents:
+    def __init__(self):
+        self.channels = {}  # game_id -> _Channel, while someone listens
+        self.lock = threading.Lock()
+
+    def publish(self, game_id, view):
+        # Send the change that produced view to the game's listeners
+        channel = self.channels.get(str(game_id))
+        if channel is None:
+            return
+        frame = event_frame(view)
+        with channel.condition:
+            channel.count += 1
+            channel.events.append((channel.count, view.version, view.delta is not None, frame))
+            channel.condition.notify_all()
+
+    def _join(self, game_id):
+        with self.lock:
+            channel = self.channels.get(game_id)
+            if channel is None:
+                channel = self.channels[game_id] = _Channel()
+            channel.listeners += 1
+            return channel
+
+    def _leave(self, game_id, channel):
+        with self.lock:
+            channel.listeners -= 1
+            if not channel.listeners and self.channels.get(game_id) is channel:
+                del self.channels[game_id]
+
+    def stream(self, game_id, current_view, last_version=None, poll_seconds=15):
+        # SSE text for one client. current_view() returns the game's view, or
+        # None once the game is gone, which ends the stream. The client gets
+        # what it missed since last_version (everything, as a 'sync', when
+        # that is None), then every event as it is published, with a comment
+        # line every poll_seconds to keep the connection open.
+        game_id = str(game_id)
+        channel = self._join(game_id)
+        try:
+            # Joined before reading the view, so no later change is missed
+            with channel.condition:
+                seen = channel.count
+                backlog = list(channel.events)
+            view = current_view()
+            if view is None:
+                return
+            version = view.version
+            if last_version != version:
+                missed = [frame for _, event_version, _, frame in backlog
+                          if last_version is not None and last_version < event_version <= version]
+                if last_version is not None and len(missed) == version - last_version:
+                    yield ''.join(missed)
+                else:
+                    yield sync_frame(view)
+
+            while True:
+                with channel.condition:
+                    if channel.count == seen:
+                        channel.condition.wait(poll_seconds)
+                    fresh = [event for event in channel.events if event[0] > seen]
+                    overflowed = fresh and fresh[0][0] != seen + 1
+                    seen = channel.count
+                if not fresh:
+                    view = current_view()
+                    if view is None:
+                        return
+                    if view.version != version:
+                        version = view.version
+                        yield sync_frame(view)
+                    else:
+                        yield ': keep-alive\n\n'
+                    continue
+                frames = []
+                for _, event_version, is_move, frame in fresh:
+                    if is_move and event_version <= version:
+                        continue  # Already part of the state this client has
+                    if is_move and event_version != version + 1:
+                        overflowed = True
+                        break
+                    frames.append(frame)
+                    version = event_version
+                if overflowed:
+                    # Events were lost to the backlog limit: send the whole state
+                    view = current_view()
+                    if view is None:
+                        return
+                    version = view.version
+                    frames = [sync_frame(view)]
+                yield ''.join(frames)
+        finally:
+            self._leave(game_id, channel)
@@ -0,0 +1,429 @@
+# Storage for ongoing games.
+#
+# GameStore keeps recently used games live in memory, up to a fixed number,
+# and moves the rest into a backend as compact snapshots (bytes produced by
+# the dump function it is given). A game is snapshotted when it falls off
+# the end of the LRU list or has been idle for longer than idle_seconds, and
+# is rebuilt with load the next time it is requested. A backend given a ttl
+# drops snapshots that have not been written for that many seconds.
+#
+# With a backend shared between processes (SQLite file, Redis) pass
+# shared=True: nothing is then cached between requests, every get() reads the
+# snapshot and every save() writes it back, so any worker can serve any game.
+# Each snapshot then carries a version, and save() only writes if the
+# snapshot is still the version the game was loaded from; otherwise another
+# request changed the game meanwhile and save() raises GameConflict.
+#
+# Backends need get(key), put(key, data) and delete(key) on bytes, and for
+# shared stores read(key), which returns (data, version) or (None, None), and
+# replace(key, data, version), which writes only over that version. put()
+# and replace() return the new version, replace() None if it didn't write.
+
+import sqlite3
+import struct
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import redis
+    from redis.exceptions import WatchError
+except ImportError:
+    redis = None
+
+    class WatchError(Exception):
+        pass
+
+
+class GameConflict(Exception):
+    # Another request saved the game after this one loaded it
+    pass
+
+
+class MemoryBackend:
+    # Snapshots in a dict in this process
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self.items = {}  # key -> (data, time stored, version)
+        self.lock = threading.Lock()
+        self.writes = 0  # Also the version of the latest write
+
+    def get(self, key):
+        return self.read(key)[0]
+
+    def read(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item and self.ttl and time.monotonic() - item[1] > self.ttl:
+                del self.items[key]
+                item = None
+            return item[::2] if item else (None, None)
+
+    def put(self, key, data):
+        with self.lock:
+            return self._write(key, data)
+
+    def replace(self, key, data, version):
+        with self.lock:
+            item = self.items.get(key)
+            if not item or item[2] != version:
+                return None
+            return self._write(key, data)
+
+    def _write(self, key, data):
+        # The caller holds the lock
+        self.writes += 1
+        self.items[key] = (data, time.monotonic(), self.writes)
+        if self.ttl and self.writes & 1023 == 0:
+            self.purge()
+        return self.writes
+
+    def delete(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+    def purge(self):
+        # Drop expired snapshots; the caller holds the lock
+        cutoff = time.monotonic() - self.ttl
+        for key in [key for key, item in self.items.items() if item[1] < cutoff]:
+            del self.items[key]
+
+    def __len__(self):
+        return len(self.items)
+
+
+class SQLiteBackend:
+    # Snapshots in a table of a local SQLite database, which several worker
+    # processes on one machine can share
+    def __init__(self, path, ttl=None):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS games (id TEXT PRIMARY KEY, data BLOB NOT NULL, '
+                        'updated REAL NOT NULL, version INTEGER NOT NULL DEFAULT 0)')
+        self.writes = 0
+
+    def get(self, key):
+        return self.read(key)[0]
+
+    def read(self, key):
+        with self.lock:
+            row = self.db.execute('SELECT data, updated, version FROM games WHERE id = ?', (key,)).fetchone()
+        if not row or (self.ttl and time.time() - row[1] > self.ttl):
+            return None, None
+        return bytes(row[0]), row[2]
+
+    def put(self, key, data):
+        with self.lock:
+            # One statement, so the version goes up even with other writers
+            self.db.execute('INSERT INTO games (id, data, updated, version) VALUES (?, ?, ?, 1) '
+                            'ON CONFLICT (id) DO UPDATE SET data = excluded.data, updated = excluded.updated, '
+                            'version = version + 1', (key, data, time.time()))
+            self._wrote()
+            return self.db.execute('SELECT version FROM games WHERE id = ?', (key,)).fetchone()[0]
+
+    def replace(self, key, data, version):
+        with self.lock:
+            cursor = self.db.execute('UPDATE games SET data = ?, updated = ?, version = version + 1 '
+                                     'WHERE id = ? AND version = ?', (data, time.time(), key, version))
+            if cursor.rowcount != 1:
+                return None
+            self._wrote()
+            return version + 1
+
+    def _wrote(self):
+        # The caller holds the lock
+        self.writes += 1
+        if self.ttl and self.writes & 1023 == 0:
+            self.db.execute('DELETE FROM games WHERE updated < ?', (time.time() - self.ttl,))
+
+    def delete(self, key):
+        with self.lock:
+            self.db.execute('DELETE FROM games WHERE id = ?', (key,))
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM games').fetchone()[0]
+
+
+VERSION = struct.Struct('>Q')  # Ahead of each snapshot in Redis
+
+
+class RedisBackend:
+    # Snapshots in Redis, or anything with the same get/set/delete and
+    # pipeline calls (such as FakeRedis), with the TTL left to the server.
+    # Each value is the snapshot's version followed by the snapshot, and
+    # writes are WATCH/MULTI transactions on it.
+    def __init__(self, client, ttl=None, prefix='chess:game:'):
+        self.client = client
+        self.ttl = int(ttl) if ttl else None
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.read(key)[0]
+
+    def read(self, key):
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            return None, None
+        return value[VERSION.size:], VERSION.unpack_from(value)[0]
+
+    def put(self, key, data):
+        while True:
+            version = self._write(key, data, None)
+            if version is not None:
+                return version
+
+    def replace(self, key, data, version):
+        return self._write(key, data, version)
+
+    def _write(self, key, data, version):
+        # Writes data as the version after the stored one, if that is version
+        # (or any with version None); None if it isn't or another client
+        # wrote in between
+        name = self.prefix + key
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(name)
+                value = pipe.get(name)
+                current = VERSION.unpack_from(value)[0] if value is not None else 0
+                if version is not None and (value is None or current != version):
+                    return None
+                pipe.multi()
+                pipe.set(name, VERSION.pack(current + 1) + data, ex=self.ttl)
+                pipe.execute()
+            except WatchError:
+                return None
+        return current + 1
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+
+class FakeRedis:
+    # In-process stand-in for the part of the redis.Redis client that
+    # RedisBackend uses, for development and single-process runs
+    def __init__(self):
+        self.items = {}  # key -> (value, expiry time or None)
+        self.lock = threading.Lock()
+
+    def get(self, name):
+        with self.lock:
+            item = self.items.get(name)
+            if item and item[1] is not None and time.monotonic() >= item[1]:
+                del self.items[name]
+                return None
+            return item[0] if item else None
+
+    def set(self, name, value, ex=None):
+        with self.lock:
+            self.items[name] = (bytes(value), time.monotonic() + ex if ex else None)
+        return True
+
+    def delete(self, *names):
+        with self.lock:
+            return sum(self.items.pop(name, None) is not None for name in names)
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    # A WATCH/MULTI/EXEC transaction on a FakeRedis: commands after multi()
+    # are queued, and execute() runs them only if no watched key was
+    # written since watch()
+    def __init__(self, client):
+        self.client = client
+        self.watched = {}  # name -> item when watched
+        self.queued = None
+
+    def watch(self, *names):
+        with self.client.lock:
+            for name in names:
+                self.watched[name] = self.client.items.get(name)
+
+    def get(self, name):
+        return self.client.get(name)
+
+    def multi(self):
+        self.queued = []
+
+    def set(self, name, value, ex=None):
+        self.queued.append((name, value, ex))
+
+    def execute(self):
+        client = self.client
+        with client.lock:
+            if any(client.items.get(name) is not item for name, item in self.watched.items()):
+                raise WatchError('Watched variable changed.')
+            for name, value, ex in self.queued:
+                client.items[name] = (bytes(value), time.monotonic() + ex if ex else None)
+        results = [True] * len(self.queued)
+        self.reset()
+        return results
+
+    def reset(self):
+        self.watched = {}
+        self.queued = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.reset()
+
+
+class GameStore:
+    def __init__(self, backend, dump, load, max_games=1000, idle_seconds=1800, shared=False):
+        self.backend = backend
+        self.dump = dump  # game -> bytes
+        self.load = load  # bytes -> game
+        self.max_games = max_games
+        self.idle_seconds = idle_seconds
+        self.shared = shared
+        self.live = OrderedDict()  # game_id -> [game, last used], oldest first
+        self.lock = threading.RLock()
+        self.last_sweep = time.monotonic()
+        self.evictions = 0
+
+    def get(self, game_id, default=None):
+        if game_id is None:
+            return default
+        game_id = str(game_id)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.live.get(game_id)
+            if entry:
+                entry[1] = now
+                self.live.move_to_end(game_id)
+                self._sweep(now)
+                return entry[0]
+        if self.shared:
+            data, version = self.backend.read(game_id)
+            if data is None:
+                return default
+            game = self.load(data)
+            game.store_version = version  # What save() expects to write over
+            return game
+        data = self.backend.get(game_id)
+        if data is None:
+            return default
+        game = self.load(data)
+        with self.lock:
+            # Another thread may have loaded it meanwhile; keep one copy
+            entry = self.live.get(game_id)
+            if entry:
+                return entry[0]
+            self._add(game_id, game, now)
+            self.backend.delete(game_id)
+        return game
+
+    @contextmanager
+    def locked(self, game_id, game=None):
+        # The live game (game if it is given and still live) with its lock
+        # held, for a request that changes it, or None if there is no such
+        # game. A game snapshotted between get() and the lock being taken is
+        # loaded again, so the change isn't made to a copy nobody will see.
+        if game is None:
+            game = self.get(game_id)
+        while game is not None:
+            with game.lock:
+                if not game.evicted:
+                    yield game
+                    return
+            game = self.get(game_id)
+        yield None
+
+    def __getitem__(self, game_id):
+        game = self.get(game_id)
+        if game is None:
+            raise KeyError(game_id)
+        return game
+
+    def __setitem__(self, game_id, game):
+        game_id = str(game_id)
+        if self.shared:
+            game.store_version = self.backend.put(game_id, self.dump(game))
+            return
+        with self.lock:
+            self.live.pop(game_id, None)
+            self._add(game_id, game, time.monotonic())
+        self.backend.delete(game_id)  # Drop any stale snapshot
+
+    def save(self, game_id, game):
+        # Called after a game changes; only shared stores have to write it
+        # out, and raise GameConflict if another request saved it first
+        if self.shared:
+            version = self.backend.replace(str(game_id), self.dump(game), game.store_version)
+            if version is None:
+                raise GameConflict(game_id)
+            game.store_version = version
+
+    def __delitem__(self, game_id):
+        game_id = str(game_id)
+        with self.lock:
+            self.live.pop(game_id, None)
+        self.backend.delete(game_id)
+
+    def __contains__(self, game_id):
+        return self.get(game_id) is not None
+
+    def __len__(self):
+        # Games held live in this process
+        return len(self.live)
+
+    def _add(self, game_id, game, now):
+        # The caller holds the lock
+        self.live[game_id] = [game, now]
+        if len(self.live) > self.max_games:
+            for old_id in list(self.live)[:-1]:
+                if self._evict(old_id) and len(self.live) <= self.max_games:
+                    break
+        self._sweep(now)
+
+    def _sweep(self, now):
+        # Snapshot games idle for too long, at most once every few seconds
+        if not self.idle_seconds or now - self.last_sweep < min(self.idle_seconds, 10):
+            return
+        self.last_sweep = now
+        cutoff = now - self.idle_seconds
+        for game_id, entry in list(self.live.items()):
+            if entry[1] >= cutoff:
+                break  # The rest were used more recently
+            self._evict(game_id)
+
+    def _evict(self, game_id):
+        # Games whose lock is held are in use and stay live for now; a
+        # snapshot taken mid-request would lose the request's change. The
+        # game is marked evicted so that a request which got it before this
+        # and takes its lock after knows to load it again (see locked()).
+        game = self.live[game_id][0]
+        lock = getattr(game, 'lock', None)
+        if lock is not None and not lock.acquire(blocking=False):
+            return False
+        try:
+            self.backend.put(game_id, self.dump(game))
+            del self.live[game_id]
+            game.evicted = True
+        finally:
+            if lock is not None:
+                lock.release()
+        self.evictions += 1
+        return True
+
+
+def open_backend(url, ttl=None):
+    # memory, fakeredis, sqlite:///path/to/file.db or redis://host:port/db
+    if url in ('', 'memory'):
+        return MemoryBackend(ttl)
+    if url == 'fakeredis':
+        return RedisBackend(FakeRedis(), ttl)
+    if url.startswith('sqlite:///'):
+        return SQLiteBackend(url[len('sqlite:///'):], ttl)
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        if redis is None:
+            raise RuntimeError('The redis package is needed for a Redis game store')
+        return RedisBackend(redis.Redis.from_url(url), ttl)
+    raise ValueError('Unknown game store: ' + url)
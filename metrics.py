@@ -0,0 +1,218 @@
+# Counters, histograms and a sampling profiler for the server.
+#
+# Modules declare their metrics once at import time:
+#
+#   MOVES = metrics.counter('chess_moves_total', 'Moves played', ('source',))
+#   MOVES.inc('bot')
+#
+# and render() writes every declared metric in the Prometheus text format
+# for the /metrics endpoint. Values are kept per process, so with several
+# server processes each one is scraped on its own.
+#
+# With enabled set to False every inc() and observe() returns straight
+# away, which keeps the cost of the calls on the request path to a global
+# lookup. Nothing counts inside the search itself: its node counts and
+# times come from the result of each search.
+
+import bisect
+import itertools
+import os
+import sys
+import threading
+from collections import Counter as _Tally, OrderedDict
+
+enabled = True
+
+# Seconds; suits request and search times
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_metrics = []  # In the order they were declared
+_lock = threading.Lock()
+
+
+def _labels(names, values, extra=''):
+    pairs = ['%s="%s"' % (name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+             for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{%s}' % ','.join(pairs) if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, label_names=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        # label values -> count; one without labels reads 0 until counted
+        self.values = {} if self.label_names else {(): 0}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels):
+        if not enabled:
+            return
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + 1
+
+    def add(self, amount, *labels):
+        if not enabled:
+            return
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        return ['%s%s %s' % (self.name, _labels(self.label_names, labels), _number(value))
+                for labels, value in items]
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count per bucket, count above the last bucket, sum]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        if not enabled:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self.lock:
+            items = sorted((labels, list(counts)) for labels, counts in self.values.items())
+        lines = []
+        for labels, counts in items:
+            total = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                total += count
+                lines.append('%s_bucket%s %d' % (self.name, _labels(self.label_names, labels,
+                                                                     'le="%s"' % _number(float(bound))), total))
+            lines.append('%s_sum%s %s' % (self.name, _labels(self.label_names, labels), _number(counts[-1])))
+            lines.append('%s_count%s %d' % (self.name, _labels(self.label_names, labels), total))
+        return lines
+
+
+class Reading:
+    # A value read from elsewhere when the metrics are rendered, such as the
+    # number of live games. kind is 'gauge', or 'counter' for running totals
+    # that something else keeps.
+    def __init__(self, name, help, read, kind='gauge'):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.kind = kind
+
+    def samples(self):
+        return ['%s %s' % (self.name, _number(self.read()))]
+
+
+def _declare(metric):
+    with _lock:
+        _metrics.append(metric)
+    return metric
+
+
+def counter(name, help, label_names=()):
+    return _declare(Counter(name, help, label_names))
+
+
+def histogram(name, help, label_names=(), buckets=DEFAULT_BUCKETS):
+    return _declare(Histogram(name, help, label_names, buckets))
+
+
+def reading(name, help, read, kind='gauge'):
+    return _declare(Reading(name, help, read, kind))
+
+
+def render():
+    # Every metric in the Prometheus text exposition format
+    with _lock:
+        declared = list(_metrics)
+    lines = []
+    for metric in declared:
+        lines.append('# HELP %s %s' % (metric.name, metric.help))
+        lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+
+class SamplingProfiler:
+    # Records where one thread spends its time: a helper thread looks at the
+    # thread's stack every interval seconds and counts each stack it sees.
+    # The helper needs the GIL to look, so a thread that is busy in Python
+    # is sampled about once per switch interval (5 ms by default) however
+    # short interval is.
+    def __init__(self, thread_id=None, interval=0.001):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks = _Tally()  # 'outermost;...;innermost' -> samples
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        return self
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                return
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('%s (%s)' % (code.co_name, os.path.basename(code.co_filename)))
+                frame = frame.f_back
+            stack.reverse()
+            self.stacks[';'.join(stack)] += 1
+
+    def collapsed(self):
+        # One 'stack count' line per stack, the input flamegraph.pl and
+        # speedscope read, most sampled first
+        return ''.join('%s %d\n' % item for item in self.stacks.most_common())
+
+
+class ProfileStore:
+    # The latest finished profiles by id, for fetching after the request
+    def __init__(self, size=32):
+        self.size = size
+        self.profiles = OrderedDict()
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def add(self, text):
+        with self.lock:
+            profile_id = '%x' % next(self.ids)
+            self.profiles[profile_id] = text
+            while len(self.profiles) > self.size:
+                self.profiles.popitem(last=False)
+        return profile_id
+
+    def get(self, profile_id):
+        with self.lock:
+            return self.profiles.get(profile_id)
@@ -0,0 +1,403 @@
+# Bitboard move generation for Position.
+#
+# Bit n of a bitboard is square n of the position (row * 8 + col), so
+# moving "up" the board towards black's back rank is a right shift by 8.
+# Moves are packed into ints: start | end << 6 | promotion << 12.
+
+from position import (WHITE, BLACK, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING,
+                      WHITE_KING_SIDE, WHITE_QUEEN_SIDE, BLACK_KING_SIDE, BLACK_QUEEN_SIDE)
+
+FULL = (1 << 64) - 1
+FILE_A = sum(1 << (row * 8) for row in range(8))
+FILE_H = FILE_A << 7
+ROW_BITS = [0xFF << (row * 8) for row in range(8)]
+LIGHT_SQUARES = sum(1 << square for square in range(64) if not (square >> 3) + (square & 7) & 1)
+PROMOTION_TYPES = (QUEEN, ROOK, BISHOP, KNIGHT)
+
+
+def encode_move(start, end, promotion=0):
+    return start | end << 6 | promotion << 12
+
+
+def move_start(move):
+    return move & 63
+
+
+def move_end(move):
+    return move >> 6 & 63
+
+
+def move_promotion(move):
+    return move >> 12
+
+
+def _step_attacks(offsets):
+    table = []
+    for square in range(64):
+        row, col = square >> 3, square & 7
+        bits = 0
+        for dr, dc in offsets:
+            r, c = row + dr, col + dc
+            if 0 <= r < 8 and 0 <= c < 8:
+                bits |= 1 << (r * 8 + c)
+        table.append(bits)
+    return table
+
+
+def _ray_attacks(dr, dc):
+    table = []
+    for square in range(64):
+        row, col = square >> 3, square & 7
+        bits = 0
+        r, c = row + dr, col + dc
+        while 0 <= r < 8 and 0 <= c < 8:
+            bits |= 1 << (r * 8 + c)
+            r, c = r + dr, c + dc
+        table.append(bits)
+    return table
+
+
+KNIGHT_ATTACKS = _step_attacks([(2, 1), (2, -1), (-2, 1), (-2, -1), (1, 2), (1, -2), (-1, 2), (-1, -2)])
+KING_ATTACKS = _step_attacks([(1, 0), (1, 1), (1, -1), (0, 1), (0, -1), (-1, 0), (-1, 1), (-1, -1)])
+# Squares a pawn of each color attacks from a square
+PAWN_ATTACKS = (_step_attacks([(-1, -1), (-1, 1)]), _step_attacks([(1, -1), (1, 1)]))
+
+# Classical ray lookups. Rays towards higher square numbers are blocked by
+# the lowest set bit, rays towards lower ones by the highest.
+ROOK_DIRECTIONS = ((1, 0), (0, 1), (-1, 0), (0, -1))
+BISHOP_DIRECTIONS = ((1, 1), (1, -1), (-1, -1), (-1, 1))
+ROOK_RAYS = [(_ray_attacks(dr, dc), dr * 8 + dc > 0) for dr, dc in ROOK_DIRECTIONS]
+BISHOP_RAYS = [(_ray_attacks(dr, dc), dr * 8 + dc > 0) for dr, dc in BISHOP_DIRECTIONS]
+
+
+def _line_tables():
+    # BETWEEN[a][b]: squares strictly between two aligned squares.
+    # LINE[a][b]: the whole line through them, both ends included.
+    between = [[0] * 64 for _ in range(64)]
+    line = [[0] * 64 for _ in range(64)]
+    for square in range(64):
+        row, col = square >> 3, square & 7
+        for dr, dc in ROOK_DIRECTIONS + BISHOP_DIRECTIONS:
+            full = 1 << square
+            r, c = row - dr, col - dc
+            while 0 <= r < 8 and 0 <= c < 8:
+                full |= 1 << (r * 8 + c)
+                r, c = r - dr, c - dc
+            r, c = row + dr, col + dc
+            while 0 <= r < 8 and 0 <= c < 8:
+                full |= 1 << (r * 8 + c)
+                r, c = r + dr, c + dc
+            path = 0
+            r, c = row + dr, col + dc
+            while 0 <= r < 8 and 0 <= c < 8:
+                target = r * 8 + c
+                between[square][target] = path
+                line[square][target] = full
+                path |= 1 << target
+                r, c = r + dr, c + dc
+    return between, line
+
+
+BETWEEN, LINE = _line_tables()
+
+
+def _slider_attacks(rays, square, occupied):
+    attacks = 0
+    for table, positive in rays:
+        ray = table[square]
+        blockers = ray & occupied
+        if blockers:
+            if positive:
+                first = (blockers & -blockers).bit_length() - 1
+            else:
+                first = blockers.bit_length() - 1
+            ray ^= table[first]
+        attacks |= ray
+    return attacks
+
+
+def rook_attacks(square, occupied):
+    return _slider_attacks(ROOK_RAYS, square, occupied)
+
+
+def bishop_attacks(square, occupied):
+    return _slider_attacks(BISHOP_RAYS, square, occupied)
+
+
+def attacks_by(position, color):
+    # Every square the given side attacks
+    pieces = position.pieces
+    occupied = position.occupied[0] | position.occupied[1]
+    base = color << 3
+    attacks = 0
+
+    pawns = pieces[base | PAWN]
+    if color == WHITE:
+        attacks |= (pawns & ~FILE_A) >> 9 | (pawns & ~FILE_H) >> 7
+    else:
+        attacks |= ((pawns & ~FILE_A) << 7 | (pawns & ~FILE_H) << 9) & FULL
+
+    bits = pieces[base | KNIGHT]
+    while bits:
+        low = bits & -bits
+        attacks |= KNIGHT_ATTACKS[low.bit_length() - 1]
+        bits ^= low
+    bits = pieces[base | BISHOP] | pieces[base | QUEEN]
+    while bits:
+        low = bits & -bits
+        attacks |= bishop_attacks(low.bit_length() - 1, occupied)
+        bits ^= low
+    bits = pieces[base | ROOK] | pieces[base | QUEEN]
+    while bits:
+        low = bits & -bits
+        attacks |= rook_attacks(low.bit_length() - 1, occupied)
+        bits ^= low
+    king = position.king_square[color]
+    if king is not None:
+        attacks |= KING_ATTACKS[king]
+    return attacks
+
+
+def attackers_of(position, square, by_color, occupied=None):
+    # Bitboard of by_color's pieces attacking the square, found by looking
+    # outward from the square with each piece's attack pattern
+    pieces = position.pieces
+    base = by_color << 3
+    if occupied is None:
+        occupied = position.occupied[0] | position.occupied[1]
+    queens = pieces[base | QUEEN]
+    return (PAWN_ATTACKS[by_color ^ 1][square] & pieces[base | PAWN]
+            | KNIGHT_ATTACKS[square] & pieces[base | KNIGHT]
+            | KING_ATTACKS[square] & pieces[base | KING]
+            | bishop_attacks(square, occupied) & (pieces[base | BISHOP] | queens)
+            | rook_attacks(square, occupied) & (pieces[base | ROOK] | queens))
+
+
+def is_square_attacked(position, square, by_color, occupied=None):
+    pieces = position.pieces
+    base = by_color << 3
+    if PAWN_ATTACKS[by_color ^ 1][square] & pieces[base | PAWN]:
+        return True
+    if KNIGHT_ATTACKS[square] & pieces[base | KNIGHT]:
+        return True
+    if KING_ATTACKS[square] & pieces[base | KING]:
+        return True
+    if occupied is None:
+        occupied = position.occupied[0] | position.occupied[1]
+    queens = pieces[base | QUEEN]
+    if bishop_attacks(square, occupied) & (pieces[base | BISHOP] | queens):
+        return True
+    return bool(rook_attacks(square, occupied) & (pieces[base | ROOK] | queens))
+
+
+def pinned_pieces(position, color):
+    # Pieces of the given color that shield their king from an enemy slider
+    king = position.king_square[color]
+    if king is None:
+        return 0
+    pieces = position.pieces
+    enemy = (color ^ 1) << 3
+    own = position.occupied[color]
+    occupied = own | position.occupied[color ^ 1]
+    queens = pieces[enemy | QUEEN]
+    snipers = (rook_attacks(king, 0) & (pieces[enemy | ROOK] | queens)
+               | bishop_attacks(king, 0) & (pieces[enemy | BISHOP] | queens))
+    pinned = 0
+    while snipers:
+        low = snipers & -snipers
+        snipers ^= low
+        blockers = BETWEEN[king][low.bit_length() - 1] & occupied
+        if blockers and not blockers & (blockers - 1) and blockers & own:
+            pinned |= blockers
+    return pinned
+
+
+def in_check(position, color):
+    king = position.king_square[color]
+    return king is not None and is_square_attacked(position, king, color ^ 1)
+
+
+def insufficient_material(position):
+    # True when neither side can ever mate: bare kings, a single knight or
+    # bishop, or only bishops that all stand on squares of one colour
+    pieces = position.pieces
+    for color in (WHITE, BLACK):
+        if pieces[color << 3 | PAWN] or pieces[color << 3 | ROOK] or pieces[color << 3 | QUEEN]:
+            return False
+    knights = pieces[KNIGHT] | pieces[BLACK << 3 | KNIGHT]
+    bishops = pieces[BISHOP] | pieces[BLACK << 3 | BISHOP]
+    minors = bin(knights | bishops).count('1')
+    if minors <= 1:
+        return True
+    return not knights and (not bishops & LIGHT_SQUARES or not bishops & ~LIGHT_SQUARES)
+
+
+def _add_targets(moves, start, targets):
+    while targets:
+        low = targets & -targets
+        moves.append(start | (low.bit_length() - 1) << 6)
+        targets ^= low
+
+
+def _add_pawn_moves(moves, targets, offset):
+    # offset is end - start for every move in targets
+    while targets:
+        low = targets & -targets
+        end = low.bit_length() - 1
+        targets ^= low
+        start = end - offset
+        if end < 8 or end >= 56:
+            for promotion in PROMOTION_TYPES:
+                moves.append(start | end << 6 | promotion << 12)
+        else:
+            moves.append(start | end << 6)
+
+
+def generate_pseudo_legal(position, captures_only=False):
+    # All moves for the side to move, ignoring whether they leave the king in
+    # check. captures_only keeps captures and promotions, for quiescence search.
+    moves = []
+    color = position.turn
+    pieces = position.pieces
+    own = position.occupied[color]
+    enemy = position.occupied[color ^ 1]
+    occupied = own | enemy
+    empty = ~occupied & FULL
+    base = color << 3
+
+    pawns = pieces[base | PAWN]
+    enemy_or_ep = enemy
+    if position.ep_square is not None:
+        enemy_or_ep |= 1 << position.ep_square
+    if color == WHITE:
+        single = pawns >> 8 & empty
+        if captures_only:
+            _add_pawn_moves(moves, single & ROW_BITS[0], -8)
+        else:
+            _add_pawn_moves(moves, single, -8)
+            _add_pawn_moves(moves, (single & ROW_BITS[5]) >> 8 & empty, -16)
+        _add_pawn_moves(moves, (pawns & ~FILE_A) >> 9 & enemy_or_ep, -9)
+        _add_pawn_moves(moves, (pawns & ~FILE_H) >> 7 & enemy_or_ep, -7)
+    else:
+        single = pawns << 8 & empty
+        if captures_only:
+            _add_pawn_moves(moves, single & ROW_BITS[7], 8)
+        else:
+            _add_pawn_moves(moves, single, 8)
+            _add_pawn_moves(moves, (single & ROW_BITS[2]) << 8 & empty, 16)
+        _add_pawn_moves(moves, (pawns & ~FILE_A) << 7 & enemy_or_ep, 7)
+        _add_pawn_moves(moves, (pawns & ~FILE_H) << 9 & enemy_or_ep, 9)
+
+    not_own = enemy if captures_only else ~own
+    bits = pieces[base | KNIGHT]
+    while bits:
+        low = bits & -bits
+        start = low.bit_length() - 1
+        _add_targets(moves, start, KNIGHT_ATTACKS[start] & not_own)
+        bits ^= low
+    bits = pieces[base | BISHOP]
+    while bits:
+        low = bits & -bits
+        start = low.bit_length() - 1
+        _add_targets(moves, start, bishop_attacks(start, occupied) & not_own)
+        bits ^= low
+    bits = pieces[base | ROOK]
+    while bits:
+        low = bits & -bits
+        start = low.bit_length() - 1
+        _add_targets(moves, start, rook_attacks(start, occupied) & not_own)
+        bits ^= low
+    bits = pieces[base | QUEEN]
+    while bits:
+        low = bits & -bits
+        start = low.bit_length() - 1
+        _add_targets(moves, start, (rook_attacks(start, occupied) | bishop_attacks(start, occupied)) & not_own)
+        bits ^= low
+
+    king = position.king_square[color]
+    if king is not None:
+        _add_targets(moves, king, KING_ATTACKS[king] & not_own)
+        if not captures_only:
+            _add_castling_moves(moves, position, color, occupied)
+    return moves
+
+
+def _add_castling_moves(moves, position, color, occupied):
+    castling = position.castling
+    if color == WHITE:
+        if not castling & (WHITE_KING_SIDE | WHITE_QUEEN_SIDE):
+            return
+        king_side, queen_side, king = WHITE_KING_SIDE, WHITE_QUEEN_SIDE, 60
+    else:
+        if not castling & (BLACK_KING_SIDE | BLACK_QUEEN_SIDE):
+            return
+        king_side, queen_side, king = BLACK_KING_SIDE, BLACK_QUEEN_SIDE, 4
+    # The king may not castle out of, through or into check. A right is only
+    # kept while its rook is at home, but check the rook anyway: castling
+    # with a missing one would put a phantom rook on the board.
+    squares = position.squares
+    rook = color << 3 | ROOK
+    kings_path_free = castling & king_side and not occupied & (3 << (king + 1)) and squares[king + 3] == rook
+    queens_path_free = castling & queen_side and not occupied & (7 << (king - 3)) and squares[king - 4] == rook
+    if not (kings_path_free or queens_path_free):
+        return
+    attacked = attacks_by(position, color ^ 1)
+    if kings_path_free and not attacked & (7 << king):
+        moves.append(king | (king + 2) << 6)
+    if queens_path_free and not attacked & (7 << (king - 2)):
+        moves.append(king | (king - 2) << 6)
+
+
+def generate_legal(position, captures_only=False):
+    # Legal moves from the check and pin rays around the king, so only
+    # en-passant captures ever need to be played out to test them
+    color = position.turn
+    king = position.king_square[color]
+    moves = generate_pseudo_legal(position, captures_only)
+    if king is None:
+        return moves
+    enemy = color ^ 1
+    occupied = position.occupied[0] | position.occupied[1]
+    checkers = attackers_of(position, king, enemy, occupied)
+    if checkers & (checkers - 1):
+        evasions = 0  # Double check: only the king can move
+    elif checkers:
+        evasions = checkers | BETWEEN[king][checkers.bit_length() - 1]
+    else:
+        evasions = FULL
+    pinned = pinned_pieces(position, color)
+    line = LINE[king]
+    without_king = occupied ^ (1 << king)
+    ep_square = position.ep_square
+    squares = position.squares
+
+    legal = []
+    for move in moves:
+        start = move & 63
+        end = move >> 6 & 63
+        if start == king:
+            # Castling was already checked for attacked squares
+            if abs(end - start) == 2 or not is_square_attacked(position, end, enemy, without_king):
+                legal.append(move)
+        elif end == ep_square and squares[start] & 7 == PAWN:
+            # Two pawns leave the row at once, which pin rays can't describe
+            position.push(move)
+            if not in_check(position, color):
+                legal.append(move)
+            position.pop()
+        elif evasions >> end & 1 and (not pinned >> start & 1 or line[start] >> end & 1):
+            legal.append(move)
+    return legal
+
+
+def perft(position, depth):
+    # Count leaf nodes of the legal move tree, for checking the generator
+    moves = generate_legal(position)
+    if depth <= 1:
+        return len(moves) if depth == 1 else 1
+    nodes = 0
+    for move in moves:
+        position.push(move)
+        nodes += perft(position, depth - 1)
+        position.pop()
+    return nodes
@@ -0,0 +1,171 @@
+# Move notation: square names, UCI-style move strings, SAN and PGN.
+
+import re
+
+from position import Position, WHITE, PAWN, KING
+from movegen import generate_legal, in_check
+
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+FILES = 'abcdefgh'
+PIECE_LETTERS = ' PNBRQK'
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+
+
+def square_name(square):
+    return FILES[square & 7] + str(8 - (square >> 3))
+
+
+def parse_square(name):
+    if len(name) != 2 or name[0] not in FILES or name[1] not in '12345678':
+        raise ValueError('Bad square: ' + name)
+    return (8 - int(name[1])) * 8 + FILES.index(name[0])
+
+
+def move_to_uci(move):
+    text = square_name(move & 63) + square_name(move >> 6 & 63)
+    if move >> 12:
+        text += PIECE_LETTERS[move >> 12].lower()
+    return text
+
+
+def parse_uci(position, text):
+    # Returns the legal move written as e2e4 / e7e8q, or raises ValueError
+    text = text.strip().lower()
+    for move in generate_legal(position):
+        if move_to_uci(move) == text:
+            return move
+    raise ValueError('Illegal move: ' + text)
+
+
+def move_to_san(position, move, legal_moves=None):
+    # SAN for a legal move in the given position (which is left unchanged)
+    if legal_moves is None:
+        legal_moves = generate_legal(position)
+    start = move & 63
+    end = move >> 6 & 63
+    piece = position.squares[start]
+    kind = piece & 7
+
+    if kind == KING and abs(start - end) == 2:
+        text = 'O-O' if end > start else 'O-O-O'
+    else:
+        capture = bool(position.squares[end]) or (kind == PAWN and end == position.ep_square)
+        if kind == PAWN:
+            text = FILES[start & 7] + 'x' if capture else ''
+        else:
+            text = PIECE_LETTERS[kind]
+            # Disambiguate from other pieces of the same kind reaching the square
+            rivals = [other & 63 for other in legal_moves
+                      if other != move and other >> 6 & 63 == end and other & 63 != start
+                      and position.squares[other & 63] == piece]
+            if rivals:
+                if all(rival & 7 != start & 7 for rival in rivals):
+                    text += FILES[start & 7]
+                elif all(rival >> 3 != start >> 3 for rival in rivals):
+                    text += str(8 - (start >> 3))
+                else:
+                    text += square_name(start)
+            if capture:
+                text += 'x'
+        text += square_name(end)
+        if move >> 12:
+            text += '=' + PIECE_LETTERS[move >> 12]
+
+    position.push(move)
+    if in_check(position, position.turn):
+        text += '#' if not generate_legal(position) else '+'
+    position.pop()
+    return text
+
+
+def parse_san(position, text):
+    # Returns the legal move written in SAN, or raises ValueError
+    wanted = re.sub(r'[+#!?]+$', '', text.strip()).replace('0', 'O')
+    legal_moves = generate_legal(position)
+    for move in legal_moves:
+        if re.sub(r'[+#]$', '', move_to_san(position, move, legal_moves)) == wanted:
+            return move
+    raise ValueError('Illegal or ambiguous move: ' + text)
+
+
+def export_pgn(start_fen, moves, result='*', headers=None):
+    # PGN text for a list of packed moves played from start_fen
+    position = Position.from_fen(start_fen)
+    tags = [('Event', '?'), ('Site', '?'), ('Date', '????.??.??'), ('Round', '?'),
+            ('White', '?'), ('Black', '?')]
+    if headers:
+        tags = [(name, headers.get(name, value)) for name, value in tags]
+        tags += [(name, value) for name, value in headers.items() if name not in dict(tags)]
+    tags.append(('Result', result))
+    if start_fen != START_FEN:
+        tags += [('SetUp', '1'), ('FEN', start_fen)]
+
+    tokens = []
+    for index, move in enumerate(moves):
+        if position.turn == WHITE:
+            tokens.append('%d.' % position.fullmove_number)
+        elif index == 0:
+            tokens.append('%d...' % position.fullmove_number)
+        tokens.append(move_to_san(position, move))
+        position.push(move)
+    tokens.append(result)
+
+    # Wrap the movetext at 80 columns as the PGN export format asks
+    lines = []
+    line = ''
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > 80:
+            lines.append(line)
+            line = token
+        else:
+            line = line + ' ' + token if line else token
+    lines.append(line)
+    header_text = ''.join('[%s "%s"]\n' % (name, str(value).replace('"', "'")) for name, value in tags)
+    return header_text + '\n' + '\n'.join(lines) + '\n'
+
+
+def parse_pgn(text):
+    # Returns (headers, start FEN, packed moves, result) for the first game
+    # in the text. Comments, variations and annotations are skipped.
+    headers = dict(re.findall(r'^\[(\w+)\s+"(.*)"\]\s*$', text, re.MULTILINE))
+    movetext = re.sub(r'^\[.*\]\s*$', '', text, flags=re.MULTILINE)
+    movetext = re.sub(r'\{[^}]*\}|;[^\n]*', ' ', movetext)
+    while '(' in movetext:
+        stripped = re.sub(r'\([^()]*\)', ' ', movetext)
+        if stripped == movetext:
+            raise ValueError('Unbalanced variation in PGN')
+        movetext = stripped
+
+    start_fen = headers.get('FEN', START_FEN)
+    position = Position.from_fen(start_fen)
+    moves = []
+    result = headers.get('Result', '*')
+    for token in movetext.split():
+        if token in RESULTS:
+            result = token
+            break
+        token = re.sub(r'^\d+\.+', '', token)
+        if not token or token.startswith('$'):
+            continue
+        move = parse_san(position, token)
+        moves.append(move)
+        position.push(move)
+    return headers, start_fen, moves, result
+
+
+def split_pgn(text):
+    # The games of a multi-game PGN file, as separate texts for parse_pgn()
+    games = []
+    current = []
+    in_moves = False
+    for line in text.splitlines():
+        if line.startswith('[') and in_moves:
+            games.append('\n'.join(current))
+            current = []
+            in_moves = False
+        elif line.strip() and not line.startswith('['):
+            in_moves = True
+        current.append(line)
+    if any(line.strip() for line in current):
+        games.append('\n'.join(current))
+    return games
@@ -0,0 +1,469 @@
+# Compact board representation used by ChessGame.
+#
+# Squares are numbered 0..63 as row * 8 + col, with row 0 being black's back
+# rank, so they line up with the [row, col] pairs used by the routes.
+# Pieces are small ints: color << 3 | piece type, 0 for an empty square.
+
+from zobrist import PIECE_KEYS, CASTLING_KEYS, EP_FILE_KEYS, BLACK_TO_MOVE_KEY
+
+WHITE, BLACK = 0, 1
+COLOR_NAMES = ('white', 'black')
+
+EMPTY = 0
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = 1, 2, 3, 4, 5, 6
+PIECE_NAMES = ('', 'pawn', 'knight', 'bishop', 'rook', 'queen', 'king')
+
+# Castling rights bits
+WHITE_KING_SIDE, WHITE_QUEEN_SIDE = 1, 2
+BLACK_KING_SIDE, BLACK_QUEEN_SIDE = 4, 8
+ALL_CASTLING = 15
+
+
+def make_piece(color, piece_type):
+    return color << 3 | piece_type
+
+
+def piece_color(piece):
+    return piece >> 3
+
+
+def piece_type(piece):
+    return piece & 7
+
+
+def piece_name(piece):
+    if not piece:
+        return ''
+    return COLOR_NAMES[piece >> 3] + ' ' + PIECE_NAMES[piece & 7]
+
+
+def parse_piece(name):
+    if not name:
+        return EMPTY
+    color, kind = name.split(' ')
+    return make_piece(COLOR_NAMES.index(color), PIECE_NAMES.index(kind))
+
+
+def square_of(row, col):
+    return row * 8 + col
+
+
+def row_col(square):
+    return [square >> 3, square & 7]
+
+
+# Rights that survive a move touching a given square (king or rook leaving
+# its home square, or a rook being captured there).
+CASTLING_MASK = [ALL_CASTLING] * 64
+CASTLING_MASK[0] = ALL_CASTLING & ~BLACK_QUEEN_SIDE
+CASTLING_MASK[4] = ALL_CASTLING & ~(BLACK_KING_SIDE | BLACK_QUEEN_SIDE)
+CASTLING_MASK[7] = ALL_CASTLING & ~BLACK_KING_SIDE
+CASTLING_MASK[56] = ALL_CASTLING & ~WHITE_QUEEN_SIDE
+CASTLING_MASK[60] = ALL_CASTLING & ~(WHITE_KING_SIDE | WHITE_QUEEN_SIDE)
+CASTLING_MASK[63] = ALL_CASTLING & ~WHITE_KING_SIDE
+
+# Rook hops for castling, keyed by the king's destination square
+CASTLING_ROOK_MOVES = {62: (63, 61), 58: (56, 59), 6: (7, 5), 2: (0, 3)}
+# (right, king's home square, rook's home square, color) of each castling right
+CASTLING_HOMES = ((WHITE_KING_SIDE, 60, 63, WHITE), (WHITE_QUEEN_SIDE, 60, 56, WHITE),
+                  (BLACK_KING_SIDE, 4, 7, BLACK), (BLACK_QUEEN_SIDE, 4, 0, BLACK))
+BACK_RANKS = 0xFF | 0xFF << 56
+# Largest halfmove clock an undo record holds (see pack_last_move)
+MAX_HALFMOVE_CLOCK = (1 << 20) - 1
+
+BACK_RANK = (ROOK, KNIGHT, BISHOP, QUEEN, KING, BISHOP, KNIGHT, ROOK)
+
+FEN_PIECES = {'p': PAWN, 'n': KNIGHT, 'b': BISHOP, 'r': ROOK, 'q': QUEEN, 'k': KING}
+FEN_CASTLING = (('K', WHITE_KING_SIDE), ('Q', WHITE_QUEEN_SIDE), ('k', BLACK_KING_SIDE), ('q', BLACK_QUEEN_SIDE))
+
+
+class Position:
+    __slots__ = ('squares', 'pieces', 'occupied', 'turn', 'castling', 'ep_square', 'king_square',
+                 'halfmove_clock', 'fullmove_number', 'hash', 'stack',
+                 'eval_tables', 'mg', 'eg', 'phase')
+
+    def __init__(self):
+        self.squares = bytearray(64)
+        self.pieces = [0] * 16  # One bitboard per piece code
+        self.occupied = [0, 0]  # One bitboard per color
+        self.turn = WHITE
+        self.castling = 0
+        self.ep_square = None  # Square a pawn can capture onto en passant
+        self.king_square = [None, None]
+        self.halfmove_clock = 0
+        self.fullmove_number = 1
+        self.hash = 0  # Zobrist hash, kept up to date by push() and pop()
+        self.stack = []  # Undo records for pop()
+        # Running evaluation sums, only kept while eval tables are in use
+        self.eval_tables = None
+        self.mg = self.eg = self.phase = 0
+
+    @classmethod
+    def initial(cls):
+        position = cls()
+        for col, kind in enumerate(BACK_RANK):
+            position.put_piece(col, make_piece(BLACK, kind))
+            position.put_piece(8 + col, make_piece(BLACK, PAWN))
+            position.put_piece(48 + col, make_piece(WHITE, PAWN))
+            position.put_piece(56 + col, make_piece(WHITE, kind))
+        position.castling = ALL_CASTLING
+        position.hash = position.compute_hash()
+        return position
+
+    @classmethod
+    def from_board(cls, board, turn='white'):
+        # Build a position from the 8x8 list of piece names used by the routes
+        position = cls()
+        for row in range(8):
+            for col in range(8):
+                piece = parse_piece(board[row][col])
+                if piece:
+                    position.put_piece(row * 8 + col, piece)
+        position.turn = COLOR_NAMES.index(turn)
+        position.check_setup()
+        position.castling = position.possible_castling()
+        position.hash = position.compute_hash()
+        return position
+
+    @classmethod
+    def from_fen(cls, fen):
+        # Raises ValueError for anything that isn't a well-formed FEN string
+        fields = fen.split()
+        if len(fields) < 4:
+            raise ValueError('FEN needs at least 4 fields')
+        rows = fields[0].split('/')
+        if len(rows) != 8:
+            raise ValueError('FEN board needs 8 rows')
+        position = cls()
+        for row, text in enumerate(rows):
+            col = 0
+            for char in text:
+                if char.isdigit():
+                    col += int(char)
+                elif char.lower() in FEN_PIECES and col < 8:
+                    color = WHITE if char.isupper() else BLACK
+                    position.put_piece(row * 8 + col, make_piece(color, FEN_PIECES[char.lower()]))
+                    col += 1
+                else:
+                    raise ValueError('Bad FEN board row: ' + text)
+            if col != 8:
+                raise ValueError('Bad FEN board row: ' + text)
+
+        if fields[1] not in ('w', 'b'):
+            raise ValueError('Bad FEN side to move: ' + fields[1])
+        position.turn = WHITE if fields[1] == 'w' else BLACK
+        position.check_setup()
+        if fields[2] != '-':
+            for char in fields[2]:
+                rights = dict(FEN_CASTLING)
+                if char not in rights:
+                    raise ValueError('Bad FEN castling field: ' + fields[2])
+                position.castling |= rights[char]
+            # Rights whose king or rook has left home are dropped, not trusted
+            position.castling &= position.possible_castling()
+        if fields[3] != '-':
+            # The square a pawn of the side that just moved skipped over: on
+            # rank 6 with the pawn below it when white is to move, on rank 3
+            # when black is
+            square = fields[3]
+            if len(square) != 2 or square[0] not in 'abcdefgh' or square[1] != '63'[position.turn]:
+                raise ValueError('Bad FEN en passant square: ' + square)
+            ep_square = (8 - int(square[1])) * 8 + 'abcdefgh'.index(square[0])
+            forward = 8 if position.turn == WHITE else -8
+            if (position.squares[ep_square + forward] != make_piece(position.turn ^ 1, PAWN)
+                    or position.squares[ep_square] or position.squares[ep_square - forward]):
+                raise ValueError('Bad FEN en passant square: ' + square)
+            position.ep_square = ep_square
+        try:
+            if len(fields) > 4:
+                position.halfmove_clock = int(fields[4])
+            if len(fields) > 5:
+                position.fullmove_number = int(fields[5])
+        except ValueError:
+            raise ValueError('Bad FEN move counters')
+        if not 0 <= position.halfmove_clock <= MAX_HALFMOVE_CLOCK or position.fullmove_number < 1:
+            raise ValueError('Bad FEN move counters')
+        position.hash = position.compute_hash()
+        return position
+
+    def to_fen(self):
+        rows = []
+        for row in range(8):
+            text = ''
+            empty = 0
+            for piece in self.squares[row * 8:row * 8 + 8]:
+                if not piece:
+                    empty += 1
+                    continue
+                if empty:
+                    text += str(empty)
+                    empty = 0
+                letter = 'pnbrqk'[(piece & 7) - 1]
+                text += letter.upper() if piece >> 3 == WHITE else letter
+            if empty:
+                text += str(empty)
+            rows.append(text)
+        castling = ''.join(char for char, right in FEN_CASTLING if self.castling & right) or '-'
+        if self.ep_square is None:
+            ep = '-'
+        else:
+            ep = 'abcdefgh'[self.ep_square & 7] + str(8 - (self.ep_square >> 3))
+        return '%s %s %s %s %d %d' % ('/'.join(rows), 'wb'[self.turn], castling, ep,
+                                      self.halfmove_clock, self.fullmove_number)
+
+    def check_setup(self):
+        # Raises ValueError for piece placements no game can reach that the
+        # move generator relies on never seeing: anything but one king per
+        # side, pawns on the first or last rank, or the side that just moved
+        # still in check
+        for color in (WHITE, BLACK):
+            if bin(self.pieces[make_piece(color, KING)]).count('1') != 1:
+                raise ValueError('Position needs exactly one king per side')
+        if (self.pieces[make_piece(WHITE, PAWN)] | self.pieces[make_piece(BLACK, PAWN)]) & BACK_RANKS:
+            raise ValueError('Position has a pawn on the first or last rank')
+        from movegen import in_check  # movegen imports this module
+        if in_check(self, self.turn ^ 1):
+            raise ValueError('The side not to move is in check')
+
+    def possible_castling(self):
+        # The castling rights the piece placement still allows
+        rights = 0
+        for right, king, rook, color in CASTLING_HOMES:
+            if self.squares[king] == make_piece(color, KING) and self.squares[rook] == make_piece(color, ROOK):
+                rights |= right
+        return rights
+
+    def put_piece(self, square, piece):
+        # Place a piece on an empty square while setting up a position
+        self.squares[square] = piece
+        self.pieces[piece] |= 1 << square
+        self.occupied[piece >> 3] |= 1 << square
+        if piece & 7 == KING:
+            self.king_square[piece >> 3] = square
+
+    def compute_hash(self):
+        # Full Zobrist hash from scratch; push() and pop() update it incrementally
+        key = CASTLING_KEYS[self.castling]
+        for square, piece in enumerate(self.squares):
+            if piece:
+                key ^= PIECE_KEYS[piece][square]
+        if self.ep_square is not None:
+            key ^= EP_FILE_KEYS[self.ep_square & 7]
+        if self.turn == BLACK:
+            key ^= BLACK_TO_MOVE_KEY
+        return key
+
+    def use_eval_tables(self, tables):
+        # Start keeping the evaluation sums for a set of EvalTables
+        self.eval_tables = tables
+        if tables is not None:
+            self.mg, self.eg, self.phase = tables.score(self)
+
+    def to_board(self):
+        # 8x8 list of piece names, only built for JSON responses
+        names = [piece_name(piece) for piece in self.squares]
+        return [names[row * 8:row * 8 + 8] for row in range(8)]
+
+    def copy(self):
+        # Copy of the current position, without its undo records
+        position = Position.__new__(Position)
+        position.squares = bytearray(self.squares)
+        position.pieces = self.pieces[:]
+        position.occupied = self.occupied[:]
+        position.turn = self.turn
+        position.castling = self.castling
+        position.ep_square = self.ep_square
+        position.king_square = self.king_square[:]
+        position.halfmove_clock = self.halfmove_clock
+        position.fullmove_number = self.fullmove_number
+        position.hash = self.hash
+        position.stack = []
+        position.eval_tables = self.eval_tables
+        position.mg, position.eg, position.phase = self.mg, self.eg, self.phase
+        return position
+
+    def push(self, move):
+        # Play a packed move (start | end << 6 | promotion << 12) in place,
+        # without checking legality, and return the captured piece
+        start = move & 63
+        end = move >> 6 & 63
+        squares = self.squares
+        pieces = self.pieces
+        occupied = self.occupied
+        turn = self.turn
+        piece = squares[start]
+        kind = piece & 7
+        captured = squares[end]
+        captured_square = end
+        key = self.hash
+        record = [move, captured, self.castling, self.ep_square, self.halfmove_clock, key]
+
+        start_bit = 1 << start
+        end_bit = 1 << end
+        if captured:
+            pieces[captured] ^= end_bit
+            occupied[turn ^ 1] ^= end_bit
+            key ^= PIECE_KEYS[captured][end]
+        squares[end] = piece
+        squares[start] = EMPTY
+        pieces[piece] ^= start_bit | end_bit
+        occupied[turn] ^= start_bit | end_bit
+        key ^= PIECE_KEYS[piece][start] ^ PIECE_KEYS[piece][end]
+
+        ep_square = self.ep_square
+        self.ep_square = None
+        if ep_square is not None:
+            key ^= EP_FILE_KEYS[ep_square & 7]
+        if kind == PAWN:
+            if end == ep_square:
+                # The captured pawn sits beside the moving pawn, not on the target square
+                captured_square = (start & ~7) | (end & 7)
+                captured = squares[captured_square]
+                squares[captured_square] = EMPTY
+                pieces[captured] ^= 1 << captured_square
+                occupied[turn ^ 1] ^= 1 << captured_square
+                key ^= PIECE_KEYS[captured][captured_square]
+            elif abs(start - end) == 16:
+                self.ep_square = (start + end) // 2
+                key ^= EP_FILE_KEYS[start & 7]
+            elif end < 8 or end >= 56:
+                if not move >> 12:
+                    move |= QUEEN << 12
+                    record[0] = move
+                promoted = make_piece(turn, move >> 12)
+                squares[end] = promoted
+                pieces[piece] ^= end_bit
+                pieces[promoted] |= end_bit
+                key ^= PIECE_KEYS[piece][end] ^ PIECE_KEYS[promoted][end]
+        elif kind == KING:
+            self.king_square[turn] = end
+            if abs(start - end) == 2:
+                rook_start, rook_end = CASTLING_ROOK_MOVES[end]
+                rook = squares[rook_start]
+                squares[rook_end] = rook
+                squares[rook_start] = EMPTY
+                pieces[rook] ^= 1 << rook_start | 1 << rook_end
+                occupied[turn] ^= 1 << rook_start | 1 << rook_end
+                key ^= PIECE_KEYS[rook][rook_start] ^ PIECE_KEYS[rook][rook_end]
+
+        castling = self.castling
+        self.castling = castling & CASTLING_MASK[start] & CASTLING_MASK[end]
+        if self.castling != castling:
+            key ^= CASTLING_KEYS[castling] ^ CASTLING_KEYS[self.castling]
+        self.hash = key ^ BLACK_TO_MOVE_KEY
+
+        tables = self.eval_tables
+        if tables is not None:
+            self._update_eval(tables, move, piece, captured, captured_square, 1)
+        self.stack.append(tuple(record))
+        if kind == PAWN or captured:
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        if turn == BLACK:
+            self.fullmove_number += 1
+        self.turn = turn ^ 1
+        return captured
+
+    def _update_eval(self, tables, move, piece, captured, captured_square, sign):
+        # Add (sign 1) or take back (sign -1) a move's change to the eval sums.
+        # piece is the piece that moved, before any promotion.
+        start = move & 63
+        end = move >> 6 & 63
+        mg, eg = tables.mg, tables.eg
+        landed = piece
+        if move >> 12 and piece & 7 == PAWN:
+            landed = make_piece(piece >> 3, move >> 12)
+            self.phase += sign * tables.phase[landed]
+        mg_delta = mg[landed][end] - mg[piece][start]
+        eg_delta = eg[landed][end] - eg[piece][start]
+        if captured:
+            mg_delta -= mg[captured][captured_square]
+            eg_delta -= eg[captured][captured_square]
+            self.phase -= sign * tables.phase[captured]
+        if piece & 7 == KING and abs(start - end) == 2:
+            rook_start, rook_end = CASTLING_ROOK_MOVES[end]
+            rook = make_piece(piece >> 3, ROOK)
+            mg_delta += mg[rook][rook_end] - mg[rook][rook_start]
+            eg_delta += eg[rook][rook_end] - eg[rook][rook_start]
+        self.mg += sign * mg_delta
+        self.eg += sign * eg_delta
+
+    def pop(self):
+        # Take back the last pushed move from its undo record
+        record = self.stack.pop()
+        move, captured, castling, ep_square, halfmove_clock, self.hash = record
+        start = move & 63
+        end = move >> 6 & 63
+        squares = self.squares
+        pieces = self.pieces
+        occupied = self.occupied
+        turn = self.turn ^ 1
+        self.turn = turn
+        self.castling = castling
+        self.ep_square = ep_square
+        self.halfmove_clock = halfmove_clock
+        if turn == BLACK:
+            self.fullmove_number -= 1
+
+        piece = squares[end]
+        start_bit = 1 << start
+        end_bit = 1 << end
+        if move >> 12 and piece & 7 != PAWN:
+            # Turn the promoted piece back into a pawn
+            pawn = make_piece(turn, PAWN)
+            pieces[piece] ^= end_bit
+            pieces[pawn] |= end_bit
+            piece = pawn
+        squares[start] = piece
+        squares[end] = captured
+        captured_square = end
+        pieces[piece] ^= start_bit | end_bit
+        occupied[turn] ^= start_bit | end_bit
+        if captured:
+            pieces[captured] |= end_bit
+            occupied[turn ^ 1] |= end_bit
+
+        kind = piece & 7
+        if kind == PAWN and end == ep_square:
+            captured_square = (start & ~7) | (end & 7)
+            captured = make_piece(turn ^ 1, PAWN)
+            squares[captured_square] = captured
+            pieces[captured] |= 1 << captured_square
+            occupied[turn ^ 1] |= 1 << captured_square
+        elif kind == KING:
+            self.king_square[turn] = start
+            if abs(start - end) == 2:
+                rook_start, rook_end = CASTLING_ROOK_MOVES[end]
+                rook = squares[rook_end]
+                squares[rook_start] = rook
+                squares[rook_end] = EMPTY
+                pieces[rook] ^= 1 << rook_start | 1 << rook_end
+                occupied[turn] ^= 1 << rook_start | 1 << rook_end
+
+        tables = self.eval_tables
+        if tables is not None:
+            self._update_eval(tables, move, piece, captured, captured_square, -1)
+
+    def pack_last_move(self):
+        # Take the last undo record off the stack as (move, packed record) so
+        # a game can keep its history in flat integer arrays. The record packs
+        # the captured piece (bits 0-3), castling rights (4-7), en passant file
+        # + 1 or 0 (8-11) and the halfmove clock (12-31); the hash is left
+        # out because pop_packed() recomputes it. A clock past
+        # MAX_HALFMOVE_CLOCK is stored as that, which makes no difference to
+        # the fifty-move rule.
+        move, captured, castling, ep_square, halfmove_clock, _ = self.stack.pop()
+        ep = 0 if ep_square is None else (ep_square & 7) + 1
+        return move, captured | castling << 4 | ep << 8 | min(halfmove_clock, MAX_HALFMOVE_CLOCK) << 12
+
+    def pop_packed(self, move, record):
+        # Take back a move whose undo record came from pack_last_move()
+        ep = record >> 8 & 15
+        ep_square = None
+        if ep:
+            # The en passant square sat behind the pawn the mover could capture
+            ep_square = (16 if self.turn == BLACK else 40) + ep - 1
+        self.stack.append((move, record & 15, record >> 4 & 15, ep_square, record >> 12, 0))
+        self.pop()
+        self.hash = self.compute_hash()
@@ -0,0 +1,298 @@
+# Bot search. Everything works on a single Position that is played forward
+# with push() and taken back with pop(), so no copies are made per node.
+#
+# The search is a negamax alpha-beta: every score is from the point of view
+# of the side to move at that node, and a child's score is negated on the
+# way back up.
+
+import time
+
+from position import PAWN
+from movegen import generate_legal, in_check
+from transposition import EXACT, LOWER, UPPER
+from evaluate import evaluate, STANDARD_TABLES
+
+# Piece values for ordering captures, indexed by piece type
+PIECE_VALUES = (0, 1, 3, 3, 5, 9, 0)
+
+MATE = 100000
+MATE_BOUND = MATE - 1000  # Scores beyond this are mates, counted in plies
+INFINITY = MATE + 1
+MAX_PLY = 128
+
+# Move ordering buckets
+HASH_MOVE_SCORE = 1 << 30
+CAPTURE_SCORE = 1 << 28
+KILLER_SCORES = (1 << 27, (1 << 27) - 1)
+
+
+class SearchAborted(Exception):
+    pass
+
+
+class SearchLimits:
+    # Node counter shared by one search, which stops it once the time budget
+    # or node limit runs out. None means no such limit; other values must
+    # be positive, or ValueError is raised.
+    def __init__(self, time_ms=None, node_limit=None):
+        if time_ms is not None and time_ms <= 0:
+            raise ValueError('time_ms must be positive')
+        if node_limit is not None and node_limit <= 0:
+            raise ValueError('node_limit must be positive')
+        self.start = time.perf_counter()
+        self.deadline = self.start + time_ms / 1000.0 if time_ms else None
+        self.node_limit = node_limit
+        self.nodes = 0
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.start) * 1000.0
+
+    def count_node(self):
+        # The node over the limit isn't counted, so nodes never passes it
+        if self.node_limit and self.nodes >= self.node_limit:
+            raise SearchAborted()
+        self.nodes += 1
+        # Reading the clock every node would cost more than the node itself
+        if self.deadline and not self.nodes & 255 and time.perf_counter() >= self.deadline:
+            raise SearchAborted()
+
+
+def _to_table(score, ply):
+    # Mate scores are stored relative to the node, not the root
+    if score > MATE_BOUND:
+        return score + ply
+    if score < -MATE_BOUND:
+        return score - ply
+    return score
+
+
+def _from_table(score, ply):
+    if score > MATE_BOUND:
+        return score - ply
+    if score < -MATE_BOUND:
+        return score + ply
+    return score
+
+
+class Searcher:
+    # Search state that lives across the iterations of one bot move: the
+    # killer moves per ply and the history heuristic counters. Positions an
+    # endgame tablebase covers are scored from it instead of searched.
+    def __init__(self, tt=None, limits=None, tablebase=None):
+        self.tt = tt
+        self.limits = limits or SearchLimits()
+        self.tablebase = tablebase
+        self.killers = [[0, 0] for _ in range(MAX_PLY)]
+        self.history = [[0] * 64 for _ in range(16)]
+
+    def order_moves(self, position, moves, hash_move, ply):
+        # Hash move, then captures by MVV-LVA (most valuable victim, least
+        # valuable attacker), then killers, then quiet moves by history
+        squares = position.squares
+        killers = self.killers[ply] if ply < MAX_PLY else (0, 0)
+        history = self.history
+        ep_square = position.ep_square
+        scored = []
+        for move in moves:
+            if move == hash_move:
+                score = HASH_MOVE_SCORE
+            else:
+                start = move & 63
+                end = move >> 6 & 63
+                piece = squares[start]
+                victim = squares[end]
+                if victim or move >> 12 or (end == ep_square and piece & 7 == PAWN):
+                    victim_type = victim & 7 if victim else PAWN
+                    score = CAPTURE_SCORE + PIECE_VALUES[victim_type] * 16 + (move >> 12) * 8 - (piece & 7)
+                elif move == killers[0]:
+                    score = KILLER_SCORES[0]
+                elif move == killers[1]:
+                    score = KILLER_SCORES[1]
+                else:
+                    score = history[piece][end]
+            scored.append((score, move))
+        scored.sort(reverse=True)
+        return [move for _, move in scored]
+
+    def quiescence(self, position, alpha, beta, ply):
+        # Only captures (and promotions) are searched, so leaves are not
+        # scored in the middle of an exchange
+        self.limits.count_node()
+        if self.tablebase is not None:
+            score = self.tablebase.score(position, ply)
+            if score is not None:
+                return score
+        checked = in_check(position, position.turn)
+        if checked:
+            moves = generate_legal(position)
+            if not moves:
+                return -MATE + ply
+        else:
+            stand_pat = evaluate(position)
+            if stand_pat >= beta or ply >= MAX_PLY - 1:
+                return stand_pat
+            if stand_pat > alpha:
+                alpha = stand_pat
+            moves = generate_legal(position, captures_only=True)
+
+        best = alpha if not checked else -INFINITY
+        for move in self.order_moves(position, moves, 0, ply):
+            position.push(move)
+            score = -self.quiescence(position, -beta, -alpha, ply + 1)
+            position.pop()
+            if score > best:
+                best = score
+                if score > alpha:
+                    alpha = score
+                    if score >= beta:
+                        break
+        return best
+
+    def negamax(self, position, depth, alpha, beta, ply):
+        if depth <= 0:
+            return self.quiescence(position, alpha, beta, ply)
+        self.limits.count_node()
+        if self.tablebase is not None:
+            score = self.tablebase.score(position, ply)
+            if score is not None:
+                return score
+
+        tt = self.tt
+        hash_move = 0
+        if tt is not None:
+            entry = tt.probe(position.hash)
+            if entry:
+                hash_move = entry[3]
+                if entry[1] >= depth:
+                    score = _from_table(entry[0], ply)
+                    bound = entry[2]
+                    if bound == EXACT:
+                        return score
+                    if bound == LOWER and score >= beta:
+                        return score
+                    if bound == UPPER and score <= alpha:
+                        return score
+
+        moves = generate_legal(position)
+        if not moves:
+            # Checkmate or stalemate
+            return -MATE + ply if in_check(position, position.turn) else 0
+
+        alpha_orig = alpha
+        best = -INFINITY
+        best_move = 0
+        squares = position.squares
+        for move in self.order_moves(position, moves, hash_move, ply):
+            position.push(move)
+            score = -self.negamax(position, depth - 1, -beta, -alpha, ply + 1)
+            position.pop()
+            if score > best:
+                best = score
+                best_move = move
+                if score > alpha:
+                    alpha = score
+                    if score >= beta:
+                        end = move >> 6 & 63
+                        if not squares[end] and not move >> 12 and ply < MAX_PLY:
+                            # Remember quiet moves that refute a position
+                            killers = self.killers[ply]
+                            if killers[0] != move:
+                                killers[1] = killers[0]
+                                killers[0] = move
+                            self.history[squares[move & 63]][end] += depth * depth
+                        break
+
+        if tt is not None:
+            if best <= alpha_orig:
+                bound = UPPER
+            elif best >= beta:
+                bound = LOWER
+            else:
+                bound = EXACT
+            tt.store(position.hash, _to_table(best, ply), depth, bound, best_move)
+        return best
+
+    def search_root(self, position, depth):
+        # Returns (best move, score), or (None, score) when there are no moves
+        moves = generate_legal(position)
+        if not moves:
+            return None, (-MATE if in_check(position, position.turn) else 0)
+        hash_move = 0
+        if self.tt is not None:
+            entry = self.tt.probe(position.hash)
+            if entry:
+                hash_move = entry[3]
+
+        best_move = None
+        alpha = -INFINITY
+        for move in self.order_moves(position, moves, hash_move, 0):
+            position.push(move)
+            score = -self.negamax(position, depth - 1, -INFINITY, -alpha, 1)
+            position.pop()
+            if score > alpha or best_move is None:
+                alpha = score
+                best_move = move
+        if self.tt is not None:
+            self.tt.store(position.hash, _to_table(alpha, 0), depth, EXACT, best_move)
+        return best_move, alpha
+
+
+def get_best_move(position, depth, tt=None, limits=None, tables=STANDARD_TABLES):
+    # Returns a packed move, or None when the side to move has no moves.
+    # A transposition table passed in is reused across calls. Raises
+    # SearchAborted if the limits run out first.
+    if position.eval_tables is not tables:
+        position.use_eval_tables(tables)
+    return Searcher(tt, limits).search_root(position, depth)[0]
+
+
+def iterative_deepening(position, time_ms=None, node_limit=None, max_depth=64, tt=None,
+                        tables=STANDARD_TABLES, first_depth=1, generation=None, tablebase=None):
+    # Search depth first_depth, first_depth + 1, ... until the budget runs
+    # out and return the best move of the deepest iteration that finished.
+    # Searches sharing one table pass the same generation. There must be a
+    # time budget or a node limit, or the search could run for ever; without
+    # either it raises ValueError.
+    if not time_ms and not node_limit:
+        raise ValueError('iterative_deepening needs a time or node limit')
+    if position.eval_tables is not tables:
+        position.use_eval_tables(tables)
+    limits = SearchLimits(time_ms or None, node_limit or None)
+    searcher = Searcher(tt, limits, tablebase)
+    if tt is not None:
+        if generation is None:
+            tt.new_search()
+        else:
+            tt.generation = generation
+    root_ply = len(position.stack)
+    best_move = None
+    best_score = None
+    depth_reached = 0
+    for depth in range(min(first_depth, max_depth), min(max_depth, MAX_PLY - 1) + 1):
+        try:
+            move, score = searcher.search_root(position, depth)
+        except SearchAborted:
+            # Unwind the moves the interrupted search still had on the board
+            while len(position.stack) > root_ply:
+                position.pop()
+            break
+        if move is None:
+            break
+        best_move, best_score = move, score
+        depth_reached = depth
+        if score > MATE_BOUND or score < -MATE_BOUND:
+            break  # A forced mate won't change with more depth
+        # The next iteration takes several times longer than this one
+        if limits.deadline and limits.elapsed_ms() * 2 > time_ms:
+            break
+
+    if best_move is None:
+        moves = generate_legal(position)
+        best_move = moves[0] if moves else None
+    return {
+        'move': best_move,
+        'depth': depth_reached,
+        'score': best_score,
+        'nodes': limits.nodes,
+        'time_ms': round(limits.elapsed_ms(), 1),
+    }
@@ -1,3 +1,90 @@
+// Every legal move for the side to move, as target squares keyed by "row,col",
+// loaded once per board update so clicking a piece needs no request
+let legalMovesBySquare = null;
+let legalMovesRequest = 0;
+
+function loadLegalMoves() {
+    const gameId = new URLSearchParams(window.location.search).get('game_id');
+    const request = ++legalMovesRequest;
+    legalMovesBySquare = null;
+    fetch(`/all_legal_moves/${gameId}`)
+        .then(response => response.json())
+        .then(data => {
+            // Ignore an answer that a later board update has overtaken
+            if (request === legalMovesRequest && data.legal_moves) {
+                legalMovesBySquare = data.legal_moves;
+            }
+        });
+}
+
+// Board updates are pushed by the server as Server-Sent Events from
+// /events/<game_id>: 'sync' carries the whole game and 'move' only the move,
+// which is played on the board here. Browsers without EventSource fetch the
+// board after each change instead.
+let eventSource = null;
+
+function squareAt(pos) {
+    return document.querySelector(`.square[data-row='${pos[0]}'][data-col='${pos[1]}']`);
+}
+
+function applyMove(move) {
+    const from = squareAt(move.from);
+    const to = squareAt(move.to);
+    const piece = from.firstChild;
+    const mover = move.turn === 'white' ? 'black' : 'white';
+    if (piece && piece.src.includes('pawn') && move.from[1] !== move.to[1] && !to.firstChild) {
+        // En passant: the captured pawn stands beside the moving one
+        squareAt([move.from[0], move.to[1]]).innerHTML = '';
+    }
+    if (piece && piece.src.includes('king') && Math.abs(move.from[1] - move.to[1]) === 2) {
+        // Castling: the rook jumps over the king
+        const rookCols = move.to[1] === 6 ? [7, 5] : [0, 3];
+        squareAt([move.from[0], rookCols[1]]).appendChild(squareAt([move.from[0], rookCols[0]]).firstChild);
+    }
+    to.innerHTML = '';
+    if (piece) {
+        if (move.promotion) {
+            piece.src = `/static/assets/images/${mover} ${move.promotion}.png`;
+        }
+        to.appendChild(piece);
+    }
+    if (move.captured) {
+        const img = document.createElement('img');
+        img.src = `/static/assets/images/${move.captured}.png`;
+        img.classList.add('captured-piece');
+        document.getElementById(`${mover}-captured-pieces`).appendChild(img);
+    }
+    loadLegalMoves();
+}
+
+function listenForUpdates(gameId, onLoad) {
+    // onLoad gets the game's state the first time it arrives
+    eventSource = new EventSource(`/events/${gameId}`);
+    eventSource.addEventListener('sync', event => {
+        const data = JSON.parse(event.data);
+        if (!data.game_over) {
+            document.getElementById('game-over-message').classList.add('hidden');
+        }
+        updateBoard(data);
+        checkGameOver(data);
+        if (onLoad) {
+            onLoad(data);
+            onLoad = null;
+        }
+    });
+    eventSource.addEventListener('move', event => {
+        const move = JSON.parse(event.data);
+        applyMove(move);
+        checkGameOver(move);
+    });
+    eventSource.onerror = () => {
+        // The browser reconnects by itself unless the game is gone
+        if (eventSource.readyState === EventSource.CLOSED) {
+            alert('Game not found');
+        }
+    };
+}
+
 function updateBoard(data) {
     console.log(data)
     const squares = document.querySelectorAll('.square');
@@ -23,6 +110,7 @@ function updateBoard(data) {
     } else {
         console.warn("Captured pieces data is missing.");
     }
+    loadLegalMoves();
 }
 
 function checkGameOver(data) {
@@ -31,14 +119,16 @@ function checkGameOver(data) {
 
     if (data.game_over) {
         const messageText=document.getElementById('message-text')
-        messageText.innerText=`Game Over! Winner: ${data.winner}`
+        messageText.innerText=`Game Over! Winner: ${data.winner}` + (data.reason ? ` (${data.reason})` : '')
         document.getElementById('game-over-message').classList.remove('hidden');
     }
 }
 
 document.addEventListener('DOMContentLoaded', function () {
     const gameId = new URLSearchParams(window.location.search).get('game_id');
-    if (gameId) {
+    if (gameId && window.EventSource) {
+        listenForUpdates(gameId);
+    } else if (gameId) {
         fetch(`/board/${gameId}`)
             .then(response => response.json())
             .then(data => {
@@ -131,6 +221,17 @@ function selectSquare(square) {
         const endPos = [square.dataset.row, square.dataset.col];
         const gameId = new URLSearchParams(window.location.search).get('game_id');
 
+        // Moves already known to be illegal don't need a round-trip
+        if (legalMovesBySquare) {
+            const targets = legalMovesBySquare[`${startPos[0]},${startPos[1]}`] || [];
+            if (!targets.some(move => move[0] == endPos[0] && move[1] == endPos[1])) {
+                alert('Invalid move');
+                selectedPiece = null;
+                selectedSquare.classList.remove('selected');
+                return;
+            }
+        }
+
         fetch('/move', {
             method: 'POST',
             headers: {
@@ -153,8 +254,10 @@ function selectSquare(square) {
                     //     alert(`Game Over! Winner: ${data.winner}`);
                     //     disableBoard();
                     // }
-                    updateBoard(data);
-                    checkGameOver(data);
+                    if (!eventSource) {
+                        updateBoard(data);
+                        checkGameOver(data);
+                    }
                 } else {
                     alert('Invalid move');
                 }
@@ -170,9 +273,14 @@ function selectSquare(square) {
             selectedSquare = square;
             square.classList.add('selected');
 
-            // Fetch legal moves for the selected piece from the server
             const row = square.dataset.row;
             const col = square.dataset.col;
+            if (legalMovesBySquare) {
+                highlightLegalMoves(legalMovesBySquare[`${row},${col}`] || []);
+                return;
+            }
+
+            // Fetch legal moves for the selected piece from the server
             const gameId = new URLSearchParams(window.location.search).get('game_id');
 
             fetch('/legal_moves', {
@@ -235,6 +343,9 @@ function restartGame() {
     .then(data => {
         if (data.status === 'success') {
             console.log(data.message);
+            if (eventSource) {
+                return;  // The board is redrawn by the 'sync' event
+            }
             fetch(`/board/${gameId}`)
                 .then(response => response.json())
                 .then(data => {
@@ -276,8 +387,10 @@ function undoMove() {
     .then(data => {
         if (data.status === 'success') {
             console.log(data.message);
-            updateBoard(data);
-            checkGameOver(data);
+            if (!eventSource) {
+                updateBoard(data);
+                checkGameOver(data);
+            }
         } else {
             alert(data.message);
         }
@@ -0,0 +1,491 @@
+# Endgame tablebases: exact results for positions with no pawns and at most
+# four pieces, kings included.
+#
+# Each ending (KQvK, KRvKN, ...; the stronger side's pieces first) is one
+# file of one byte per position, holding the result for the side to move:
+#   0        draw
+#   odd n    win, mate in n plies
+#   even n   loss, mated in n - 2 plies
+#   255      not a legal position, or one stored under another index
+# Positions are stored with the stronger side as white; one where black is
+# the stronger side is looked up with the colours swapped and the board
+# mirrored top to bottom. With no pawns and no castling the board's eight
+# symmetries don't change the result, so the white king is always moved
+# into the a1-d1-d4 triangle first (with it on the diagonal, the board is
+# also reflected across the diagonal when that gives a smaller index), which
+# makes the tables eight times smaller: 80 KB for three pieces, 5 MB for
+# four. The index is
+#   ((side to move * 10 + white king) * 64 + black king) * 64 ... + last piece
+# with the other pieces in signature order.
+#
+# Tables are built offline by retrograde analysis (generate()): every mate
+# is found first, then the analysis works backwards a ply at a time, so each
+# position gets the shortest win or the longest defence. Captures lead into
+# smaller endings, which are built first. The fifty-move rule is ignored.
+# Probing maps the files into memory, so search processes share their pages.
+#
+#   python tablebase.py generate [DIR] [ENDING ...|all]   default KQvK KRvK
+#   python tablebase.py probe DIR FEN
+
+import argparse
+import mmap
+import os
+import sys
+import time
+from array import array
+from itertools import combinations_with_replacement, product
+
+from position import Position, WHITE, BLACK, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING
+from movegen import KNIGHT_ATTACKS, KING_ATTACKS, rook_attacks, bishop_attacks, generate_legal
+from search import MATE
+
+MAX_PIECES = 4
+ILLEGAL = 255
+ESCAPE = 255  # In the generator's capture floors: some capture doesn't lose
+
+DEFAULT_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tablebases')
+
+PIECE_LETTERS = ' PNBRQK'
+# Endings no side can win, which have no table
+DRAWN_ENDINGS = ('KvK', 'KNvK', 'KBvK')
+
+
+def _transforms():
+    # The eight symmetries of the board as square lookup tables, identity first
+    tables = []
+    for flip_rank, flip_file, swap in product((False, True), repeat=3):
+        table = []
+        for square in range(64):
+            rank, file = 7 - (square >> 3), square & 7
+            if flip_rank:
+                rank = 7 - rank
+            if flip_file:
+                file = 7 - file
+            if swap:
+                rank, file = file, rank
+            table.append((7 - rank) * 8 + file)
+        tables.append(table)
+    return tables
+
+
+TRANSFORMS = _transforms()
+# Squares the white king is moved into: a1-d1, b2-d2, c3-d3, d4
+TRIANGLE = [(7 - rank) * 8 + file for file in range(4) for rank in range(file + 1)]
+TRIANGLE_INDEX = {square: index for index, square in enumerate(TRIANGLE)}
+# The symmetry that takes a white king on each square into the triangle
+CANONICAL = [next(t for t, table in enumerate(TRANSFORMS) if table[square] in TRIANGLE_INDEX)
+             for square in range(64)]
+# a1, b2, c3, d4, and the reflection across that diagonal
+DIAGONAL = frozenset(square for square in TRIANGLE if 7 - (square >> 3) == square & 7)
+REFLECT = TRANSFORMS[1]
+
+
+def _index(squares, turn):
+    # Table index of a position given its squares in table order (kings
+    # first) and the side to move. Every position the board's symmetries
+    # turn into one another gets the same index.
+    transform = TRANSFORMS[CANONICAL[squares[0]]]
+    king = transform[squares[0]]
+    rest = 0
+    for square in squares[1:]:
+        rest = rest * 64 + transform[square]
+    if king in DIAGONAL:
+        reflected = 0
+        for square in squares[1:]:
+            reflected = reflected * 64 + REFLECT[transform[square]]
+        rest = min(rest, reflected)
+    return (turn * 10 + TRIANGLE_INDEX[king]) * 64 ** (len(squares) - 1) + rest
+
+
+def _attacks(kind, square, occupied):
+    if kind == KNIGHT:
+        return KNIGHT_ATTACKS[square]
+    if kind == BISHOP:
+        return bishop_attacks(square, occupied)
+    if kind == ROOK:
+        return rook_attacks(square, occupied)
+    if kind == QUEEN:
+        return rook_attacks(square, occupied) | bishop_attacks(square, occupied)
+    return KING_ATTACKS[square]
+
+
+def _signature(white, black):
+    # (ending name, colours swapped) for the non-king piece types of each side
+    white = sorted(white, reverse=True)
+    black = sorted(black, reverse=True)
+    swapped = (len(black), black) > (len(white), white)
+    if swapped:
+        white, black = black, white
+    name = 'K' + ''.join(PIECE_LETTERS[kind] for kind in white) + 'vK' + \
+           ''.join(PIECE_LETTERS[kind] for kind in black)
+    return name, swapped
+
+
+def _parse_signature(name):
+    # Piece types of the white and black sides, other than the kings, of an
+    # ending name in its usual form
+    try:
+        white, black = name.upper().split('V')
+        if white[0] != 'K' or black[0] != 'K':
+            raise ValueError
+        white = [PIECE_LETTERS.index(letter) for letter in white[1:]]
+        black = [PIECE_LETTERS.index(letter) for letter in black[1:]]
+    except ValueError:
+        raise ValueError('Bad ending: ' + name)
+    if not set(white + black) <= {KNIGHT, BISHOP, ROOK, QUEEN} or len(white + black) + 2 > MAX_PIECES:
+        raise ValueError('Tables cover pawnless endings of up to %d pieces: %s' % (MAX_PIECES, name))
+    if _signature(white, black) != (name, False):
+        raise ValueError('Write the ending as ' + _signature(white, black)[0])
+    return white, black
+
+
+def all_endings():
+    # Every ending with a table, smaller ones first
+    endings = []
+    for extra in range(1, MAX_PIECES - 1):
+        for kinds in combinations_with_replacement((QUEEN, ROOK, BISHOP, KNIGHT), extra):
+            for split in range(extra, (extra - 1) // 2, -1):
+                name, swapped = _signature(kinds[:split], kinds[split:])
+                if not swapped and name not in DRAWN_ENDINGS and name not in endings:
+                    endings.append(name)
+    return endings
+
+
+def _sub_endings(name):
+    # Endings a capture can lead to
+    white, black = _parse_signature(name)
+    subs = []
+    for side in (white, black):
+        for kind in set(side):
+            rest = list(side)
+            rest.remove(kind)
+            sub = _signature(rest, black) if side is white else _signature(white, rest)
+            if sub[0] not in DRAWN_ENDINGS and sub[0] not in subs:
+                subs.append(sub[0])
+    return subs
+
+
+class Tablebase:
+    def __init__(self, directory):
+        self.directory = directory
+        self.tables = {}  # ending -> mmap, or None when there is no file
+
+    def _table(self, name):
+        table = self.tables.get(name, False)
+        if table is False:
+            table = None
+            path = os.path.join(self.directory, name + '.tbl')
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    table = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.tables[name] = table
+        return table
+
+    def probe_pieces(self, pieces, turn):
+        # Table byte for [(piece code, square)] with turn to move, or None
+        # when the ending has no table
+        white = [piece & 7 for piece, _ in pieces if piece >> 3 == WHITE and piece & 7 != KING]
+        black = [piece & 7 for piece, _ in pieces if piece >> 3 == BLACK and piece & 7 != KING]
+        name, swapped = _signature(white, black)
+        if name in DRAWN_ENDINGS:
+            return 0
+        table = self._table(name)
+        if table is None:
+            return None
+        if swapped:
+            pieces = [(piece ^ 8, square ^ 56) for piece, square in pieces]
+            turn ^= 1
+        # Kings first, then each side's pieces from the most valuable down
+        pieces = sorted(pieces, key=lambda item: (item[0] & 7 != KING, item[0] >> 3, -(item[0] & 7)))
+        return table[_index([square for _, square in pieces], turn)]
+
+    def probe(self, position):
+        # Table byte for a position, or None when no table covers it
+        occupied = position.occupied[0] | position.occupied[1]
+        if occupied.bit_count() > MAX_PIECES or position.castling:
+            return None
+        if position.pieces[PAWN] or position.pieces[BLACK << 3 | PAWN]:
+            return None
+        pieces = []
+        while occupied:
+            low = occupied & -occupied
+            square = low.bit_length() - 1
+            pieces.append((position.squares[square], square))
+            occupied ^= low
+        return self.probe_pieces(pieces, position.turn)
+
+    def score(self, position, ply):
+        # Exact search score of a position ply plies from the root, or None
+        value = self.probe(position)
+        if value is None or value == ILLEGAL:
+            return None
+        if not value:
+            return 0
+        if value & 1:
+            return MATE - ply - value
+        return -MATE + ply + value - 2
+
+    def best_move(self, position):
+        # (move, score) with the quickest win or longest defence the tables
+        # give for a covered position, or None
+        score = self.score(position, 0)
+        if score is None:
+            return None
+        best = None
+        for move in generate_legal(position):
+            position.push(move)
+            value = self.probe(position)
+            position.pop()
+            if value is None or value == ILLEGAL:
+                return None
+            # Best first: the opponent mated soonest, then draws, then the
+            # opponent's slowest win
+            if not value:
+                rank = (1, 0)
+            elif value & 1:
+                rank = (0, value)
+            else:
+                rank = (2, -value)
+            if best is None or rank > best[0]:
+                best = (rank, move)
+        return (best[1], score) if best else None
+
+    def close(self):
+        for table in self.tables.values():
+            if table is not None:
+                table.close()
+        self.tables.clear()
+
+
+def open_tablebase(directory):
+    # The tablebase in directory, or None when there is no such directory
+    if not directory or not os.path.isdir(directory):
+        return None
+    return Tablebase(directory)
+
+
+def generate(directory, name, log=print):
+    # Write DIR/<name>.tbl, and first the tables of any endings its captures
+    # lead to that are missing
+    white, black = _parse_signature(name)
+    for sub in _sub_endings(name):
+        if not os.path.exists(os.path.join(directory, sub + '.tbl')):
+            generate(directory, sub, log)
+
+    started = time.time()
+    tablebase = Tablebase(directory)
+    kinds = [KING, KING] + white + black
+    colors = [WHITE, BLACK] + [WHITE] * len(white) + [BLACK] * len(black)
+    codes = [color << 3 | kind for color, kind in zip(colors, kinds)]
+    count = len(kinds)
+    weights = [64 ** (count - 1 - i) for i in range(count)]
+    side_weight = 10 * weights[0]
+    size = 2 * side_weight
+    movers = ([i for i in range(count) if colors[i] == WHITE], [i for i in range(count) if colors[i] == BLACK])
+
+    def attacked(square, by, squares, occupied, skip=None):
+        # Is square attacked by side by's pieces (other than piece skip)?
+        for i in movers[by]:
+            if i != skip and _attacks(kinds[i], squares[i], occupied) >> square & 1:
+                return True
+        return False
+
+    def positions():
+        index = 0
+        for side in (WHITE, BLACK):
+            for king in TRIANGLE:
+                for rest in product(range(64), repeat=count - 1):
+                    yield index, side, (king,) + rest
+                    index += 1
+
+    # Mark the illegal positions (pieces sharing a square or the side not to
+    # move in check) and the ones stored under another index. Moves that
+    # keep the white king off the diagonal keep the same symmetry, so their
+    # indexes can be worked out from the move alone.
+    values = bytearray(size)
+    for index, side, squares in positions():
+        if len(set(squares)) < count or (squares[0] in DIAGONAL and _index(squares, side) != index):
+            values[index] = ILLEGAL
+            continue
+        occupied = 0
+        for square in squares:
+            occupied |= 1 << square
+        if attacked(squares[side ^ 1], side, squares, occupied):
+            values[index] = ILLEGAL
+
+    # Count each position's quiet successors, and settle what its captures
+    # into smaller endings give it
+    quiet = bytearray(size)
+    floors = bytearray(size)  # Longest loss by a capture, in plies, or ESCAPE
+    buckets = {}  # ply -> array of positions that may be settled at that ply
+
+    def schedule(ply, index):
+        if ply >= ILLEGAL - 2:
+            raise ValueError('Mate too long to store in ' + name)
+        bucket = buckets.get(ply)
+        if bucket is None:
+            bucket = buckets[ply] = array('I')
+        bucket.append(index)
+
+    for index, side, squares in positions():
+        if values[index] == ILLEGAL:
+            continue
+        occupied = own = 0
+        where = {}
+        for i, square in enumerate(squares):
+            occupied |= 1 << square
+            where[square] = i
+            if colors[i] == side:
+                own |= 1 << square
+        successors = set()
+        captures = 0
+        win = None
+        floor = 0
+        for i in movers[side]:
+            start = squares[i]
+            targets = _attacks(kinds[i], start, occupied) & ~own
+            while targets:
+                low = targets & -targets
+                targets ^= low
+                end = low.bit_length() - 1
+                moved = squares[:i] + (end,) + squares[i + 1:]
+                taken = where.get(end)
+                if taken is None:
+                    if i and squares[0] not in DIAGONAL:
+                        successor = index + (end - start) * weights[i] + (side_weight if side == WHITE else -side_weight)
+                    else:
+                        successor = _index(moved, side ^ 1)
+                    if values[successor] != ILLEGAL:
+                        successors.add(successor)
+                    continue
+                after = occupied ^ 1 << start
+                if attacked(moved[side], side ^ 1, moved, after, taken):
+                    continue
+                captures += 1
+                value = tablebase.probe_pieces([(codes[k], moved[k]) for k in range(count) if k != taken], side ^ 1)
+                if not value:
+                    floor = ESCAPE
+                elif value & 1:
+                    if floor != ESCAPE:
+                        floor = max(floor, value + 1)
+                else:
+                    floor = ESCAPE
+                    win = value - 1 if win is None else min(win, value - 1)
+        quiet[index] = len(successors)
+        floors[index] = floor
+        if win is not None:
+            schedule(win, index)
+        elif not successors:
+            if captures:
+                if floor != ESCAPE:
+                    schedule(floor, index)
+            elif attacked(squares[side], side ^ 1, squares, occupied):
+                schedule(0, index)  # Checkmate
+            # Otherwise stalemate, which stays a draw
+
+    # Work backwards from the settled positions a ply at a time. A position
+    # lost in n plies makes every predecessor a win in n + 1; a won one
+    # takes one escape away from each predecessor, which is lost once it
+    # has none left.
+    ply = 0
+    longest = 0
+    while buckets:
+        bucket = buckets.pop(ply, ())
+        for index in bucket:
+            if values[index]:
+                continue  # Settled at an earlier ply
+            values[index] = ply if ply & 1 else ply + 2
+            longest = ply
+            rest = index
+            squares = [0] * count
+            for i in range(count - 1, 0, -1):
+                squares[i] = rest & 63
+                rest >>= 6
+            side, king = divmod(rest, 10)
+            squares[0] = TRIANGLE[king]
+            occupied = 0
+            for square in squares:
+                occupied |= 1 << square
+            mover = side ^ 1
+            predecessors = set()
+            for i in movers[mover]:
+                start = squares[i]
+                sources = _attacks(kinds[i], start, occupied) & ~occupied
+                while sources:
+                    low = sources & -sources
+                    sources ^= low
+                    source = low.bit_length() - 1
+                    if i and squares[0] not in DIAGONAL:
+                        predecessors.add(index + (source - start) * weights[i] +
+                                         (-side_weight if mover == WHITE else side_weight))
+                    else:
+                        squares[i] = source
+                        predecessors.add(_index(squares, mover))
+                        squares[i] = start
+            for predecessor in predecessors:
+                if values[predecessor]:
+                    continue  # Settled or illegal
+                if not ply & 1:
+                    schedule(ply + 1, predecessor)
+                else:
+                    quiet[predecessor] -= 1
+                    if not quiet[predecessor] and floors[predecessor] != ESCAPE:
+                        schedule(max(ply + 1, floors[predecessor]), predecessor)
+        ply += 1
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name + '.tbl')
+    with open(path + '.tmp', 'wb') as f:
+        f.write(values)
+    os.replace(path + '.tmp', path)
+    tablebase.close()
+    if log:
+        legal = size - values.count(ILLEGAL)
+        draws = values.count(0)
+        log('%s: %d positions, %d decided, longest mate %d plies, %.1fs'
+            % (name, legal, legal - draws, longest, time.time() - started))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build or probe endgame tablebases')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('generate', help='write tables')
+    build.add_argument('directory', nargs='?', default=DEFAULT_DIRECTORY)
+    build.add_argument('endings', nargs='*', default=['KQvK', 'KRvK'],
+                       help="endings such as KQvKR, or 'all' (default: KQvK KRvK)")
+    probe = commands.add_parser('probe', help='look up a position')
+    probe.add_argument('directory')
+    probe.add_argument('fen')
+    args = parser.parse_args(argv)
+
+    if args.command == 'generate':
+        endings = all_endings() if args.endings == ['all'] else args.endings
+        for name in endings:
+            try:
+                generate(args.directory, name)
+            except ValueError as e:
+                print(e, file=sys.stderr)
+                return 1
+        return 0
+
+    tablebase = Tablebase(args.directory)
+    position = Position.from_fen(args.fen)
+    value = tablebase.probe(position)
+    if value is None:
+        print('Not covered by the tables')
+    elif value == ILLEGAL:
+        print('Illegal position')
+    elif not value:
+        print('Draw')
+    else:
+        print('%s in %d plies' % ('Win' if value & 1 else 'Loss', value if value & 1 else value - 2))
+        best = tablebase.best_move(position)
+        if best:
+            from notation import move_to_san
+            print('Best move: ' + move_to_san(position, best[0]))
+    tablebase.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
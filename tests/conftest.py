@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Run the modules from the repository root, and keep bot searches in the
+# test process instead of starting worker processes
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('CHESS_BOT_WORKERS', '0')
+os.environ.setdefault('CHESS_GAME_STORE', 'memory')
@@ -0,0 +1,195 @@
+import json
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+import app
+from analysis import DEFAULT_LIMITS, analyse_positions, parse_item, read_limits
+from bot_pool import BotPool
+
+START = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+MATE_IN_ONE = '6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1'
+MATED = 'R5k1/5ppp/8/8/8/8/8/6K1 b - - 0 1'
+STALEMATE = '7k/5Q2/6K1/8/8/8/8/8 b - - 0 1'
+
+
+@pytest.fixture
+def pool():
+    pool = BotPool(0, 0, 0, 1 << 10)
+    yield pool
+    pool.shutdown()
+
+
+def ndjson(response):
+    # Closing the response gives back its analysis slot, as the server does
+    with response:
+        return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_read_limits():
+    assert read_limits({}, DEFAULT_LIMITS) == DEFAULT_LIMITS
+    limits = read_limits({'time_ms': '250', 'node_limit': '', 'max_depth': 500, 'difficulty': 'easy'},
+                         DEFAULT_LIMITS)
+    assert limits == {'time_ms': 250, 'node_limit': None, 'max_depth': 64, 'difficulty': 'easy'}
+    assert read_limits({'time_ms': 0, 'node_limit': 1000}, DEFAULT_LIMITS)['time_ms'] == 0
+    # With a cap, no time and too much time both mean the cap
+    assert read_limits({'time_ms': 0}, DEFAULT_LIMITS, 5000)['time_ms'] == 5000
+    assert read_limits({'time_ms': 60000}, DEFAULT_LIMITS, 5000)['time_ms'] == 5000
+
+
+@pytest.mark.parametrize('source, error', [
+    ({'time_ms': 0}, 'A time or node limit is needed'),
+    ({'time_ms': -1}, 'Invalid search limits'),
+    ({'node_limit': 0}, 'Invalid search limits'),
+    ({'max_depth': 'deep'}, 'Invalid search limits'),
+    ({'time_ms': [1]}, 'Invalid search limits'),
+    ({'difficulty': 'impossible'}, 'Unknown difficulty'),
+])
+def test_read_limits_rejects(source, error):
+    with pytest.raises(ValueError, match=error):
+        read_limits(source, DEFAULT_LIMITS)
+
+
+def test_parse_item():
+    assert parse_item(START, DEFAULT_LIMITS) == (START, None, DEFAULT_LIMITS)
+    fen, item_id, limits = parse_item(b'{"fen": "%s", "id": 7, "node_limit": 50}' % MATED.encode(), DEFAULT_LIMITS)
+    assert (fen, item_id, limits['node_limit']) == (MATED, 7, 50)
+    board = app.ChessGame().get_board()
+    assert parse_item({'board': board, 'turn': 'black'}, DEFAULT_LIMITS)[0] == START.replace(' w ', ' b ')
+    for item, error in [('{"fen": ', 'Invalid JSON'), ([START], 'Expected a FEN'), ({'id': 1}, 'Expected a FEN'),
+                        ({'board': board, 'turn': 'red'}, 'Invalid turn'), ({'board': [[1]]}, 'Invalid board'),
+                        ('not a fen', 'FEN needs at least 4 fields')]:
+        with pytest.raises(ValueError, match=error):
+            parse_item(item, DEFAULT_LIMITS)
+
+
+def test_results(pool):
+    results = list(analyse_positions(pool, [MATE_IN_ONE, MATED, STALEMATE], node_limit=2000, time_ms=0))
+    mate, mated, stalemate = sorted(results, key=lambda result: result['index'])
+    assert (mate['best_move'], mate['san'], mate['mate'], mate['score']) == ('a1a8', 'Ra8#', 1, None)
+    assert (mated['best_move'], mated['reason']) == (None, 'checkmate')
+    assert (stalemate['best_move'], stalemate['reason']) == (None, 'stalemate')
+    assert all(result['nodes'] <= 2000 for result in results)
+
+
+def test_bad_items_do_not_stop_the_batch(pool):
+    items = [START, 'not a fen', '{"fen": ', {'board': 'x'}, {'fen': MATE_IN_ONE, 'id': 'last'}]
+    results = sorted(analyse_positions(pool, items, node_limit=500, time_ms=0), key=lambda result: result['index'])
+    assert [result['index'] for result in results] == [0, 1, 2, 3, 4]
+    assert 'error' not in results[0] and results[0]['best_move']
+    assert [set(result) for result in results[1:4]] == [{'index', 'error'}] * 3
+    assert results[2]['error'] == 'Invalid JSON'
+    assert results[4]['id'] == 'last' and results[4]['best_move'] == 'a1a8'
+
+
+def test_failed_search_is_reported_per_item(monkeypatch, pool):
+    import analysis
+
+    def fail_on_mate(fen, *limits):
+        if fen == MATE_IN_ONE:
+            raise RuntimeError('worker died')
+        return {'fen': fen}
+
+    monkeypatch.setattr(analysis, 'analyse_fen', fail_on_mate)
+    results = sorted(analyse_positions(pool, [START, MATE_IN_ONE, MATED]), key=lambda result: result['index'])
+    assert results == [{'index': 0, 'fen': START}, {'index': 1, 'error': 'Analysis failed: worker died'},
+                       {'index': 2, 'fen': MATED}]
+
+
+def test_items_override_the_limits(pool):
+    items = [{'fen': START, 'max_depth': 1}, {'fen': START, 'node_limit': 100}, {'fen': START, 'time_ms': 0}]
+    results = sorted(analyse_positions(pool, items, node_limit=5000, time_ms=0, max_depth=3),
+                     key=lambda result: result['index'])
+    assert results[0]['depth'] == 1
+    assert results[1]['nodes'] <= 100 < results[0]['nodes'] + results[2]['nodes']
+    assert results[2]['depth'] == 3 and results[2]['nodes'] <= 5000
+
+
+def test_unbounded_limits_are_rejected(pool):
+    with pytest.raises(ValueError, match='A time or node limit is needed'):
+        next(analyse_positions(pool, [START], time_ms=0))
+    # An item can't drop the batch's node limit either way, but can ask for no time
+    results = list(analyse_positions(pool, [{'fen': START, 'time_ms': 0, 'node_limit': None}], time_ms=0,
+                                     node_limit=100))
+    assert results[0]['nodes'] <= 100
+    [result] = analyse_positions(pool, [{'fen': START, 'time_ms': 0}], max_depth=2)
+    assert result == {'index': 0, 'error': 'A time or node limit is needed'}
+
+
+class SlowFirstPool:
+    # Finishes the first item it is given last
+    workers = 2
+
+    def __init__(self):
+        self.calls = 0
+
+    def run(self, function, *args):
+        future = Future()
+        delay = 0.2 if not self.calls else 0
+        self.calls += 1
+        threading.Timer(delay, future.set_result, ({'fen': args[0]},)).start()
+        return future
+
+
+def test_results_come_in_finish_order_with_their_index():
+    items = [{'fen': START, 'id': 'slow'}, {'fen': MATED, 'id': 'fast'}]
+    results = list(analyse_positions(SlowFirstPool(), items))
+    assert [(result['index'], result['id']) for result in results] == [(1, 'fast'), (0, 'slow')]
+
+
+def test_analyse_route_ndjson():
+    client = app.app.test_client()
+    body = '\n'.join([MATE_IN_ONE, 'not a fen', '', json.dumps({'fen': START, 'id': 'd2', 'max_depth': 2})]) + '\n'
+    response = client.post('/analyse?node_limit=300&time_ms=0', data=body, content_type='application/x-ndjson')
+    assert response.status_code == 200 and response.mimetype == 'application/x-ndjson'
+    results = sorted(ndjson(response), key=lambda result: result['index'])
+    assert [result['index'] for result in results] == [0, 1, 2]
+    assert results[0]['best_move'] == 'a1a8' and results[0]['nodes'] <= 300
+    assert 'error' in results[1]
+    assert (results[2]['id'], results[2]['depth']) == ('d2', 2)
+
+
+def test_analyse_route_json():
+    client = app.app.test_client()
+    response = client.post('/analyse', json={'node_limit': 200, 'positions': [
+        MATED, {'fen': START, 'node_limit': 50}, 42]})
+    results = sorted(ndjson(response), key=lambda result: result['index'])
+    assert results[0]['reason'] == 'checkmate'
+    assert results[1]['nodes'] <= 50
+    assert results[2] == {'index': 2, 'error': 'Expected a FEN or an object with a fen or a board'}
+
+
+@pytest.mark.parametrize('query, body, error', [
+    ('?time_ms=-5', START, 'Invalid search limits'),
+    ('?node_limit=none', START, 'Invalid search limits'),
+    ('?difficulty=godlike', START, 'Unknown difficulty'),
+    ('', {'positions': START}, 'Expected an object with a positions list'),
+    ('', {'positions': [START], 'time_ms': -1}, 'Invalid search limits'),
+])
+def test_analyse_route_rejects(query, body, error):
+    client = app.app.test_client()
+    if isinstance(body, dict):
+        response = client.post('/analyse' + query, json=body)
+    else:
+        response = client.post('/analyse' + query, data=body, content_type='application/x-ndjson')
+    assert response.status_code == 400 and response.json['error'] == error
+
+
+def test_analyse_route_caps_the_time(monkeypatch):
+    # No time limit on the route means the server's longest bot search
+    searches = []
+    monkeypatch.setattr('analysis.analyse_fen', lambda *args: searches.append(args) or {})
+    client = app.app.test_client()
+    ndjson(client.post('/analyse?time_ms=0', data=START, content_type='application/x-ndjson'))
+    ndjson(client.post('/analyse', json={'positions': [{'fen': START, 'time_ms': 10 ** 9}]}))
+    assert [search[1] for search in searches] == [app.BOT_MAX_TIME_MS] * 2
+
+
+def test_analyse_route_is_busy_when_all_slots_are_taken(monkeypatch):
+    monkeypatch.setattr(app, 'analysis_slots', threading.BoundedSemaphore(1))
+    client = app.app.test_client()
+    running = client.post('/analyse', json={'positions': [START], 'node_limit': 10})
+    assert client.post('/analyse', json={'positions': [START]}).status_code == 503
+    ndjson(running)
+    assert ndjson(client.post('/analyse', json={'positions': [START], 'node_limit': 10}))[0]['best_move']
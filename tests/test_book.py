@@ -0,0 +1,102 @@
+import random
+
+import pytest
+
+import app
+from book import ENTRY, DEFAULT_BOOK, OpeningBook, build_book, write_book
+from movegen import encode_move
+from position import Position
+
+START = Position.initial()
+E4, D4, NF3, C4 = encode_move(52, 36), encode_move(51, 35), encode_move(62, 45), encode_move(50, 34)
+
+
+def raw_book(path, entries):
+    # A book file of (key, move, weight) entries, in the order given
+    with open(path, 'wb') as f:
+        for key, move, weight in entries:
+            f.write(ENTRY.pack(key, move, weight, 0))
+    return OpeningBook(str(path))
+
+
+@pytest.fixture
+def book(tmp_path):
+    counts = {(START.hash, E4): 5, (START.hash, D4): 3, (START.hash, NF3): 1,
+              (0, E4): 1, (2 ** 64 - 1, D4): 2, (START.hash - 1, C4): 4, (START.hash + 1, C4): 4}
+    path = tmp_path / 'book.bin'
+    assert write_book(counts, str(path)) == len(counts)
+    book = OpeningBook(str(path))
+    yield book
+    book.close()
+
+
+def test_lookup_finds_every_entry_of_a_key(book):
+    # Duplicate keys come back together, heaviest first
+    assert book.lookup(START.hash) == [(E4, 5), (D4, 3), (NF3, 1)]
+    assert book.lookup(0) == [(E4, 1)]
+    assert book.lookup(2 ** 64 - 1) == [(D4, 2)]
+
+
+@pytest.mark.parametrize('key', [1, START.hash - 2, START.hash + 2, 2 ** 64 - 2])
+def test_lookup_misses(book, key):
+    assert book.lookup(key) == []
+
+
+def test_empty_book(tmp_path):
+    book = raw_book(tmp_path / 'empty.bin', [])
+    assert book.count == 0 and book.lookup(START.hash) == [] and book.choose(START) is None
+    book.close()
+
+
+def test_truncated_book_is_rejected(tmp_path):
+    path = tmp_path / 'bad.bin'
+    path.write_bytes(bytes(ENTRY.size + 3))
+    with pytest.raises(ValueError):
+        OpeningBook(str(path))
+
+
+def test_choice_is_weighted_and_repeatable(book):
+    picks = [book.choose(START, random.Random(7)) for _ in range(3)]
+    assert picks[0] == picks[1] == picks[2]
+    rng = random.Random(1)
+    counts = {E4: 0, D4: 0, NF3: 0}
+    for _ in range(900):
+        counts[book.choose(START, rng)] += 1
+    assert counts[E4] > counts[D4] > counts[NF3] > 0
+
+
+def test_zero_weight_and_illegal_moves_are_never_chosen(tmp_path):
+    illegal = encode_move(52, 28)  # e2e5
+    book = raw_book(tmp_path / 'weights.bin', [(START.hash, E4, 0), (START.hash, illegal, 50),
+                                               (START.hash, D4, 1)])
+    rng = random.Random(3)
+    assert {book.choose(START, rng) for _ in range(50)} == {D4}
+    book.close()
+    book = raw_book(tmp_path / 'zero.bin', [(START.hash, E4, 0), (START.hash, illegal, 9)])
+    assert book.choose(START) is None
+    book.close()
+
+
+def test_shipped_book_matches_a_rebuild(tmp_path):
+    path = tmp_path / 'rebuilt.bin'
+    build_book(str(path))
+    with open(DEFAULT_BOOK, 'rb') as f:
+        assert path.read_bytes() == f.read()
+
+
+def test_bot_plays_a_book_move():
+    client = app.app.test_client()
+    client.post('/start_game', json={'game_id': 'book'})
+    response = client.post('/bot_move', json={'game_id': 'book'})
+    assert response.json['status'] == 'move made'
+    assert response.json['search']['book'] and response.json['search']['nodes'] == 0
+    book = OpeningBook(DEFAULT_BOOK)
+    try:
+        book_fens = set()
+        for move, _ in book.lookup(START.hash):
+            position = Position.initial()
+            position.push(move)
+            book_fens.add(position.to_fen())
+    finally:
+        book.close()
+    assert client.get('/fen/book').json['fen'] in book_fens
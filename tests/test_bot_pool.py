@@ -0,0 +1,81 @@
+import os
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from bot_pool import BotPool
+from position import Position
+
+
+@pytest.fixture
+def pool():
+    pool = BotPool(1, 4, 30000, 1 << 10)
+    yield pool
+    pool.shutdown()
+
+
+def break_pool(pool):
+    # A worker that dies breaks the whole pool
+    executor = pool._executor()
+    with pytest.raises(BrokenProcessPool):
+        pool.run(os._exit, 1).result(timeout=60)
+    return executor
+
+
+def settle(pool):
+    # Job callbacks run just after the waiters wake
+    deadline = time.monotonic() + 10
+    while pool.pending and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_run_starts_a_new_pool_when_a_worker_dies(pool):
+    broken = break_pool(pool)
+    assert pool.run(pow, 2, 10).result(timeout=60) == 1024
+    assert pool.executor is not broken
+
+
+def test_submit_starts_a_new_pool_when_a_worker_dies(pool):
+    broken = break_pool(pool)
+    job = pool.submit('game', Position.from_fen('6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1'), None, 500, 4, 'easy')
+    assert job.wait(60) == 'done'
+    assert job.result()['move'] is not None
+    settle(pool)
+    assert pool.executor is not broken and pool.pending == 0
+
+
+@pytest.mark.parametrize('node_limit', [3, 1000])
+def test_parallel_search_shares_the_node_limit(node_limit):
+    pool = BotPool(2, 4, 30000, 1 << 10)
+    try:
+        position = Position.from_fen('r1bq1rk1/pp2bppp/2n1pn2/2pp4/3P4/2PBPN2/PP1N1PPP/R2QK2R w KQ - 0 8')
+        job = pool.submit('game', position, None, node_limit, 64, 'easy', 2)
+        assert job.wait(60) == 'done'
+        result = job.result()
+        assert result['workers'] == 2 and 0 < result['nodes'] <= node_limit
+    finally:
+        pool.shutdown()
+
+
+def test_overlapping_parallel_searches_get_their_own_tables():
+    pool = BotPool(2, 4, 30000, 1 << 10)
+    try:
+        position = Position.from_fen('r1bq1rk1/pp2bppp/2n1pn2/2pp4/3P4/2PBPN2/PP1N1PPP/R2QK2R w KQ - 0 8')
+        first = pool.submit('one', position, 300, None, 64, 'easy', 2)
+        second = pool.submit('two', position, 300, None, 64, 'easy', 2)
+        first_tt, second_tt = first.shared_tt[1], second.shared_tt[1]
+        assert first_tt is not second_tt
+        assert first.wait(60) == second.wait(60) == 'done'
+        assert first.result()['move'] is not None and second.result()['move'] is not None
+        settle(pool)
+        assert first.shared_tt is None and len(pool.free_tts['easy']) == 2
+
+        # A finished search's table is reused, starting a new generation
+        generations = {first_tt: first_tt.generation, second_tt: second_tt.generation}
+        third = pool.submit('three', position, None, 1000, 64, 'easy', 2)
+        tt = third.shared_tt[1]
+        assert tt in generations and tt.generation == (generations[tt] + 1) & 63
+        assert third.wait(60) == 'done' and len(pool.shared_tts) == 2
+    finally:
+        pool.shutdown()
@@ -0,0 +1,150 @@
+import json
+
+import app
+import game_events
+from chess_game import ChessGame
+from game_events import GameEvents
+from notation import move_to_uci
+
+
+def play(game, events, *uci):
+    # Play moves the way the routes do, publishing each change
+    for text in uci:
+        move = next(move for move in game.legal_move_list() if move_to_uci(move) == text)
+        game.play_move(move)
+        events.publish('g', game.view)
+
+
+def parse(text):
+    # [(id, event, data)] from SSE text, skipping comment lines
+    frames = []
+    for block in text.split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.split('\n') if line and not line.startswith(':'))
+        if fields:
+            frames.append((int(fields['id']), fields['event'], json.loads(fields['data'])))
+    return frames
+
+
+def test_new_client_gets_a_sync_then_moves():
+    events, game = GameEvents(), ChessGame()
+    stream = events.stream('g', lambda: game.view, poll_seconds=0.05)
+    [(version, name, data)] = parse(next(stream))
+    assert (version, name) == (0, 'sync')
+    assert data['fen'] == game.view.fen and data['turn'] == 'white' and not data['game_over']
+
+    play(game, events, 'e2e4', 'd7d5', 'e4d5')
+    frames = parse(next(stream))
+    assert [(version, name) for version, name, _ in frames] == [(1, 'move'), (2, 'move'), (3, 'move')]
+    assert frames[0][2] == {'from': [6, 4], 'to': [4, 4], 'promotion': None, 'captured': None, 'turn': 'black',
+                            'game_over': False, 'winner': None, 'reason': None}
+    assert frames[2][2]['captured'] == 'black pawn'
+    stream.close()
+    assert not events.channels
+
+
+def test_other_changes_are_sent_as_a_sync():
+    events, game = GameEvents(), ChessGame()
+    stream = events.stream('g', lambda: game.view, poll_seconds=0.05)
+    next(stream)
+    play(game, events, 'e2e4')
+    next(stream)
+    game.undo_move()
+    events.publish('g', game.view)
+    [(version, name, data)] = parse(next(stream))
+    assert (version, name) == (2, 'sync') and data['fen'] == ChessGame().view.fen
+    stream.close()
+
+
+def test_up_to_date_client_gets_keep_alives():
+    events, game = GameEvents(), ChessGame()
+    play(game, events, 'e2e4')
+    stream = events.stream('g', lambda: game.view, 1, poll_seconds=0.01)
+    assert next(stream) == ': keep-alive\n\n'
+    stream.close()
+
+
+def test_reconnecting_client_gets_the_moves_it_missed():
+    events, game = GameEvents(), ChessGame()
+    # The channel and its backlog live while someone listens
+    watcher = events.stream('g', lambda: game.view, poll_seconds=0.05)
+    next(watcher)
+    play(game, events, 'e2e4', 'e7e5', 'g1f3')
+
+    stream = events.stream('g', lambda: game.view, 1, poll_seconds=0.05)
+    frames = parse(next(stream))
+    assert [(version, name) for version, name, _ in frames] == [(2, 'move'), (3, 'move')]
+    assert frames[-1][2]['to'] == [5, 5]
+    stream.close()
+    watcher.close()
+
+
+def test_reconnecting_past_the_backlog_gets_a_sync(monkeypatch):
+    monkeypatch.setattr(game_events, 'BACKLOG', 2)
+    events, game = GameEvents(), ChessGame()
+    watcher = events.stream('g', lambda: game.view, poll_seconds=0.05)
+    next(watcher)
+    play(game, events, 'e2e4', 'e7e5', 'g1f3', 'b8c6')
+
+    stream = events.stream('g', lambda: game.view, 1, poll_seconds=0.05)
+    [(version, name, data)] = parse(next(stream))
+    assert (version, name) == (4, 'sync') and data['fen'] == game.view.fen
+    stream.close()
+
+    # The same for a client that stopped reading while the backlog moved on
+    play(game, events, 'f1b5', 'a7a6', 'b5a4')
+    [(version, name, data)] = parse(next(watcher))
+    assert (version, name) == (7, 'sync') and data['fen'] == game.view.fen
+    watcher.close()
+
+
+def test_reconnecting_without_a_watcher_gets_a_sync():
+    events, game = GameEvents(), ChessGame()
+    play(game, events, 'e2e4', 'e7e5')
+    stream = events.stream('g', lambda: game.view, 1, poll_seconds=0.05)
+    [(version, name, _)] = parse(next(stream))
+    assert (version, name) == (2, 'sync')
+    stream.close()
+
+
+def test_change_made_elsewhere_is_picked_up_by_polling():
+    # Another worker process changed the game: nothing was published here
+    events, game = GameEvents(), ChessGame()
+    stream = events.stream('g', lambda: game.view, poll_seconds=0.01)
+    next(stream)
+    game.play_move(game.legal_move_list()[0])
+    [(version, name, _)] = parse(next(stream))
+    assert (version, name) == (1, 'sync')
+    stream.close()
+
+
+def test_stream_ends_when_the_game_is_gone():
+    events, game = GameEvents(), ChessGame()
+    views = [game.view]
+    stream = events.stream('g', lambda: views[0], poll_seconds=0.01)
+    next(stream)
+    views[0] = None
+    assert list(stream) == []
+    assert not events.channels
+
+
+def test_events_route():
+    client = app.app.test_client()
+    client.post('/start_game', json={'game_id': 'watched'})
+    response = client.get('/events/watched', buffered=False)
+    assert response.mimetype == 'text/event-stream'
+    chunks = iter(response.response)
+    [(_, name, _)] = parse(next(chunks).decode())
+    assert name == 'sync'
+
+    client.post('/move', json={'game_id': 'watched', 'start': [6, 4], 'end': [4, 4]})
+    client.post('/move', json={'game_id': 'watched', 'start': [1, 4], 'end': [3, 4]})
+    assert [name for _, name, _ in parse(next(chunks).decode())] == ['move', 'move']
+
+    # EventSource reconnects with the last id it saw
+    replay = client.get('/events/watched', headers={'Last-Event-ID': '1'}, buffered=False)
+    [(version, name, data)] = parse(next(iter(replay.response)).decode())
+    assert (version, name, data['to']) == (2, 'move', [3, 4])
+    replay.close()
+    response.close()
+
+    assert client.get('/events/watched?since=x').status_code == 400
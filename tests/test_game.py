@@ -0,0 +1,141 @@
+import pytest
+
+import app
+
+from chess_game import ChessGame
+from position import MAX_HALFMOVE_CLOCK
+from notation import parse_san
+
+
+def play(game, *sans):
+    for san in sans:
+        game.play_move(parse_san(game.position, san))
+
+
+@pytest.mark.parametrize('clock', [99, MAX_HALFMOVE_CLOCK - 1, MAX_HALFMOVE_CLOCK])
+def test_undo_at_a_large_halfmove_clock(clock):
+    fen = '4k3/8/8/8/8/8/8/R3K3 w Q - %d 60' % clock
+    game = ChessGame(fen=fen)
+    play(game, 'Ra2', 'Kd7', 'Ra3')
+    assert len(game.moves) == len(game.undo_records) == 3
+    assert game.position.halfmove_clock == clock + 3
+    while game.undo_move():
+        pass
+    assert game.position.to_fen() == fen
+    assert game.redo_move() and game.position.halfmove_clock == clock + 1
+
+
+def assert_draw(game, reason):
+    assert game.game_over and game.winner == 'draw' and game.end_reason == reason
+    assert game.result() == '1/2-1/2' and game.view.reason == reason and not game.view.moves_from
+
+
+def assert_playing(game):
+    assert not game.game_over and game.winner is None and game.end_reason is None
+    assert game.result() == '*' and game.view.moves_from
+
+
+SHUFFLE = ('Nf3', 'Nf6', 'Ng1', 'Ng8')
+
+
+def test_threefold_repetition():
+    game = ChessGame()
+    play(game, *SHUFFLE)
+    assert_playing(game)  # The start position has occurred twice
+    play(game, *SHUFFLE[:3])
+    assert_playing(game)
+    play(game, SHUFFLE[3])
+    assert_draw(game, 'threefold repetition')
+
+    assert game.undo_move()
+    assert_playing(game)
+    assert game.redo_move()
+    assert_draw(game, 'threefold repetition')
+
+
+def test_repetition_needs_the_same_side_to_move():
+    # Triangulating with the king brings the pieces back with the other side
+    # to move, which doesn't count
+    game = ChessGame(fen='4k3/8/8/8/8/8/8/R3K3 w - - 0 1')
+    play(game, 'Kd1', 'Kd8', 'Kd2', 'Ke8', 'Ke1', 'Kd8', 'Kd1', 'Ke8', 'Ke1')
+    assert_playing(game)
+
+
+def test_fifty_move_rule():
+    game = ChessGame(fen='4k3/8/8/8/8/8/8/R3K3 w - - 98 70')
+    play(game, 'Ra2')
+    assert_playing(game)
+    play(game, 'Kd7')
+    assert_draw(game, 'fifty-move rule')
+    assert game.position.halfmove_clock == 100
+
+    game.undo_move()
+    assert_playing(game)
+    game.undo_move()
+    play(game, 'Kd1', 'Kd7')
+    assert_draw(game, 'fifty-move rule')
+
+
+def test_a_pawn_move_or_capture_resets_the_fifty_move_count():
+    game = ChessGame(fen='4k3/4p3/8/8/8/8/8/R3K3 b - - 99 70')
+    play(game, 'e5')
+    assert_playing(game)
+    assert game.position.halfmove_clock == 0
+
+
+def test_insufficient_material():
+    game = ChessGame(fen='4k3/8/8/8/8/8/3q4/4K3 w - - 0 1')
+    play(game, 'Kxd2')
+    assert_draw(game, 'insufficient material')
+    assert game.captured_pieces['white'] == ['black queen']
+
+    game.undo_move()
+    assert_playing(game)
+    assert game.captured_pieces['white'] == []
+    play(game, 'Kf1', 'Qd1')
+    assert_playing(game)
+
+
+@pytest.mark.parametrize('fen', [
+    '4k3/8/8/8/8/8/8/4K3 w - - 0 1',
+    '4k3/8/8/8/8/8/8/4KN2 w - - 0 1',
+    '4kb2/8/8/8/8/8/8/2B1K3 w - - 0 1',  # Bishops on squares of one colour
+])
+def test_dead_positions_are_drawn_from_the_start(fen):
+    assert_draw(ChessGame(fen=fen), 'insufficient material')
+
+
+@pytest.mark.parametrize('fen', [
+    '4k3/8/8/8/8/8/8/2B1KB2 w - - 0 1',  # Bishops on both colours
+    '4k3/8/8/8/8/8/8/3NKN2 w - - 0 1',
+    '4k3/8/8/8/8/8/4P3/4K3 w - - 0 1',
+])
+def test_material_that_can_still_mate(fen):
+    assert_playing(ChessGame(fen=fen))
+
+
+def test_draws_through_the_routes():
+    client = app.app.test_client()
+    client.post('/start_game', json={'game_id': 'draw', 'fen': '4k3/8/8/8/8/8/3q4/4K3 w - - 0 1'})
+    response = client.post('/move', json={'game_id': 'draw', 'start': [7, 4], 'end': [6, 3]})
+    assert response.json['game_over'] and response.json['reason'] == 'insufficient material'
+    assert response.json['winner'] == 'draw'
+    response = client.post('/move', json={'game_id': 'draw', 'start': [6, 3], 'end': [5, 3]})
+    assert response.json['status'] == 'game over'
+
+    response = client.post('/undo', json={'game_id': 'draw'})
+    assert response.json['status'] == 'success' and not response.json['game_over']
+    assert response.json['captured'] == {'white': [], 'black': []}
+    response = client.post('/redo', json={'game_id': 'draw'})
+    assert response.json['game_over'] and response.json['reason'] == 'insufficient material'
+
+
+def test_play_on_after_a_claimable_draw():
+    # A PGN may continue past a repetition or the fifty-move rule, which
+    # only end a game here because no one is asked whether to claim them
+    moves = ' '.join('%d. %s %s' % (number + 1, *pair) for number, pair in
+                     enumerate(zip(SHUFFLE[::2] * 2, SHUFFLE[1::2] * 2)))
+    game = ChessGame.from_pgn(moves + ' 5. e4 *')
+    assert_playing(game)
+    with pytest.raises(ValueError):
+        ChessGame.from_pgn('[FEN "4k3/8/8/8/8/8/3q4/4K3 w - - 0 1"]\n\n1. Kxd2 Ke7 *')
@@ -0,0 +1,163 @@
+import time
+
+import pytest
+
+import app
+from game_store import GameStore, GameConflict, MemoryBackend, open_backend
+from movegen import encode_move
+from notation import move_to_uci
+
+
+def make_store(max_games=1000, idle_seconds=0, backend=None, shared=False):
+    return GameStore(backend or MemoryBackend(), lambda game: game.to_snapshot(), app.ChessGame.from_snapshot,
+                     max_games, idle_seconds, shared)
+
+
+def play(game, *uci):
+    for text in uci:
+        move = next(move for move in game.legal_move_list() if move_to_uci(move) == text)
+        game.play_move(move)
+
+
+def test_locked_loads_a_game_evicted_before_the_lock():
+    # A request got the game, then another game pushed it out of the store
+    # before the request took its lock
+    store = make_store(max_games=1)
+    store['a'] = app.ChessGame()
+    stale = store.get('a')
+    store['b'] = app.ChessGame()
+    assert stale.evicted and 'a' not in store.live
+
+    with store.locked('a', stale) as game:
+        assert game is not stale and not game.evicted
+        play(game, 'e2e4')
+    assert store.get('a') is game
+    assert store.get('a').position.to_fen() == game.position.to_fen()
+
+
+def test_locked_keeps_a_game_in_use():
+    store = make_store(max_games=1)
+    store['a'] = app.ChessGame()
+    with store.locked('a') as game:
+        store['b'] = app.ChessGame()
+        assert not game.evicted and 'a' in store.live
+    store['c'] = app.ChessGame()
+    assert game.evicted
+
+
+def test_locked_missing_game():
+    store = make_store()
+    with store.locked('nope') as game:
+        assert game is None
+
+
+def test_moves_survive_eviction_between_requests():
+    client = app.app.test_client()
+    client.post('/start_game', json={'game_id': 'evicted'})
+    with app.games.lock:
+        app.games._evict('evicted')
+    assert client.post('/move', json={'game_id': 'evicted', 'start': [6, 4], 'end': [4, 4]}).json['status'] == \
+        'move made'
+    with app.games.lock:
+        app.games._evict('evicted')
+    assert client.get('/fen/evicted').json['fen'].startswith('rnbqkbnr/pppppppp/8/8/4P3/')
+
+
+def test_least_recently_used_games_are_snapshotted():
+    store = make_store(max_games=2)
+    store['a'] = app.ChessGame()
+    play(store['a'], 'e2e4')
+    store['b'] = app.ChessGame()
+    store.get('a')
+    store['c'] = app.ChessGame()
+    assert list(store.live) == ['a', 'c']
+    assert store.evictions == 1 and store.backend.get('b') is not None
+
+    # Loading it again makes it live and drops the snapshot
+    assert store['b'].position.to_fen() == app.ChessGame().position.to_fen()
+    assert 'b' in store.live and store.backend.get('b') is None
+    assert store['a'].moves.tolist() == [encode_move(52, 36)]
+
+
+def test_idle_games_are_snapshotted():
+    store = make_store(idle_seconds=0.05)
+    store['a'] = app.ChessGame()
+    time.sleep(0.1)
+    store['b'] = app.ChessGame()
+    assert list(store.live) == ['b']
+    assert store.get('a') is not None
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'fakeredis'])
+def backend_url(request, tmp_path):
+    return 'sqlite:///%s' % (tmp_path / 'games.db') if request.param == 'sqlite' else request.param
+
+
+def test_snapshots_expire(backend_url):
+    if backend_url == 'fakeredis':
+        pytest.skip('Redis TTLs are whole seconds')
+    backend = open_backend(backend_url, ttl=0.05)
+    backend.put('a', b'snapshot')
+    assert backend.get('a') == b'snapshot'
+    time.sleep(0.1)
+    assert backend.get('a') is None
+    assert backend.read('a') == (None, None)
+
+
+def test_backend_versions(backend_url):
+    backend = open_backend(backend_url)
+    assert backend.read('a') == (None, None)
+    assert backend.replace('a', b'one', 1) is None
+    version = backend.put('a', b'one')
+    assert backend.read('a') == (b'one', version)
+    newer = backend.replace('a', b'two', version)
+    assert newer is not None and newer != version
+    assert backend.replace('a', b'three', version) is None
+    assert backend.read('a') == (b'two', newer)
+    assert backend.put('a', b'four') not in (version, newer)
+    backend.delete('a')
+    assert backend.get('a') is None
+
+
+def test_shared_store_rejects_a_lost_update(backend_url):
+    # Two processes load the same game; the second save must not overwrite
+    # the first one's move
+    store = make_store(backend=open_backend(backend_url), shared=True)
+    store['a'] = app.ChessGame()
+    first, second = store.get('a'), store.get('a')
+    play(first, 'e2e4')
+    store.save('a', first)
+    play(second, 'd2d4')
+    with pytest.raises(GameConflict):
+        store.save('a', second)
+    assert store.get('a').moves.tolist() == [encode_move(52, 36)]
+
+    # A game loaded after the save can be saved, more than once
+    third = store.get('a')
+    play(third, 'e7e5')
+    store.save('a', third)
+    play(third, 'g1f3')
+    store.save('a', third)
+    assert len(store.get('a').moves) == 3
+
+
+def test_conflicting_request_gets_409(monkeypatch):
+    store = make_store(backend=open_backend('fakeredis'), shared=True)
+    monkeypatch.setattr(app, 'games', store)
+    client = app.app.test_client()
+    client.post('/start_game', json={'game_id': 'shared'})
+    get = store.get
+
+    def get_then_another_move(game_id, default=None):
+        # Another process moves between this request's load and its save
+        game = get(game_id, default)
+        other = get(game_id)
+        play(other, 'g1f3')
+        store.save(game_id, other)
+        return game
+
+    monkeypatch.setattr(store, 'get', get_then_another_move)
+    response = client.post('/move', json={'game_id': 'shared', 'start': [6, 4], 'end': [4, 4]})
+    assert response.status_code == 409
+    monkeypatch.setattr(store, 'get', get)
+    assert client.get('/fen/shared').json['fen'].startswith('rnbqkbnr/pppppppp/8/8/8/5N2/')
@@ -0,0 +1,131 @@
+import os
+import subprocess
+import sys
+
+import app
+import metrics
+
+
+def test_counter_rendering(monkeypatch):
+    monkeypatch.setattr(metrics, '_metrics', [])
+    plain = metrics.counter('plain_total', 'A counter without labels')
+    labelled = metrics.counter('labelled_total', 'A counter with labels', ('path', 'status'))
+    assert metrics.render() == ('# HELP plain_total A counter without labels\n'
+                                '# TYPE plain_total counter\n'
+                                'plain_total 0\n'
+                                '# HELP labelled_total A counter with labels\n'
+                                '# TYPE labelled_total counter\n')
+
+    plain.inc()
+    plain.add(2.5)
+    labelled.inc('/b', 200)
+    labelled.add(3, '/a', 404)
+    labelled.inc('/b', 200)
+    assert metrics.render().splitlines()[2:] == [
+        'plain_total 3.5',
+        '# HELP labelled_total A counter with labels',
+        '# TYPE labelled_total counter',
+        'labelled_total{path="/a",status="404"} 3',
+        'labelled_total{path="/b",status="200"} 2',
+    ]
+
+
+def test_label_values_are_escaped():
+    counter = metrics.Counter('escaped_total', 'Escaping', ('value',))
+    counter.inc('a "quoted" back\\slash\nnewline')
+    assert counter.samples() == [r'escaped_total{value="a \"quoted\" back\\slash\nnewline"} 1']
+
+
+def test_histogram_rendering():
+    histogram = metrics.Histogram('took_seconds', 'Times', ('endpoint',), buckets=(1, 0.1, 0.5))
+    for value in (0.05, 0.1, 0.3, 2):
+        histogram.observe(value, 'move')
+    histogram.observe(0.7, 'fen')
+    assert histogram.samples() == [
+        'took_seconds_bucket{endpoint="fen",le="0.1"} 0',
+        'took_seconds_bucket{endpoint="fen",le="0.5"} 0',
+        'took_seconds_bucket{endpoint="fen",le="1.0"} 1',
+        'took_seconds_bucket{endpoint="fen",le="+Inf"} 1',
+        'took_seconds_sum{endpoint="fen"} 0.7',
+        'took_seconds_count{endpoint="fen"} 1',
+        # Buckets are cumulative and a value on a bound falls in that bucket
+        'took_seconds_bucket{endpoint="move",le="0.1"} 2',
+        'took_seconds_bucket{endpoint="move",le="0.5"} 3',
+        'took_seconds_bucket{endpoint="move",le="1.0"} 3',
+        'took_seconds_bucket{endpoint="move",le="+Inf"} 4',
+        'took_seconds_sum{endpoint="move"} 2.45',
+        'took_seconds_count{endpoint="move"} 4',
+    ]
+
+
+def test_reading_and_type_lines(monkeypatch):
+    monkeypatch.setattr(metrics, '_metrics', [])
+    metrics.reading('live_things', 'Things alive', lambda: 7)
+    metrics.reading('made_total', 'Things made elsewhere', lambda: 12, 'counter')
+    metrics.histogram('empty_seconds', 'Nothing observed yet')
+    assert metrics.render() == ('# HELP live_things Things alive\n# TYPE live_things gauge\nlive_things 7\n'
+                                '# HELP made_total Things made elsewhere\n# TYPE made_total counter\nmade_total 12\n'
+                                '# HELP empty_seconds Nothing observed yet\n# TYPE empty_seconds histogram\n')
+
+
+def test_disabled_metrics_count_nothing(monkeypatch):
+    monkeypatch.setattr(metrics, 'enabled', False)
+    counter = metrics.Counter('off_total', 'Off', ('kind',))
+    histogram = metrics.Histogram('off_seconds', 'Off')
+    counter.inc('a')
+    counter.add(5, 'a')
+    histogram.observe(0.2)
+    assert counter.samples() == [] and histogram.samples() == []
+
+
+def test_metrics_route_counts_requests():
+    client = app.app.test_client()
+    client.get('/fen/no-such-game')
+    text = client.get('/metrics').get_data(as_text=True)
+    assert '# TYPE chess_http_requests_total counter' in text
+    assert 'chess_http_requests_total{endpoint="get_fen",status="404"} ' in text
+    assert 'chess_http_request_seconds_bucket{endpoint="get_fen",le="+Inf"} ' in text
+    assert 'chess_live_games ' in text
+
+
+def test_profiling_is_off_by_default():
+    client = app.app.test_client()
+    assert not app.PROFILING_ENABLED
+    response = client.get('/fen/no-such-game?profile=1')
+    assert 'X-Profile-Id' not in response.headers
+    assert client.get('/profiles/1').status_code == 404
+
+
+def test_profiling_when_opted_in(monkeypatch):
+    monkeypatch.setattr(app, 'PROFILING_ENABLED', True)
+    monkeypatch.setattr(app, 'profiles', metrics.ProfileStore())
+    client = app.app.test_client()
+    assert 'X-Profile-Id' not in client.get('/fen/no-such-game').headers
+    profile_id = client.get('/fen/no-such-game?profile=1').headers['X-Profile-Id']
+    response = client.get('/profiles/%s' % profile_id)
+    assert response.status_code == 200 and response.mimetype == 'text/plain'
+
+
+def test_no_request_hooks_when_both_are_off():
+    env = dict(os.environ, CHESS_METRICS='0', CHESS_PROFILING='0')
+    code = ('import app; assert not app.app.before_request_funcs and not app.app.after_request_funcs; '
+            'assert app.app.test_client().get("/metrics").status_code == 404')
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, '-c', code], cwd=root, env=env, check=True)
+
+
+def test_sampling_profiler_sees_the_thread():
+    profiler = metrics.SamplingProfiler(interval=0.001).start()
+    total = 0
+    while not profiler.stacks:
+        total += sum(range(1000))
+    lines = profiler.stop().collapsed().splitlines()
+    assert any('test_sampling_profiler_sees_the_thread (test_metrics.py)' in line for line in lines)
+    assert all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
+
+
+def test_profile_store_keeps_the_latest():
+    store = metrics.ProfileStore(size=2)
+    first, second, third = store.add('a 1\n'), store.add('b 1\n'), store.add('c 1\n')
+    assert store.get(first) is None
+    assert (store.get(second), store.get(third)) == ('b 1\n', 'c 1\n')
@@ -0,0 +1,127 @@
+import pytest
+
+import app
+from bench import PERFT_POSITIONS
+from book import OPENING_LINES
+from position import Position
+from movegen import generate_legal
+from notation import (START_FEN, export_pgn, parse_pgn, split_pgn, move_to_san, parse_san, move_to_uci,
+                      parse_uci)
+
+FENS = [fen for _, fen, _ in PERFT_POSITIONS]
+
+
+@pytest.mark.parametrize('fen', FENS)
+def test_fen_round_trip(fen):
+    assert Position.from_fen(fen).to_fen() == fen
+
+
+@pytest.mark.parametrize('fen', [
+    '4k3/8/8/8/8/8/8/8 w - - 0 1',                      # No white king
+    '4k3/8/8/8/8/8/8/KK6 w - - 0 1',                    # Two white kings
+    'P3k3/8/8/8/8/8/8/4K3 w - - 0 1',                   # Pawn on the last rank
+    '4k3/8/8/8/8/8/8/4K2p b - - 0 1',                   # Pawn on the first rank
+    '4k3/4Q3/8/8/8/8/8/4K3 w - - 0 1',                  # Black in check with white to move
+    'rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq e3 0 2',  # En passant rank for the wrong side
+    'rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq d6 0 2',  # No pawn in front of it
+    '4k3/8/8/8/8/8/8/4K3 w - e4 0 1',
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR x KQkq - 0 1',
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP w KQkq - 0 1',
+    'rnbqkbnr/pppppppp/9/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq',
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - -5 1',       # Negative halfmove clock
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 2000000 1',  # Too large to undo
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 0',
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 -3',
+])
+def test_bad_fen(fen):
+    with pytest.raises(ValueError):
+        Position.from_fen(fen)
+
+
+def test_castling_rights_follow_the_pieces():
+    # No rook on h1, so no O-O, and no phantom rook after it
+    position = Position.from_fen('4k3/8/8/8/8/8/8/R3K3 w KQkq - 0 1')
+    assert position.to_fen() == '4k3/8/8/8/8/8/8/R3K3 w Q - 0 1'
+    assert 'O-O' not in [move_to_san(position, move) for move in generate_legal(position)]
+
+
+def test_start_game_rejects_a_bad_fen():
+    client = app.app.test_client()
+    response = client.post('/start_game', json={'game_id': 'bad fen', 'fen': '4k3/8/8/8/8/8/8/KK6 w - - 0 1'})
+    assert response.status_code == 400
+    response = client.post('/start_game', json={'game_id': 'no rook', 'fen': '4k3/8/8/8/8/8/8/R3K3 w K - 0 1'})
+    assert response.status_code == 200
+    assert response.json['fen'] == '4k3/8/8/8/8/8/8/R3K3 w - - 0 1'
+
+
+@pytest.mark.parametrize('data', [
+    {'fen': 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - -5 1'},
+    {'fen': 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 -1'},
+    {'pgn': '[FEN "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 2000000 1"]\n\n1. e4 *'},
+])
+def test_start_game_rejects_bad_move_counters(data):
+    response = app.app.test_client().post('/start_game', json=dict(data, game_id='counters'))
+    assert response.status_code == 400
+    assert response.json['error'] == 'Bad FEN move counters'
+
+
+@pytest.mark.parametrize('fen', FENS)
+def test_san_and_uci_round_trip(fen):
+    position = Position.from_fen(fen)
+    for move in generate_legal(position):
+        assert parse_san(position, move_to_san(position, move)) == move
+        assert parse_uci(position, move_to_uci(move)) == move
+
+
+def _play(line):
+    position = Position.initial()
+    moves = []
+    for san in line.split():
+        move = parse_san(position, san)
+        moves.append(move)
+        position.push(move)
+    return moves
+
+
+@pytest.mark.parametrize('line', OPENING_LINES[:8])
+def test_pgn_round_trip(line):
+    moves = _play(line)
+    text = export_pgn(START_FEN, moves, '1/2-1/2', {'White': 'A', 'Black': 'B'})
+    headers, start_fen, parsed, result = parse_pgn(text)
+    assert (start_fen, parsed, result) == (START_FEN, moves, '1/2-1/2')
+    assert headers['White'] == 'A' and headers['Black'] == 'B'
+
+
+def test_pgn_from_a_set_up_position():
+    fen = FENS[1]
+    position = Position.from_fen(fen)
+    moves = []
+    for _ in range(6):
+        move = generate_legal(position)[0]
+        moves.append(move)
+        position.push(move)
+    headers, start_fen, parsed, result = parse_pgn(export_pgn(fen, moves))
+    assert headers['FEN'] == fen and start_fen == fen
+    assert parsed == moves and result == '*'
+
+
+def test_pgn_skips_comments_and_variations():
+    text = '1. e4 {best by test} e5 (1... c5 2. Nf3) 2. Nf3 $1 Nc6 ; a comment\n3. Bb5 1-0'
+    _, _, moves, result = parse_pgn(text)
+    assert moves == _play('e4 e5 Nf3 Nc6 Bb5')
+    assert result == '1-0'
+
+
+def test_split_pgn():
+    games = [export_pgn(START_FEN, _play(line)) for line in OPENING_LINES[:3]]
+    assert [parse_pgn(text)[2] for text in split_pgn('\n'.join(games))] == [_play(line) for line in OPENING_LINES[:3]]
+
+
+def test_game_pgn_round_trip():
+    game = app.ChessGame()
+    for move in _play(OPENING_LINES[0]):
+        game.make_packed_move(move)
+    copy = app.ChessGame.from_pgn(game.get_pgn())
+    assert copy.get_fen() == game.get_fen()
+    assert list(copy.moves) == list(game.moves)
@@ -0,0 +1,34 @@
+import pytest
+
+from bench import PERFT_POSITIONS
+from position import Position
+from movegen import perft, generate_legal
+
+
+def _cases(max_nodes):
+    for name, fen, counts in PERFT_POSITIONS:
+        for depth, count in enumerate(counts, 1):
+            if depth >= 3 and count <= max_nodes:
+                yield pytest.param(fen, depth, count, id='%s-%d' % (name, depth))
+
+
+@pytest.mark.parametrize('fen, depth, count', list(_cases(200000)))
+def test_perft(fen, depth, count):
+    assert perft(Position.from_fen(fen), depth) == count
+
+
+@pytest.mark.parametrize('fen', [fen for _, fen, _ in PERFT_POSITIONS])
+def test_push_pop_restores_the_position(fen):
+    # Every move and its undo leave the position, its incremental hash and
+    # its evaluation sums as they were
+    position = Position.from_fen(fen)
+    before = (position.to_fen(), position.hash, position.mg, position.eg, position.phase)
+    for move in generate_legal(position):
+        position.push(move)
+        assert position.hash == position.compute_hash()
+        for reply in generate_legal(position):
+            position.push(reply)
+            assert position.hash == position.compute_hash()
+            position.pop()
+        position.pop()
+        assert (position.to_fen(), position.hash, position.mg, position.eg, position.phase) == before
@@ -0,0 +1,75 @@
+import pytest
+
+import app
+from search import SearchLimits, iterative_deepening
+from position import Position
+
+
+@pytest.fixture
+def client():
+    client = app.app.test_client()
+    # Out of the opening book, so the bot has to search
+    client.post('/start_game', json={'game_id': 'limits',
+                                     'fen': 'r1bq1rk1/pp2bppp/2n1pn2/2pp4/3P4/2PBPN2/PP1N1PPP/R2QK2R w KQ - 0 8'})
+    return client
+
+
+def test_defaults():
+    game = app.ChessGame()
+    time_ms, node_limit, max_depth, difficulty, _ = app._search_limits({}, game)
+    assert time_ms == app.BOT_TIME_MS
+    assert node_limit is None
+    assert max_depth == app.BOT_MAX_DEPTH
+    assert difficulty == game.difficulty
+
+
+def test_caps():
+    limits = app._search_limits({'time_ms': 10 ** 9, 'max_depth': 1000}, app.ChessGame())
+    assert limits[0] == app.BOT_MAX_TIME_MS
+    assert limits[2] == app.BOT_MAX_DEPTH
+
+
+@pytest.mark.parametrize('data', [
+    {'time_ms': 0},
+    {'time_ms': -5},
+    {'max_depth': 0},
+    {'max_depth': -1},
+    {'node_limit': -3},
+    {'node_limit': 'many'},
+    {'time_ms': None},
+    {'difficulty': 'impossible'},
+])
+def test_rejected(data):
+    with pytest.raises(ValueError):
+        app._search_limits(data, app.ChessGame())
+
+
+@pytest.mark.parametrize('data', [{'time_ms': 0}, {'max_depth': -1}, {'node_limit': -3}])
+def test_bad_limits_are_a_400(client, data):
+    for route in ('/bot_move', '/bot_jobs'):
+        response = client.post(route, json=dict(data, game_id='limits'))
+        assert response.status_code == 400
+        assert response.json['error'] == 'Invalid search limits'
+
+
+def test_node_limit_is_kept(client):
+    response = client.post('/bot_move', json={'game_id': 'limits', 'node_limit': 200, 'time_ms': 5000})
+    assert response.status_code == 200
+    assert 0 < response.json['search']['nodes'] <= 200
+
+
+def test_search_needs_a_budget():
+    with pytest.raises(ValueError):
+        iterative_deepening(Position.initial(), None, None)
+    with pytest.raises(ValueError):
+        SearchLimits(0)
+    with pytest.raises(ValueError):
+        SearchLimits(None, -3)
+
+
+def test_request_difficulty_does_not_stick(client):
+    game = app.games.get('limits')
+    assert game.difficulty == 'hard'
+    response = client.post('/bot_move', json={'game_id': 'limits', 'difficulty': 'easy', 'node_limit': 100})
+    assert response.status_code == 200
+    assert game.difficulty == 'hard'
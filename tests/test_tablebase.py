@@ -0,0 +1,98 @@
+import os
+import random
+
+import pytest
+
+from position import Position
+from movegen import generate_legal, in_check
+from tablebase import DEFAULT_DIRECTORY, ILLEGAL, Tablebase
+
+pytestmark = pytest.mark.skipif(not os.path.exists(os.path.join(DEFAULT_DIRECTORY, 'KQvK.tbl')),
+                                reason='No tables (python tablebase.py generate)')
+
+
+@pytest.fixture(scope='module')
+def tablebase():
+    tablebase = Tablebase(DEFAULT_DIRECTORY)
+    yield tablebase
+    tablebase.close()
+
+
+def board_fen(placement, turn):
+    # FEN of {square: piece letter} with a8 = 0
+    ranks = []
+    for rank in range(8):
+        text, empty = '', 0
+        for square in range(rank * 8, rank * 8 + 8):
+            if square in placement:
+                text += (str(empty) if empty else '') + placement[square]
+                empty = 0
+            else:
+                empty += 1
+        ranks.append(text + (str(empty) if empty else ''))
+    return '%s %s - - 0 1' % ('/'.join(ranks), turn)
+
+
+def random_positions(count, seed=1):
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        piece = rng.choice('QRqr')
+        squares = rng.sample(range(64), 3)
+        placement = dict(zip(squares, ('K', 'k', piece)))
+        try:
+            positions.append(Position.from_fen(board_fen(placement, rng.choice('wb'))))
+        except ValueError:
+            pass  # Kings touching, or the side not to move in check
+    return positions
+
+
+def test_known_results(tablebase):
+    position = Position.from_fen('k7/8/1K6/8/8/8/7Q/8 w - - 0 1')
+    assert tablebase.probe(position) == 1
+    move, _ = tablebase.best_move(position)
+    position.push(move)
+    assert in_check(position, position.turn) and not generate_legal(position)
+    assert tablebase.probe(Position.from_fen('k7/2Q5/1K6/8/8/8/8/8 b - - 0 1')) == 0  # Stalemate
+    assert tablebase.probe(Position.from_fen('k7/1Q6/1K6/8/8/8/8/8 b - - 0 1')) == 2  # Mated
+    assert tablebase.probe(Position.from_fen('k7/8/8/8/8/8/6q1/7K w - - 0 1')) == 0  # The queen hangs
+    assert tablebase.probe(Position.from_fen('8/8/8/3k4/8/8/8/K6R w - - 0 1')) is not None
+
+
+def test_results_agree_with_the_moves(tablebase):
+    # Each result follows from the results after every legal move: a win in
+    # n plies has a move to a loss in n - 1, a loss has only moves to wins,
+    # the slowest of them in n - 1, and a draw has a move to a draw but none
+    # to a loss
+    for position in random_positions(300):
+        value = tablebase.probe(position)
+        assert value not in (None, ILLEGAL), position.to_fen()
+        children = []
+        for move in generate_legal(position):
+            position.push(move)
+            children.append(tablebase.probe(position))
+            position.pop()
+        fen = position.to_fen()
+        if not children:
+            assert value == (2 if in_check(position, position.turn) else 0), fen
+        elif value & 1:
+            assert value == min(child for child in children if child and not child & 1) - 1, fen
+        elif value:
+            assert all(child & 1 for child in children), fen
+            assert value - 2 == max(children) + 1, fen
+        else:
+            assert 0 in children and not any(child and not child & 1 for child in children), fen
+
+
+def test_symmetries_agree(tablebase):
+    # Mirroring the board left to right, or swapping the colours and the
+    # side to move, keeps the result
+    for position in random_positions(200, seed=2):
+        value = tablebase.probe(position)
+        fen = position.to_fen()
+        board, turn = fen.split()[:2]
+        ranks = board.split('/')
+        mirrored = '/'.join(rank[::-1] for rank in ranks)
+        swapped = '/'.join(reversed(ranks)).swapcase()
+        assert tablebase.probe(Position.from_fen('%s %s - - 0 1' % (mirrored, turn))) == value, fen
+        assert tablebase.probe(Position.from_fen('%s %s - - 0 1' % (swapped, 'wb'[turn == 'w']))) == value, fen
@@ -0,0 +1,43 @@
+import json
+import math
+import os
+import subprocess
+import sys
+
+import tournament
+
+
+def test_tools_do_not_import_the_app():
+    # Tournament and benchmark workers only need the game, not the web app's
+    # game store, bot pool and metrics
+    code = 'import sys, tournament, bench; print("app" in sys.modules or "flask" in sys.modules)'
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(tournament.__file__))).stdout
+    assert output.strip() == 'False'
+
+
+def test_elo_of_a_clean_sweep():
+    stats = tournament.match_stats(4, 0, 0)
+    assert stats['score'] == 1 and stats['elo'] == math.inf
+    assert tournament.match_stats(0, 0, 4)['elo'] == -math.inf
+    assert math.isfinite(tournament.match_stats(2, 1, 1)['elo'])
+
+
+def not_json(name):
+    raise AssertionError('%s in the JSON output' % name)
+
+
+def test_json_has_no_infinity(tmp_path, monkeypatch):
+    def first_engine_wins(index, opening, white, black, max_plies, pgn):
+        return {'index': index, 'white': white['name'], 'black': black['name'],
+                'result': '1-0' if white['name'] == 'engine1' else '0-1', 'reason': 'checkmate', 'plies': 3,
+                'stats': {white['name']: {'moves': 2, 'nodes': 10, 'time_ms': 1.0},
+                          black['name']: {'moves': 1, 'nodes': 5, 'time_ms': 1.0}},
+                'pgn': None}
+
+    monkeypatch.setattr(tournament, 'play_game', first_engine_wins)
+    path = tmp_path / 'match.json'
+    assert tournament.main(['--workers', '0', '--games', '2', '--nodes', '100', '--quiet', '--json', str(path),
+                            '--engine', 'name=engine1', '--engine', 'name=engine2']) == 0
+    summary = json.loads(path.read_text(), parse_constant=not_json)
+    assert summary['wins'] == 2 and summary['elo'] is None and summary['elo_margin'] is None
@@ -0,0 +1,333 @@
+# Self-play matches between two bot configurations, for telling whether a
+# change makes the bot stronger or faster before it goes live.
+#
+#   python tournament.py --games 200 --time-ms 100
+#   python tournament.py --engine name=new,difficulty=hard --engine name=old,difficulty=easy \
+#       --nodes 20000 --sprt 0 10 --workers 4 --pgn games.pgn
+#
+# An engine is a list of key=value settings: name, difficulty (the
+# evaluation tables), time_ms, node_limit, max_depth, tt_size and search,
+# the module whose iterative_deepening() it searches with. Copy search.py
+# to search_old.py before changing it and play search=search_old against
+# the new search to compare the two. Settings not given come from
+# --time-ms, --nodes, --depth and --tt-size.
+#
+# Games start from the opening positions (the first few moves of the book
+# lines by default, or the FENs of an --openings file), each played twice
+# with the colours swapped, and run in parallel worker processes. Each side
+# gets a fresh transposition table every game. A game ends as ChessGame
+# decides, with repetitions and the fifty-move rule as draws, or as a draw
+# after --max-plies. Results are from the first engine's point of view.
+#
+# With --sprt ELO0 ELO1 the match stops as soon as the sequential
+# probability ratio test accepts one of the hypotheses: "the first engine
+# is ELO0 stronger" or "it is ELO1 stronger".
+
+import argparse
+import importlib
+import json
+import math
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from chess_game import ChessGame
+from position import Position, WHITE
+from notation import parse_san
+from transposition import TranspositionTable
+from evaluate import DIFFICULTY_TABLES, DEFAULT_DIFFICULTY
+from book import OPENING_LINES
+from tablebase import open_tablebase
+
+ENGINE_SETTINGS = {'name': str, 'difficulty': str, 'time_ms': int, 'node_limit': int, 'max_depth': int,
+                   'tt_size': int, 'search': str}
+
+_tablebase = None
+
+
+def _init_worker(tablebase_path=None):
+    global _tablebase
+    _tablebase = open_tablebase(tablebase_path)
+
+
+def parse_engine(text, defaults):
+    # Engine settings from 'key=value,...'; raises ValueError
+    engine = dict(defaults)
+    for setting in filter(None, text.split(',')):
+        key, _, value = setting.partition('=')
+        key = key.strip()
+        if key not in ENGINE_SETTINGS or not value:
+            raise ValueError('Bad engine setting: ' + setting)
+        engine[key] = ENGINE_SETTINGS[key](value.strip())
+    if engine['difficulty'] not in DIFFICULTY_TABLES:
+        raise ValueError('Unknown difficulty: ' + engine['difficulty'])
+    if any(engine[key] is not None and engine[key] < 0 for key in ('time_ms', 'node_limit', 'max_depth')):
+        raise ValueError('Engine %s has a negative limit' % engine['name'])
+    if not engine['time_ms'] and not engine['node_limit']:
+        raise ValueError('Engine %s needs a time or node limit' % engine['name'])
+    return engine
+
+
+def book_openings(plies):
+    # Positions after the first plies moves of each book line, without repeats
+    openings = []
+    for line in OPENING_LINES:
+        position = Position.initial()
+        for san in line.split()[:plies]:
+            position.push(parse_san(position, san))
+        fen = position.to_fen()
+        if fen not in openings:
+            openings.append(fen)
+    return openings
+
+
+def play_game(index, opening, white, black, max_plies, pgn=False):
+    # Runs in a worker: one game between two engines from the opening FEN
+    searches = {engine['name']: importlib.import_module(engine['search']).iterative_deepening
+                for engine in (white, black)}
+    tts = {engine['name']: TranspositionTable(engine['tt_size']) for engine in (white, black)}
+    stats = {white['name']: {'moves': 0, 'nodes': 0, 'time_ms': 0.0},
+             black['name']: {'moves': 0, 'nodes': 0, 'time_ms': 0.0}}
+    game = ChessGame(fen=opening)
+    reason = None
+    while not game.game_over:
+        if len(game.moves) >= max_plies:
+            reason = 'move limit'
+            break
+        engine = white if game.position.turn == WHITE else black
+        name = engine['name']
+        result = searches[name](game.position.copy(), engine['time_ms'], engine['node_limit'],
+                                engine['max_depth'], tts[name], DIFFICULTY_TABLES[engine['difficulty']],
+                                tablebase=_tablebase)
+        if result['move'] is None or not game.make_packed_move(result['move']):
+            raise RuntimeError('%s played an illegal move in %s' % (name, game.get_fen()))
+        side = stats[name]
+        side['moves'] += 1
+        side['nodes'] += result['nodes']
+        side['time_ms'] += result['time_ms']
+    outcome = game.result() if reason is None else '1/2-1/2'
+    return {
+        'index': index,
+        'opening': opening,
+        'white': white['name'],
+        'black': black['name'],
+        'result': outcome,
+        'reason': reason or game.end_reason,
+        'plies': len(game.moves),
+        'stats': stats,
+        'pgn': game.get_pgn({'Event': 'Self-play', 'Round': index + 1, 'White': white['name'],
+                             'Black': black['name']}) if pgn else None,
+    }
+
+
+def elo(score):
+    # Elo difference that an expected score of score means
+    if score <= 0:
+        return -math.inf
+    if score >= 1:
+        return math.inf
+    return -400.0 * math.log10(1.0 / score - 1.0)
+
+
+def expected_score(elo_difference):
+    return 1.0 / (1.0 + 10.0 ** (-elo_difference / 400.0))
+
+
+def match_stats(wins, draws, losses):
+    # Score, Elo and its 95% margin for a win/draw/loss record
+    games = wins + draws + losses
+    if not games:
+        return {'games': 0, 'score': None, 'elo': None, 'elo_margin': None}
+    score = (wins + draws / 2.0) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    margin = 1.96 * math.sqrt(variance / games)
+    low, high = elo(score - margin), elo(score + margin)
+    return {
+        'games': games,
+        'score': score,
+        'elo': elo(score),
+        'elo_margin': (high - low) / 2 if math.isfinite(low) and math.isfinite(high) else math.inf,
+    }
+
+
+def sprt(wins, draws, losses, elo0, elo1, alpha=0.05, beta=0.05):
+    # Log-likelihood ratio of "elo1 stronger" over "elo0 stronger", in the
+    # normal approximation of the score, with the bounds that decide it
+    lower = math.log(beta / (1 - alpha))
+    upper = math.log((1 - beta) / alpha)
+    games = wins + draws + losses
+    llr = 0.0
+    if games:
+        score = (wins + draws / 2.0) / games
+        variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+        if variance > 0:
+            s0, s1 = expected_score(elo0), expected_score(elo1)
+            llr = games * (s1 - s0) * (2 * score - s0 - s1) / (2 * variance)
+    decision = 'H1' if llr >= upper else 'H0' if llr <= lower else None
+    return {'elo0': elo0, 'elo1': elo1, 'llr': llr, 'lower': lower, 'upper': upper, 'decision': decision}
+
+
+def run_match(first, second, openings, games, workers, max_plies, tablebase_path=None, sprt_bounds=None,
+              pgn=False, log=print):
+    # Plays the match and returns its summary
+    schedule = []
+    for index in range(games):
+        opening = openings[index // 2 % len(openings)]
+        white, black = (first, second) if index % 2 == 0 else (second, first)
+        schedule.append((index, opening, white, black, max_plies, pgn))
+
+    record = {'wins': 0, 'draws': 0, 'losses': 0}
+    totals = {first['name']: {'moves': 0, 'nodes': 0, 'time_ms': 0.0},
+              second['name']: {'moves': 0, 'nodes': 0, 'time_ms': 0.0}}
+    finished = []
+    test = None
+    start = time.perf_counter()
+
+    def game_done(game):
+        finished.append(game)
+        if game['result'] == '1/2-1/2':
+            record['draws'] += 1
+        elif (game['result'] == '1-0') == (game['white'] == first['name']):
+            record['wins'] += 1
+        else:
+            record['losses'] += 1
+        for name, side in game['stats'].items():
+            for key in side:
+                totals[name][key] += side[key]
+        log('game %d/%d  %s - %s  %s  %s, %d plies   +%d =%d -%d' % (
+            len(finished), games, game['white'], game['black'], game['result'], game['reason'], game['plies'],
+            record['wins'], record['draws'], record['losses']))
+        if sprt_bounds:
+            return sprt(record['wins'], record['draws'], record['losses'], *sprt_bounds)
+        return None
+
+    if workers:
+        executor = ProcessPoolExecutor(workers, multiprocessing.get_context('spawn'),
+                                       initializer=_init_worker, initargs=(tablebase_path,))
+        try:
+            futures = [executor.submit(play_game, *entry) for entry in schedule]
+            for future in as_completed(futures):
+                test = game_done(future.result())
+                if test and test['decision']:
+                    break
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+    else:
+        _init_worker(tablebase_path)
+        for entry in schedule:
+            test = game_done(play_game(*entry))
+            if test and test['decision']:
+                break
+
+    summary = match_stats(record['wins'], record['draws'], record['losses'])
+    summary.update(record)
+    summary['engines'] = [first, second]
+    summary['sprt'] = test
+    summary['seconds'] = round(time.perf_counter() - start, 1)
+    summary['speed'] = {name: {
+        'nps': round(side['nodes'] * 1000.0 / side['time_ms']) if side['time_ms'] else 0,
+        'ms_per_move': round(side['time_ms'] / side['moves'], 1) if side['moves'] else 0,
+        'moves': side['moves'],
+    } for name, side in totals.items()}
+    summary['games_played'] = sorted(finished, key=lambda game: game['index'])
+    return summary
+
+
+def report(summary, log=print):
+    first, second = (engine['name'] for engine in summary['engines'])
+    log('')
+    if not summary['games']:
+        log('No games played')
+        return
+    log('%s vs %s: +%d =%d -%d  score %.1f%%  Elo %+.1f +/- %.1f' % (
+        first, second, summary['wins'], summary['draws'], summary['losses'], summary['score'] * 100,
+        summary['elo'], summary['elo_margin']))
+    test = summary['sprt']
+    if test:
+        verdict = {'H1': '%s is at least %g Elo stronger' % (first, test['elo1']),
+                   'H0': '%s is not %g Elo stronger' % (first, test['elo1'])}.get(test['decision'], 'undecided')
+        log('SPRT [%g, %g]: LLR %.2f (%.2f, %.2f)  %s' % (test['elo0'], test['elo1'], test['llr'], test['lower'],
+                                                          test['upper'], verdict))
+    for name, speed in summary['speed'].items():
+        log('%-16s %10d nodes/s  %8.1f ms/move  %6d moves' % (name, speed['nps'], speed['ms_per_move'],
+                                                              speed['moves']))
+    log('%d games in %.1f s' % (summary['games'], summary['seconds']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bot-vs-bot self-play match')
+    parser.add_argument('--engine', action='append', default=[],
+                        help='key=value,... settings of an engine; give it twice (default: hard vs easy)')
+    parser.add_argument('--games', type=int, default=100, help='games to play, rounded up to pairs (default 100)')
+    parser.add_argument('--time-ms', type=int, default=100, help='time per move (default 100)')
+    parser.add_argument('--nodes', type=int, default=None, help='nodes per move instead of a time')
+    parser.add_argument('--depth', type=int, default=64, help='deepest iteration (default 64)')
+    parser.add_argument('--tt-size', type=int, default=1 << 16, help='transposition table entries (default 65536)')
+    parser.add_argument('--openings', help='file of opening FENs, one per line (default: the book lines)')
+    parser.add_argument('--opening-plies', type=int, default=6,
+                        help='book moves played before a game starts (default 6)')
+    parser.add_argument('--max-plies', type=int, default=300, help='draw games longer than this (default 300)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='game processes, 0 to play in this one (default: one per CPU)')
+    parser.add_argument('--tablebases', help='tablebase directory for both engines (default: none)')
+    parser.add_argument('--sprt', nargs=2, type=float, metavar=('ELO0', 'ELO1'),
+                        help='stop once the SPRT between these Elo differences decides')
+    parser.add_argument('--pgn', help='write the games to this file')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--quiet', action='store_true', help='no per-game progress output')
+    args = parser.parse_args(argv)
+
+    def log(line):
+        if not args.quiet:
+            print(line)
+
+    defaults = {'name': None, 'difficulty': DEFAULT_DIFFICULTY, 'time_ms': 0 if args.nodes else args.time_ms,
+                'node_limit': args.nodes, 'max_depth': args.depth, 'tt_size': args.tt_size, 'search': 'search'}
+    specs = args.engine or ['name=hard,difficulty=hard', 'name=easy,difficulty=easy']
+    if len(specs) != 2:
+        parser.error('give --engine twice, or not at all')
+    try:
+        engines = [parse_engine(spec, dict(defaults, name='engine%d' % (number + 1)))
+                   for number, spec in enumerate(specs)]
+    except ValueError as e:
+        parser.error(str(e))
+    if engines[0]['name'] == engines[1]['name']:
+        parser.error('the engines need different names')
+
+    if args.openings:
+        with open(args.openings) as f:
+            openings = [line.strip() for line in f if line.strip()]
+    else:
+        openings = book_openings(args.opening_plies)
+    for fen in openings:
+        try:
+            Position.from_fen(fen)
+        except ValueError as e:
+            parser.error('bad opening %r: %s' % (fen, e))
+    if not openings:
+        parser.error('no opening positions')
+
+    games = max(2, args.games + args.games % 2)
+    summary = run_match(engines[0], engines[1], openings, games, args.workers, args.max_plies, args.tablebases,
+                        args.sprt, bool(args.pgn), log)
+    report(summary)
+
+    if args.pgn:
+        with open(args.pgn, 'w') as f:
+            f.write('\n'.join(game['pgn'] for game in summary['games_played']))
+    if args.json:
+        for game in summary['games_played']:
+            game.pop('pgn')
+        # JSON has no infinity: the Elo of a 100% or 0% score is written as null
+        for key in ('elo', 'elo_margin'):
+            if summary[key] is not None and not math.isfinite(summary[key]):
+                summary[key] = None
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
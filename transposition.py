@@ -0,0 +1,100 @@
+# Fixed-size transposition table for the bot search.
+#
+# Entries live in two flat arrays of 64-bit words so the table costs a fixed
+# 16 bytes per slot however long it is used. The data word packs:
+#   bits 0-31  score + 2**31
+#   bits 32-47 best move (start | end << 6 | promotion << 12)
+#   bits 48-55 search depth
+#   bits 56-57 bound type
+#   bits 58-63 search generation, so entries from old searches get replaced
+# The key word holds the position hash XOR the data word. When processes
+# share a table, an entry half-written by one of them then reads as a miss
+# rather than as another position's data.
+
+from array import array
+from multiprocessing import shared_memory
+
+EXACT, LOWER, UPPER = 1, 2, 3  # Bound types (0 marks an empty slot)
+
+SCORE_OFFSET = 1 << 31
+
+
+class TranspositionTable:
+    def __init__(self, size=1 << 16, buffer=None):
+        # size is rounded down to a power of two entries; buffer, if given,
+        # is 16 bytes per entry of memory to keep the table in
+        size = max(1, size)
+        self.size = 1 << (size.bit_length() - 1)
+        self.mask = self.size - 1
+        self.buffer = buffer
+        self._allocate()
+        self.generation = 0
+
+    def _allocate(self):
+        if self.buffer is None:
+            self.keys = array('Q', bytes(8 * self.size))
+            self.data = array('Q', bytes(8 * self.size))
+        else:
+            words = memoryview(self.buffer).cast('Q')
+            self.keys = words[:self.size]
+            self.data = words[self.size:2 * self.size]
+
+    def new_search(self):
+        self.generation = (self.generation + 1) & 63
+
+    def clear(self):
+        if self.buffer is None:
+            self._allocate()
+        else:
+            memoryview(self.buffer)[:16 * self.size] = bytes(16 * self.size)
+        self.generation = 0
+
+    def probe(self, key):
+        # Returns (score, depth, bound, move) or None
+        index = key & self.mask
+        data = self.data[index]
+        if not data or self.keys[index] ^ data != key:
+            return None
+        return ((data & 0xFFFFFFFF) - SCORE_OFFSET, data >> 48 & 0xFF, data >> 56 & 3, data >> 32 & 0xFFFF)
+
+    def store(self, key, score, depth, bound, move):
+        # Depth-preferred: keep a deeper entry from the current search unless
+        # it is for the same position
+        index = key & self.mask
+        data = self.data[index]
+        same = self.keys[index] ^ data == key
+        if data and not same and data >> 58 == self.generation and data >> 48 & 0xFF > depth:
+            return
+        if not move and same:
+            move = data >> 32 & 0xFFFF  # Keep the old best move
+        data = ((score + SCORE_OFFSET) | (move or 0) << 32 | depth << 48
+                | bound << 56 | self.generation << 58)
+        self.keys[index] = key ^ data
+        self.data[index] = data
+
+
+class SharedTranspositionTable(TranspositionTable):
+    # A table in a multiprocessing.shared_memory block, so the processes of
+    # a parallel search all read and fill the same entries. The creator
+    # passes no name; other processes attach with the creator's name and
+    # size. The generation is not shared: each search sets it explicitly.
+    def __init__(self, size=1 << 16, name=None):
+        size = 1 << (max(1, size).bit_length() - 1)
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=16 * size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.owner = name is None
+        TranspositionTable.__init__(self, size, self.shm.buf)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def close(self):
+        # The creator's close() also frees the memory
+        self.keys.release()
+        self.data.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,12 @@
+# Zobrist keys for hashing positions. The generator is seeded so hashes are
+# stable across processes and restarts.
+
+import random
+
+_random = random.Random(20240917)
+
+# PIECE_KEYS[piece code][square]; codes 0 and 7 are unused
+PIECE_KEYS = [[_random.getrandbits(64) for _ in range(64)] for _ in range(16)]
+CASTLING_KEYS = [_random.getrandbits(64) for _ in range(16)]
+EP_FILE_KEYS = [_random.getrandbits(64) for _ in range(8)]
+BLACK_TO_MOVE_KEY = _random.getrandbits(64)